@@ -0,0 +1,234 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+Convert many repositories in one go, in a pool of processes.
+
+The conversion changes the working directory of the process (pushd
+before running rpmbuild), so the jobs run in processes, not threads.
+
+The jobs sharing a repo (e.g. c8 and c8s of a package) run one after
+the other, they would break each other's checkouts otherwise.
+"""
+import logging
+import os
+import tempfile
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import yaml
+
+from dist2src.core import Dist2Src
+from dist2src.metrics import StageTimings
+
+logger = logging.getLogger(__name__)
+
+
+class Job(NamedTuple):
+    dist_git: Path
+    source_git: Path
+    branch: str
+    # branch in the source-git repo, same as 'branch' if not set
+    dest_branch: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.dist_git}:{self.branch}"
+
+
+def read_manifest(path: Path) -> List[Job]:
+    """
+    Read the jobs from a YAML (or JSON) manifest, a list of:
+
+        - dist_git: rpms/acl
+          source_git: src/acl
+          branch: c8s
+          dest_branch: c8s  # optional
+
+    Relative paths are relative to the directory of the manifest.
+    """
+    entries = yaml.safe_load(path.read_text()) or []
+    if not isinstance(entries, list):
+        raise ValueError(f"{path}: a list of jobs expected")
+    jobs = []
+    for number, entry in enumerate(entries, start=1):
+        try:
+            jobs.append(
+                Job(
+                    dist_git=path.parent / entry["dist_git"],
+                    source_git=path.parent / entry["source_git"],
+                    branch=str(entry["branch"]),
+                    dest_branch=entry.get("dest_branch"),
+                )
+            )
+        except (KeyError, TypeError) as ex:
+            raise ValueError(f"{path}: job #{number} is invalid: {ex!r}") from ex
+    return jobs
+
+
+def group_by_repo(jobs: List[Job]) -> List[List[int]]:
+    """
+    indexes of the jobs, grouped so that the jobs which share
+    a dist-git or a source-git repo are in the same group
+    """
+    groups: List[List[int]] = []
+    # repo path: index of its group
+    group_of: Dict[Path, int] = {}
+    for index, job in enumerate(jobs):
+        paths = [job.dist_git.resolve(), job.source_git.resolve()]
+        found = sorted({group_of[path] for path in paths if path in group_of})
+        if not found:
+            groups.append([])
+            found = [len(groups) - 1]
+        target = found[0]
+        for other in found[1:]:
+            # the job joins two groups
+            groups[target].extend(groups[other])
+            groups[other] = []
+            for path, group in group_of.items():
+                if group == other:
+                    group_of[path] = target
+        groups[target].append(index)
+        groups[target].sort()
+        for path in paths:
+            group_of[path] = target
+    return [group for group in groups if group]
+
+
+def run_job(job: Job, workdir: Path, log_level: int = 1) -> Dict[str, Any]:
+    """
+    Convert a single repository, logging to 'workdir/convert.log' and
+    using 'workdir/tmp' for temporary files.
+
+    @return: result of the job for the report
+    """
+    tmp_dir = workdir / "tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    log_file = workdir / "convert.log"
+    handler = logging.FileHandler(log_file)
+    handler.setFormatter(
+        logging.Formatter("[%(asctime)s %(filename)s %(levelname)s] %(message)s")
+    )
+    dist2src_logger = logging.getLogger("dist2src")
+    dist2src_logger.addHandler(handler)
+    original_cwd = os.getcwd()
+    original_environ_tmpdir = os.environ.get("TMPDIR")
+    # child processes (rpmbuild, git) and tempfile pick up the job's directory
+    os.environ["TMPDIR"] = str(tmp_dir)
+    tempfile.tempdir = None
+
+    timings = StageTimings()
+    result = _result(job, log_file)
+    start = time.monotonic()
+    try:
+        job.source_git.mkdir(parents=True, exist_ok=True)
+        Dist2Src(
+            dist_git_path=job.dist_git,
+            source_git_path=job.source_git,
+            log_level=log_level,
+            timings=timings,
+        ).convert(job.branch, job.dest_branch or job.branch)
+    except Exception as ex:
+        logger.error(f"Converting {job.name} failed: {ex!r}")
+        dist2src_logger.debug(traceback.format_exc())
+        result.update(status="failed", error=repr(ex))
+    else:
+        result["status"] = "ok"
+    finally:
+        result["duration"] = time.monotonic() - start
+        result["stages"] = dict(timings.observed)
+        os.chdir(original_cwd)
+        if original_environ_tmpdir is None:
+            os.environ.pop("TMPDIR", None)
+        else:
+            os.environ["TMPDIR"] = original_environ_tmpdir
+        tempfile.tempdir = None
+        dist2src_logger.removeHandler(handler)
+        handler.close()
+    return result
+
+
+def run_jobs(
+    jobs: List[Job],
+    workdir: Path,
+    processes: int = 1,
+    log_level: int = 1,
+    on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Run the conversions, 'processes' at a time.
+
+    @param workdir: every job gets its own subdirectory here
+    @param processes: number of processes to use, 1 runs the jobs in this process
+    @param on_result: called with the number of finished jobs and the result
+                      of each job, as soon as it's finished
+    @return: report with the results of all the jobs, in the order of 'jobs'
+    """
+    start = time.monotonic()
+    workdirs = [
+        workdir / f"{index:05}-{job.dist_git.name}-{job.branch}"
+        for index, job in enumerate(jobs)
+    ]
+    results: List[Optional[Dict[str, Any]]] = [None] * len(jobs)
+    done = 0
+    for index, result in _results(jobs, workdirs, processes, log_level):
+        results[index] = result
+        done += 1
+        if on_result:
+            on_result(done, result)
+
+    return {
+        "jobs": len(jobs),
+        "succeeded": sum(r["status"] == "ok" for r in results),
+        "failed": sum(r["status"] != "ok" for r in results),
+        "duration": time.monotonic() - start,
+        "results": results,
+    }
+
+
+def _results(
+    jobs: List[Job], workdirs: List[Path], processes: int, log_level: int
+) -> Iterator:
+    """yield (index, result) of the jobs, as they are finished"""
+    if processes <= 1:
+        for index, (job, job_workdir) in enumerate(zip(jobs, workdirs)):
+            yield index, run_job(job, job_workdir, log_level)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        # future: (index of its job, the jobs of the group to run after it)
+        futures: Dict[Future, Tuple[int, List[int]]] = {}
+
+        def submit(group: List[int]):
+            index, rest = group[0], group[1:]
+            future = executor.submit(run_job, jobs[index], workdirs[index], log_level)
+            futures[future] = (index, rest)
+
+        for group in group_by_repo(jobs):
+            submit(group)
+        while futures:
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index, rest = futures.pop(future)
+                if rest:
+                    submit(rest)
+                try:
+                    yield index, future.result()
+                except Exception as ex:
+                    # the worker process died
+                    result = _result(jobs[index], workdirs[index] / "convert.log")
+                    result.update(
+                        status="failed", error=repr(ex), duration=None, stages={}
+                    )
+                    yield index, result
+
+
+def _result(job: Job, log_file: Path) -> Dict[str, Any]:
+    return {
+        "dist_git": str(job.dist_git),
+        "source_git": str(job.source_git),
+        "branch": job.branch,
+        "log": str(log_file),
+    }
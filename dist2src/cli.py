@@ -3,15 +3,25 @@
 # Copyright Contributors to the Packit project.
 # SPDX-License-Identifier: MIT
 
+"""
+The implementations of the subcommands (and packit, GitPython, ogr... they
+depend on) are imported only when a subcommand needs them, so that
+the CLI starts quickly. Keep it this way: tests/test_cli.py checks it.
+"""
 import functools
+import json
 import logging
+import os
 from pathlib import Path
+from typing import TYPE_CHECKING, Optional
 
 import click
 
-from dist2src.core import Dist2Src
 from dist2src.constants import START_TAG_TEMPLATE
-from dist2src.worker.updater import Updater
+
+if TYPE_CHECKING:
+    from dist2src.core import Dist2Src
+    from dist2src.profiling import Profiler
 
 logger = logging.getLogger(__name__)
 
@@ -31,8 +41,29 @@ VERBOSE_KEY = "VERBOSE"
     show_default=True,
     help="Print timestamps for log messages.",
 )
+@click.option(
+    "--metrics-file",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Write the metrics (e.g. duration of the conversion stages) to this file, "
+    "in the Prometheus text format.",
+)
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Profile the run: write a JSON timeline of the method calls and "
+    "external commands to this file, and a summary to PROFILE.txt.",
+)
+@click.option(
+    "--profile-dump",
+    type=click.Choice(["cprofile", "collapsed"]),
+    default=None,
+    help="With --profile, also write a cProfile dump (PROFILE.prof) or "
+    "collapsed stacks for flamegraphs (PROFILE.folded).",
+)
 @click.pass_context
-def cli(ctx, verbose, log_timestamps):
+def cli(ctx, verbose, log_timestamps, metrics_file, profile, profile_dump):
     """Script to convert the tip of a branch from a dist-git repository
     into a commit on a branch in a source-git repository.
 
@@ -87,6 +118,35 @@ def cli(ctx, verbose, log_timestamps):
 
     global_logger.addHandler(handler)
 
+    if metrics_file:
+        ctx.call_on_close(functools.partial(dump_metrics, metrics_file))
+
+    if profile:
+        from dist2src.core import Dist2Src, GitRepo
+        from dist2src.profiling import Profiler
+
+        profiler = Profiler(cprofile=profile_dump == "cprofile")
+        profiler.instrument(Dist2Src, GitRepo)
+        profiler.start()
+        ctx.call_on_close(
+            functools.partial(write_profile, profiler, Path(profile), profile_dump)
+        )
+
+
+def write_profile(profiler: "Profiler", path: Path, dump: Optional[str]):
+    profiler.stop()
+    profiler.write(path, dump=dump)
+    click.echo(profiler.summary(), err=True)
+
+
+def dump_metrics(path: str):
+    from prometheus_client import write_to_textfile
+
+    from dist2src.metrics import REGISTRY, observe_pending
+
+    observe_pending()
+    write_to_textfile(path, REGISTRY)
+
 
 def log_call(func):
     @functools.wraps(func)
@@ -101,6 +161,18 @@ def log_call(func):
     return wrapper
 
 
+def get_dist2src(
+    ctx, dist_git_path: Optional[str], source_git_path: Optional[str]
+) -> "Dist2Src":
+    from dist2src.core import Dist2Src
+
+    return Dist2Src(
+        dist_git_path=Path(dist_git_path) if dist_git_path else None,
+        source_git_path=Path(source_git_path) if source_git_path else None,
+        log_level=ctx.obj[VERBOSE_KEY],
+    )
+
+
 @cli.command()
 @click.argument("gitdir", type=click.Path(exists=True, file_okay=False))
 @log_call
@@ -113,9 +185,7 @@ def get_archive(ctx, gitdir: str):
     Set DIST2SRC_GET_SOURCES to the path to git_sources.sh, if it's not
     in the PATH.
     """
-    d2s = Dist2Src(
-        dist_git_path=Path(gitdir), source_git_path=None, log_level=ctx.obj[VERBOSE_KEY]
-    )
+    d2s = get_dist2src(ctx, gitdir, None)
     d2s.fetch_archive()
 
 
@@ -128,9 +198,7 @@ def run_prep(ctx, path: str):
 
     PATH needs to be a dist-git repository.
     """
-    d2s = Dist2Src(
-        dist_git_path=Path(path), source_git_path=None, log_level=ctx.obj[VERBOSE_KEY]
-    )
+    d2s = get_dist2src(ctx, path, None)
     d2s.run_prep()
 
 
@@ -148,9 +216,7 @@ def rebase_patches(ctx, gitdir: str, from_branch: str, to_branch: str):
 
     FROM_BRANCH is cleaned up (deleted).
     """
-    d2s = Dist2Src(
-        dist_git_path=None, source_git_path=Path(gitdir), log_level=ctx.obj[VERBOSE_KEY]
-    )
+    d2s = get_dist2src(ctx, None, gitdir)
     d2s.rebase_patches(from_branch, to_branch)
 
 
@@ -161,11 +227,7 @@ def rebase_patches(ctx, gitdir: str, from_branch: str, to_branch: str):
 @click.pass_context
 def copy_spec(ctx, origin: str, dest: str):
     """Copy 'SPECS/*.spec' from a dist-git repo to a source-git repo."""
-    d2s = Dist2Src(
-        dist_git_path=Path(origin),
-        source_git_path=Path(dest),
-        log_level=ctx.obj[VERBOSE_KEY],
-    )
+    d2s = get_dist2src(ctx, origin, dest)
     d2s.copy_spec()
 
 
@@ -176,11 +238,7 @@ def copy_spec(ctx, origin: str, dest: str):
 @click.pass_context
 def copy_all_sources(ctx, origin: str, dest: str):
     """Copy 'SOURCES/*' from a dist-git repo to a source-git repo."""
-    d2s = Dist2Src(
-        dist_git_path=Path(origin),
-        source_git_path=Path(dest),
-        log_level=ctx.obj[VERBOSE_KEY],
-    )
+    d2s = get_dist2src(ctx, origin, dest)
     d2s.copy_all_sources()
 
 
@@ -193,9 +251,7 @@ def add_packit_config(ctx, dest: str, branch: str):
     """
     Add packit config to the source-git repo and commit it.
     """
-    d2s = Dist2Src(
-        dist_git_path=None, source_git_path=Path(dest), log_level=ctx.obj[VERBOSE_KEY]
-    )
+    d2s = get_dist2src(ctx, None, dest)
     d2s.add_packit_config(
         upstream_ref=START_TAG_TEMPLATE.format(branch=branch), lookaside_branch=branch
     )
@@ -228,24 +284,102 @@ def convert(ctx, origin: str, dest: str):
     """
     origin_dir, origin_branch = origin.split(":")
     dest_dir, dest_branch = dest.split(":")
-    d2s = Dist2Src(
-        dist_git_path=Path(origin_dir),
-        source_git_path=Path(dest_dir),
+    d2s = get_dist2src(ctx, origin_dir, dest_dir)
+    d2s.convert(origin_branch, dest_branch)
+
+
+@cli.command("convert-many")
+@click.option(
+    "-j",
+    "--jobs",
+    "processes",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    show_default=True,
+    help="Number of conversions to run in parallel.",
+)
+@click.option(
+    "--workdir",
+    type=click.Path(file_okay=False),
+    default="convert-many",
+    show_default=True,
+    help="Directory for the logs and temporary files of the jobs.",
+)
+@click.option(
+    "--report",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Write the JSON report to this file instead of the standard output.",
+)
+@click.argument("manifest", type=click.Path(exists=True, dir_okay=False))
+@click.pass_context
+def convert_many(ctx, processes: int, workdir: str, report: Optional[str], manifest):
+    """Convert the repositories listed in MANIFEST, in parallel.
+
+    MANIFEST is a YAML (or JSON) list of jobs:
+
+        \b
+        - dist_git: rpms/acl
+          source_git: src/acl
+          branch: c8s
+
+    Paths are relative to the directory of MANIFEST. Every job logs to
+    its own directory in WORKDIR. Progress is printed to the standard error,
+    the report with the durations and failures at the end.
+
+    Exits with 1 if any of the conversions failed.
+    """
+    from dist2src.batch import read_manifest, run_jobs
+
+    jobs = read_manifest(Path(manifest))
+
+    def print_progress(done: int, result: dict):
+        click.echo(
+            f"[{done}/{len(jobs)}] {result['status']:6} "
+            f"{result['dist_git']}:{result['branch']} "
+            f"({result['duration'] or 0:.1f}s)",
+            err=True,
+        )
+
+    result = run_jobs(
+        jobs,
+        Path(workdir).absolute(),
+        processes=processes,
         log_level=ctx.obj[VERBOSE_KEY],
+        on_result=print_progress,
     )
-    d2s.convert(origin_branch, dest_branch)
+    output = json.dumps(result, indent=2)
+    if report:
+        Path(report).write_text(output + "\n")
+    else:
+        click.echo(output)
+    click.echo(
+        f"{result['succeeded']} succeeded, {result['failed']} failed "
+        f"in {result['duration']:.1f}s.",
+        err=True,
+    )
+    if result["failed"]:
+        ctx.exit(1)
 
 
 @cli.command()
+@click.option(
+    "--cursor",
+    default=None,
+    type=click.STRING,
+    help="Start checking from this page of projects (as logged by a previous run).",
+)
 @click.argument("project", required=False, default=None, type=click.STRING)
 @click.argument("branch", required=False, default=None, type=click.STRING)
-def check_updates(project, branch):
+def check_updates(cursor, project, branch):
     """
     Check if source-git repositories are up to date.
 
     Limit the search to PROJECT, and BRANCH, if specified.
     """
-    Updater().check_updates(project, branch)
+    from dist2src.worker.updater import Updater
+
+    Updater().check_updates(project, branch, cursor=cursor)
 
 
 if __name__ == "__main__":
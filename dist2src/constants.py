@@ -6,6 +6,14 @@ and emulates functionality... just kidding, it's just constants.
 """
 from typing import Iterable, Dict, Any, Tuple
 
+# where the sources of the packages are stored,
+# can be overridden with $DIST2SRC_LOOKASIDE_URL
+LOOKASIDE_URL = "https://git.centos.org/sources"
+
+# how many times bigger the sources get when %prep unpacks them into
+# a git repo, to estimate if they fit into $DIST2SRC_SCRATCH_DIR
+UNPACKED_SIZE_RATIO = 5
+
 # These packages have complex %prep's which cannot be turned
 # into a proper source-git repo - hence we just run the %prep
 # and initiate a single-commit repo for these.
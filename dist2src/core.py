@@ -2,17 +2,20 @@
 
 # Copyright Contributors to the Packit project.
 # SPDX-License-Identifier: MIT
+import functools
+import glob
+import hashlib
 import logging
 import os
 import re
 import shutil
 import subprocess
-from functools import lru_cache
+import tempfile
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Optional, Union, Set, Dict
+from typing import List, Iterator, Optional, Union, Set, Dict
 
 import git
-import requests
 import sh
 from git import GitCommandError
 from packit.config import get_local_package_config
@@ -26,8 +29,18 @@ from dist2src.constants import (
     START_TAG_TEMPLATE,
     TARGETS,
     HOOKS,
+    LOOKASIDE_URL,
+    UNPACKED_SIZE_RATIO,
     VERY_VERY_HARD_PACKAGES,
 )
+from dist2src.git_backend import get_backend
+from dist2src.git_snapshot import GitSnapshot, has_changes
+from dist2src.git_profile import config_env, get_profile
+from dist2src.journal import ConversionInterrupted, Journal, stop_on_signals
+from dist2src.metrics import StageTimings, timed_stage
+from dist2src.prep_analysis import get_prep_verdict
+from dist2src.sessions import get_session
+from dist2src.spec_cache import Patch, SpecCache, SpecMetadata
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +58,39 @@ def get_hook(package_name: str, hook_name: str) -> Optional[str]:
     return HOOKS.get(package_name, {}).get(hook_name, None)
 
 
+def read_lookaside_metadata(path: Path) -> Dict[str, str]:
+    """
+    read a .{package_name}.metadata file
+
+    @return: {path1: sha1, path2: sha3}
+    """
+    sources: Dict[str, str] = {}
+    for source_line in path.read_text().strip().split("\n"):
+        if not source_line:
+            # the metadata file can actually be empty for packages which don't have sources
+            #   e.g. hyperv-daemons, python-rpm-generators
+            continue
+        sha, source_path = source_line.split(" ")
+        sources[source_path] = sha
+    return sources
+
+
+# checksums in the metadata files, by their length
+CHECKSUM_ALGORITHMS = {32: "md5", 40: "sha1", 64: "sha256", 128: "sha512"}
+
+
+def checksum_matches(path: Path, checksum: str) -> bool:
+    """is 'path' a file with the 'checksum' (md5, sha1, sha256 or sha512)?"""
+    algorithm = CHECKSUM_ALGORITHMS.get(len(checksum))
+    if not algorithm or not path.is_file():
+        return False
+    hash_ = hashlib.new(algorithm)
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024**2), b""):
+            hash_.update(chunk)
+    return hash_.hexdigest() == checksum.lower()
+
+
 def get_build_dir(path: Path) -> Path:
     build_dirs = [d for d in (path / "BUILD").iterdir() if d.is_dir()]
     if len(build_dirs) > 1:
@@ -54,6 +100,19 @@ def get_build_dir(path: Path) -> Path:
     return build_dirs[0]
 
 
+def writes(method):
+    """a GitRepo method which changes the repo, invalidates the snapshot"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.invalidate()
+
+    return wrapper
+
+
 class GitRepo:
     """
     a wrapper on top of git.Repo for our convenience
@@ -70,6 +129,9 @@ class GitRepo:
             self.repo = git.Repo.init(repo_path)
         else:
             self.repo = git.Repo(repo_path)
+        # runs the git operations, in-process if possible, see dist2src.git_backend
+        self.backend = get_backend(self.repo) if self.repo else None
+        self._snapshot: Optional[GitSnapshot] = None
 
     def __str__(self):
         ref = None
@@ -84,19 +146,42 @@ class GitRepo:
         @param ref: the ref to check via repo.branches and remote[].refs
         @return: bool
         """
-        if ref in self.repo.branches:
-            return True
-        # .branches does not contain all remote refs = branches
-        # (Pdb) self.source_git.repo.branches
-        # [<git.Head "refs/heads/master">]
-        # (Pdb) self.source_git.repo.remotes["origin"].refs
-        # [<git.RemoteReference "refs/remotes/origin/HEAD">,
-        #  <git.RemoteReference "refs/remotes/origin/c8">,
-        #  <git.RemoteReference "refs/remotes/origin/master">]
-        if "origin" in self.repo.remotes:
-            return ref in self.repo.remotes["origin"].refs
-        return False
+        if self._snapshot:
+            return self._snapshot.has_ref(ref)
+        return self.backend.has_ref(ref)
+
+    @contextmanager
+    def snapshot(self) -> Iterator[GitSnapshot]:
+        """
+        answer the lookups (has_ref, get_tags_for_head, is_file_tracked,
+        is_dirty) in this block from an in-memory index of the repo,
+        see dist2src.git_snapshot
 
+        The methods of GitRepo invalidate it when they change the repo,
+        call invalidate() after changing it in any other way.
+        """
+        if self._snapshot:
+            # nested, use the outer one
+            yield self._snapshot
+            return
+        self._snapshot = GitSnapshot(self.repo)
+        try:
+            yield self._snapshot
+        finally:
+            self._snapshot = None
+
+    def invalidate(self):
+        """the repo was changed, the snapshot, if any, is not valid anymore"""
+        if self._snapshot:
+            self._snapshot.invalidate()
+
+    def is_dirty(self) -> bool:
+        """are there changes in the index or in the tracked files?"""
+        if self._snapshot:
+            return self._snapshot.is_dirty()
+        return has_changes(self.repo)
+
+    @writes
     def checkout(self, branch: str, orphan: bool = False, create_branch: bool = False):
         """
         Run `git checkout` in the git repo.
@@ -105,33 +190,24 @@ class GitRepo:
         @param orphan: Create a branch with disconnected history.
         @param create_branch: Create branch if it doesn't exist (using -B)
         """
-        if orphan:
-            self.repo.git.checkout("--orphan", branch)
-            # when creating an orphan branch, git preserves files in the index
-            # we don't want those, hush!
-            if self.repo.index.entries:
-                for entry in self.repo.index.entries:
-                    # entry = (path, stage number) -- see BaseIndexEntry.stage
-                    self.repo.index.remove(entry[0], working_tree=True, r=True, f=True)
-        elif create_branch:
-            self.repo.git.checkout("-B", branch)
-        else:
-            self.repo.git.checkout(branch, force=True)
+        self.backend.checkout(branch, orphan=orphan, create_branch=create_branch)
 
+    @writes
     def commit(self, message: str, body: Optional[str] = None):
         """Commit staged changes in GITDIR."""
-        other_message_kwargs = {"message": body} if body else {}
         # some of the commits may be empty and it's not an error,
         # e.g. extra source files
-        self.repo.git.commit(allow_empty=True, m=message, **other_message_kwargs)
+        self.backend.commit(message, body=body)
 
+    @writes
     def commit_all(self, message: str):
-        if self.repo.is_dirty():
+        if self.is_dirty():
             self.stage()
             self.commit(message=message)
         else:
             logger.info("The repo is not dirty, nothing to commit.")
 
+    @writes
     def fetch(self, remote: Union[str, Path], refspec: str):
         """
         fetch refs from a remote to this repo
@@ -141,25 +217,22 @@ class GitRepo:
         """
         self.repo.git.fetch(remote, refspec)
 
+    @writes
     def stage(self, add=None, rm=None, exclude=None):
         """stage content in the repo (git add)"""
-        if exclude:
-            exclude = f":(exclude){exclude}"
-            logger.debug(exclude)
-        if rm:
-            self.repo.git.rm(rm, "-f", exclude)
-        else:
-            self.repo.git.add(add or ".", "-f", exclude)
+        self.backend.stage(add=add, rm=rm, exclude=exclude)
 
+    @writes
     def create_tag(self, tag, branch):
         """Create a Git TAG at the tip of BRANCH"""
-        self.repo.create_tag(tag, ref=branch, force=True)
+        self.backend.create_tag(tag, branch)
 
     def get_tags_for_head(self) -> List[str]:
-        return list(
-            tag.name for tag in self.repo.tags if tag.commit == self.repo.head.commit
-        )
+        if self._snapshot:
+            return self._snapshot.get_tags_for_head()
+        return self.backend.get_tags_for_head()
 
+    @writes
     def cherry_pick_base(self, from_branch, to_branch, theirs=False):
         """Cherry-pick the first commit of a branch
 
@@ -177,7 +250,7 @@ class GitRepo:
             if theirs
             else {}
         )
-        if self.repo.is_dirty():
+        if self.is_dirty():
             raise RuntimeError(
                 "We wanted to cherry-pick the base commit but the source-git repo "
                 "is dirty when it shouldn't be."
@@ -195,7 +268,8 @@ class GitRepo:
                 self.stage(".")
                 # cherry-pick prompts an editor here
                 self.repo.git.cherry_pick("--continue")
-                if self.repo.is_dirty():
+                self.invalidate()
+                if self.is_dirty():
                     raise RuntimeError(
                         "We wanted to cherry-pick the base commit but the source-git repo "
                         "is dirty when it shouldn't be."
@@ -203,6 +277,7 @@ class GitRepo:
             else:
                 raise
 
+    @writes
     def revert_to_ref(
         self,
         ref,
@@ -219,18 +294,23 @@ class GitRepo:
         self.clean()  # `reset --hard HEAD` is not enough to clean untracked files
         # EOL normalization can still leave the repo in a dirty state.
         # Make sure these changes are part of the revert commit.
-        if self.repo.is_dirty():
+        if self.is_dirty():
             self.repo.git.add("--renormalize", ".")
             self.repo.git.commit("--amend", "--no-edit")
 
-    def clean(self):
+    @writes
+    def clean(self, keep: Optional[List[str]] = None):
         """
         Clean the repo.
+
+        @param keep: paths of untracked files which are not removed
         """
         # We need to use two `force` options
         # to remove the submodules/git repos as well.
-        self.repo.git.clean("-xdff")
+        excludes = [f"--exclude=/{glob.escape(path)}" for path in keep or []]
+        self.repo.git.clean("-xdff", *excludes)
 
+    @writes
     def fast_forward(self, branch, to_ref):
         self.checkout(branch)
         self.repo.git.merge(to_ref, ff_only=True)
@@ -243,12 +323,26 @@ class GitRepo:
         package_config = get_local_package_config(self.repo.working_dir)
         return package_config.upstream_ref
 
+    def set_environment(
+        self, env: Dict[str, Optional[str]]
+    ) -> Dict[str, Optional[str]]:
+        """
+        set environment variables for the git commands run in this repo
+
+        @param env: None unsets a variable
+        @return: the previous values, to restore them
+        """
+        if not self.repo:
+            return {}
+        previous = self.repo.git.update_environment(**env)
+        return {name: previous.get(name) for name in env}
+
     def is_file_tracked(self, path: str) -> bool:
-        try:
-            self.repo.git.ls_files("--error-unmatch", path)
-        except GitCommandError:
-            return False
-        return True
+        if self._snapshot:
+            tracked = self._snapshot.is_file_tracked(path)
+            if tracked is not None:
+                return tracked
+        return self.backend.is_file_tracked(path)
 
 
 class Dist2Src:
@@ -261,6 +355,11 @@ class Dist2Src:
         dist_git_path: Optional[Path],
         source_git_path: Optional[Path],
         log_level: int = 1,
+        timings: Optional[StageTimings] = None,
+        spec_cache: Optional[SpecCache] = None,
+        git_profile: Optional[Dict[str, str]] = None,
+        scratch_dir: Optional[Path] = None,
+        decompress_profile: Optional[str] = None,
     ):
         """
         both dist_git_path and source_git_path are optional because not all operations require both
@@ -269,6 +368,15 @@ class Dist2Src:
         @param source_git_path: path to a source-git repo (doesn't need to exist)
                                 where the conversion output will land
         @param log_level: int, 0 minimal output, 1 verbose, 2 debug
+        @param timings: collect the durations of the conversion stages here
+        @param spec_cache: cache of the parsed spec files, persisted in $DIST2SRC_CACHE_DIR
+        @param git_profile: git settings used during the conversion,
+                            see dist2src.git_profile for the default
+        @param scratch_dir: run %prep here (e.g. tmpfs) instead of in dist-git/BUILD,
+                            if the unpacked sources fit, $DIST2SRC_SCRATCH_DIR by default
+        @param decompress_profile: "parallel" to unpack the archives in %prep
+                                   with the parallel decompressors (macros.packit),
+                                   $DIST2SRC_DECOMPRESS_PROFILE or "default"
         """
         # we are using absolute paths since we do pushd below before running rpmbuild
         # and in that case relative paths no longer work
@@ -277,7 +385,18 @@ class Dist2Src:
         self.source_git_path = source_git_path.absolute() if source_git_path else None
         self.source_git = GitRepo(self.source_git_path, create=True)
         self.log_level = log_level
+        self.timings = timings or StageTimings()
+        self.spec_cache = spec_cache or SpecCache()
+        self.git_profile = get_profile() if git_profile is None else git_profile
+        scratch = scratch_dir or os.getenv("DIST2SRC_SCRATCH_DIR")
+        self.scratch_dir = Path(scratch) if scratch else None
+        self.decompress_profile = decompress_profile or os.getenv(
+            "DIST2SRC_DECOMPRESS_PROFILE", "default"
+        )
+        # checkpoints of the conversion, see convert()
+        self.journal: Optional[Journal] = None
         self._dist_git_spec = None
+        self._lookaside_sources: Optional[Dict[str, str]] = None
 
     @property
     def dist_git_spec(self):
@@ -291,10 +410,36 @@ class Dist2Src:
         )
         return self._dist_git_spec
 
-    # This method would run only once during the lifetime of the Dist2Src object and
-    # return the cached return value for subsequent calls to save compute
-    # since the file will not change.
-    @lru_cache()
+    @property
+    def spec_metadata(self) -> SpecMetadata:
+        """
+        sources, patches and %prep of the dist-git spec file in its current state,
+        parsed only if they are not in the spec cache yet
+        """
+        if not self.dist_git_path:
+            raise RuntimeError("dist_git_path not defined")
+        return self.spec_cache.get(
+            self.dist_git_path / self.relative_specfile_path,
+            self.dist_git_path / "SOURCES/",
+            self._parse_spec,
+        )
+
+    def _parse_spec(self) -> SpecMetadata:
+        # the spec file could have been changed since it was last read (checkout)
+        self._dist_git_spec = None
+        spec = self.dist_git_spec
+        return SpecMetadata(
+            sources=list(spec.get_sources()),
+            patches=[
+                Patch(number=x.index, name=x.get_patch_name(), path=str(x.path))
+                for x in spec.get_patches()
+            ],
+            prep=list(spec.spec_content.section("%prep") or []),
+        )
+
+    # This method would read the file only once during the conversion of a branch
+    # and return the cached value for subsequent calls to save compute
+    # since the file will not change (the cache is reset by convert()).
     def lookaside_sources(self) -> Dict[str, str]:
         """
         read .{package_name}.metadata and return a `Dict[path: sha]`
@@ -302,18 +447,47 @@ class Dist2Src:
 
         @return: {path1: sha1, path2: sha3}
         """
-        metadata_file_content = next(self.dist_git_path.glob(".*.metadata")).read_text()
-        source_lines = metadata_file_content.strip().split("\n")
-        sources: Dict[str, str] = {}
-        for source_line in source_lines:
-            if not source_line:
-                # the metadata file can actually be empty for packages which don't have sources
-                #   e.g. hyperv-daemons, python-rpm-generators
-                continue
-            sha, path = source_line.split(" ")
-            sources[path] = sha
+        if self._lookaside_sources is None:
+            metadata_file = next(self.dist_git_path.glob(".*.metadata"))
+            self._lookaside_sources = read_lookaside_metadata(metadata_file)
         # making sure the dict is unique and methods can't mutate it b/w each other
-        return sources.copy()
+        return self._lookaside_sources.copy()
+
+    @property
+    def downloaded_sources(self) -> List[str]:
+        """
+        paths of the lookaside sources of the checked-out dist-git branch
+        which are in the dist-git repo (not cached, the branch may be switched)
+        """
+        metadata_files = list(self.dist_git_path.glob(".*.metadata"))
+        if not metadata_files:
+            return []
+        return [
+            path
+            for path in read_lookaside_metadata(metadata_files[0])
+            if (self.dist_git_path / path).is_file()
+        ]
+
+    def sources_downloaded(self) -> bool:
+        """
+        are all the lookaside sources already in the dist-git repo,
+        e.g. downloaded for another branch, and do their checksums match?
+        """
+        if not any(self.dist_git_path.glob(".*.metadata")):
+            return False
+        sources = self.lookaside_sources()
+        return bool(sources) and all(
+            checksum_matches(self.dist_git_path / path, sha)
+            for path, sha in sources.items()
+        )
+
+    @property
+    def sources_size(self) -> int:
+        """total size in bytes of the downloaded lookaside sources"""
+        if not any(self.dist_git_path.glob(".*.metadata")):
+            return 0
+        paths = (self.dist_git_path / path for path in self.lookaside_sources())
+        return sum(path.stat().st_size for path in paths if path.is_file())
 
     @property
     def BUILD_repo_path(self) -> Path:
@@ -339,15 +513,22 @@ class Dist2Src:
     def relative_specfile_path(self):
         return f"SPECS/{self.package_name}.spec"
 
-    def fetch_archive(
-        self,
-        get_sources_script_path: str = os.getenv(
-            "DIST2SRC_GET_SOURCES", "get_sources.sh"
-        ),
-    ):
+    @timed_stage("fetch_archive")
+    def fetch_archive(self, get_sources_script_path: Optional[str] = None):
         """
         Fetch archive using get_sources.sh script in the dist-git repo.
+
+        @param get_sources_script_path: defaults to $DIST2SRC_GET_SOURCES
+                                        or get_sources.sh in PATH
         """
+        get_sources_script_path = get_sources_script_path or os.getenv(
+            "DIST2SRC_GET_SOURCES", "get_sources.sh"
+        )
+        if self.sources_downloaded():
+            logger.info("The lookaside sources are already downloaded.")
+            self.timings.size = self.sources_size
+            return
+
         command = sh.Command(get_sources_script_path)
 
         with sh.pushd(self.dist_git_path):
@@ -355,6 +536,7 @@ class Dist2Src:
             stdout = command()
 
         logger.debug(f"output = {stdout}")
+        self.timings.size = self.sources_size
 
     def _enforce_autosetup(self):
         """
@@ -378,21 +560,24 @@ class Dist2Src:
               %setup into %autosetup -N to be sure the .git repo is created correctly
               unless `-a -a` is used
         """
-        prep_lines = self.dist_git_spec.spec_content.section("%prep")
-
-        if not prep_lines:
+        cached_prep_lines = self.spec_metadata.prep
+        if not cached_prep_lines:
             # e.g. appstream-data does not have a %prep section
             return
+        if any(
+            line.startswith(("%autosetup", "%autopatch")) for line in cached_prep_lines
+        ):
+            logger.info("This package uses %autosetup or %autopatch.")
+            # cool, we're good, and there is no need to parse the spec file
+            return
+
+        prep_lines = self.dist_git_spec.spec_content.section("%prep")
 
         a_a_regex = re.compile(r"-a")
         # -T means to not unpack, it can actually be set e.g. like "-cT"
         cap_t_regex = re.compile(r"-[a-zA-Z]*T")
         for i, line in enumerate(prep_lines):
-            if line.startswith(("%autosetup", "%autopatch")):
-                logger.info("This package uses %autosetup or %autopatch.")
-                # cool, we're good
-                return
-            elif line.startswith("%setup"):
+            if line.startswith("%setup"):
                 if len(a_a_regex.findall(line)) >= 2:
                     logger.info(
                         "`%setup -aN -aM` detected, we cannot turn it to %autosetup"
@@ -413,6 +598,7 @@ class Dist2Src:
 
         self.dist_git_spec.save()
 
+    @timed_stage("run_prep")
     def run_prep(self, ensure_autosetup: bool = True):
         """
         run `rpmbuild -bp` in the dist-git repo to get a git-repo
@@ -423,13 +609,11 @@ class Dist2Src:
         rpmbuild = sh.Command("rpmbuild")
 
         with sh.pushd(self.dist_git_path):
-            BUILD_dir = Path("BUILD")
-            if BUILD_dir.is_dir():
-                # remove BUILD/ dir if it exists
-                # for single-commit repos, this is problem in case of a rebase
-                # there would be 2 directories which the get_build_dir() function
-                # would not handle
-                shutil.rmtree(BUILD_dir)
+            # remove BUILD/ dir if it exists
+            # for single-commit repos, this is problem in case of a rebase
+            # there would be 2 directories which the get_build_dir() function
+            # would not handle
+            self.remove_build_dir()
 
             cwd = Path.cwd()
             logger.debug(f"Running rpmbuild in {cwd}")
@@ -441,6 +625,16 @@ class Dist2Src:
                 f"_topdir {cwd}",
                 "-bp",
             ]
+            scratch_build_dir = self._make_scratch_build_dir()
+            if scratch_build_dir:
+                # BUILD/ points to it, so that the rest of the code, and the hooks,
+                # don't need to know where the sources were unpacked
+                Path("BUILD").symlink_to(scratch_build_dir, target_is_directory=True)
+                rpmbuild_args += ["--define", f"_builddir {scratch_build_dir}"]
+            rpmbuild_args += [
+                "--define",
+                f"_packit_decompress {self.decompress_profile}",
+            ]
             if self.log_level:  # -vv can be super-duper verbose
                 rpmbuild_args.append("-" + "v" * self.log_level)
             rpmbuild_args.append(str(specfile_path))
@@ -448,8 +642,18 @@ class Dist2Src:
             if ensure_autosetup:
                 self._enforce_autosetup()
 
+            # packitdecompress reports the time spent decompressing here
+            decompress_log_fd, decompress_log = tempfile.mkstemp(
+                prefix="decompress-", suffix=".log"
+            )
+            os.close(decompress_log_fd)
+            env = {
+                **os.environ,
+                **config_env(self.git_profile),
+                "PACKIT_DECOMPRESS_LOG": decompress_log,
+            }
             try:
-                running_cmd = rpmbuild(*rpmbuild_args)
+                running_cmd = rpmbuild(*rpmbuild_args, _env=env)
             except sh.ErrorReturnCode as e:
                 # This might create a tons of error logs.
                 # Create a child logger, so that it's possible to filter
@@ -460,8 +664,13 @@ class Dist2Src:
                 # Also log the failure using the main logger.
                 logger.error(f"{['rpmbuild', *rpmbuild_args]} failed")
                 raise
+            finally:
+                self._observe_decompression(Path(decompress_log))
 
             self.dist_git.repo.git.checkout(self.relative_specfile_path)
+            self.dist_git.invalidate()
+            # the spec file was changed by _enforce_autosetup and restored now
+            self._dist_git_spec = None
 
             logger.debug(f"rpmbuild stdout = {running_cmd}")  # this will print stdout
             logger.info(f"rpmbuild stderr = {running_cmd.stderr.decode()}")
@@ -471,6 +680,71 @@ class Dist2Src:
                 bash = sh.Command("bash")
                 bash("-c", hook_cmd)
 
+    def _observe_decompression(self, log: Path):
+        """
+        move the time spent by packitdecompress, as logged in 'log',
+        from the 'run_prep' stage to the 'decompress' stage, and remove the log
+
+        Never fails: it runs after rpmbuild, even when rpmbuild failed.
+        """
+        nanoseconds = 0
+        try:
+            lines = log.read_text(errors="replace").splitlines()
+            log.unlink()
+        except OSError as ex:
+            logger.warning(f"Unable to read the decompression log {log}: {ex!r}")
+            return
+        for line in lines:
+            try:
+                archive_format, tool, elapsed = line.split()
+                duration = int(elapsed)
+            except ValueError:
+                # e.g. packitdecompress was killed while writing it
+                logger.debug(f"Ignoring the malformed decompression log line {line!r}.")
+                continue
+            logger.debug(
+                f"A {archive_format} archive was decompressed by {tool} "
+                f"in {duration / 1e9:.3f}s."
+            )
+            nanoseconds += duration
+        if nanoseconds:
+            self.timings.add_nested("decompress", nanoseconds / 1e9, within="run_prep")
+
+    def _make_scratch_build_dir(self) -> Optional[Path]:
+        """
+        create a directory for %prep in the scratch dir
+
+        @return: None if there is no scratch dir or the unpacked sources
+                 wouldn't fit, %prep is run in dist-git/BUILD then
+        """
+        if not self.scratch_dir:
+            return None
+        needed = self.sources_size * UNPACKED_SIZE_RATIO
+        try:
+            free = shutil.disk_usage(self.scratch_dir).free
+        except OSError as ex:
+            logger.warning(f"Can't use the scratch dir {self.scratch_dir}: {ex}")
+            return None
+        if needed > free:
+            logger.info(
+                f"The unpacked sources (~{needed} B) wouldn't fit into "
+                f"{self.scratch_dir} ({free} B free), running %prep in dist-git."
+            )
+            return None
+        return Path(
+            tempfile.mkdtemp(prefix=f"{self.package_name}-", dir=self.scratch_dir)
+        )
+
+    def remove_build_dir(self):
+        """remove dist-git/BUILD, and the scratch dir it points to, if any"""
+        BUILD_dir = self.dist_git_path / "BUILD"
+        if BUILD_dir.is_symlink():
+            shutil.rmtree(BUILD_dir.resolve(), ignore_errors=True)
+            BUILD_dir.unlink()
+        elif BUILD_dir.is_dir():
+            shutil.rmtree(BUILD_dir)
+
+    @timed_stage("fetch_branch")
     def fetch_branch(self, source_branch: str, dest_branch: str):
         """Fetch the branch produced by 'rpmbuild -bp' from the dist-git
         repo to the source-git repo.
@@ -506,8 +780,118 @@ class Dist2Src:
     def perform_convert(
         self, origin_branch: str, dest_branch: str, source_git_tag: str
     ):
-        """Run all the steps to get a source-git repo from dist-git"""
+        """
+        Run all the steps to get a source-git repo from dist-git
+
+        The completed steps are recorded in the journal, a conversion
+        which was interrupted continues after the last one of them.
+        """
+        if not self.journal:
+            self.journal = self._open_journal(origin_branch, dest_branch)
         self.dist_git.checkout(branch=origin_branch)
+        # the lookups of a stage are answered by a single for-each-ref,
+        # ls-files or status, see GitRepo.snapshot()
+        with self.source_git.snapshot():
+            update = self._start_source_git_branch(dest_branch)
+
+        # expand dist-git and pull the history
+        fetched = self.journal.get("fetch_archive")
+        if fetched and all(
+            (self.dist_git_path / path).is_file() for path in fetched["sources"]
+        ):
+            logger.info("The sources are already downloaded.")
+        else:
+            self.fetch_archive()
+            self.journal.record("fetch_archive", sources=self.lookaside_sources())
+
+        prepped = self.journal.get("run_prep")
+        if prepped and self._BUILD_repo_commit() == prepped["commit"]:
+            logger.info("%prep already ran.")
+        else:
+            self.run_prep()
+            if not (self.BUILD_repo_path / ".git").is_dir():
+                raise RuntimeError(
+                    ".git repo not present in the BUILD/ dir after running %prep"
+                )
+            BUILD_repo = self._open_BUILD_repo()
+            # since this is not a patch, we want packit to ignore it
+            BUILD_repo.commit_all(message="Changes after running %prep\n\nignore: true")
+            self.journal.record("run_prep", commit=self._BUILD_repo_commit())
+
+        fetched_branch = self.journal.get("fetch_branch")
+        if not fetched_branch or fetched_branch["commit"] != self._source_git_commit(
+            TEMP_SG_BRANCH
+        ):
+            self.fetch_branch(source_branch="master", dest_branch=TEMP_SG_BRANCH)
+            self.journal.record(
+                "fetch_branch", commit=self._source_git_commit(TEMP_SG_BRANCH)
+            )
+
+        base = self.journal.get("cherry_pick_base")
+        if base:
+            self._reset_source_git(dest_branch, base["commit"])
+        else:
+            with self.timings.stage("cherry_pick_base"), self.source_git.snapshot():
+                self.source_git.cherry_pick_base(
+                    from_branch=TEMP_SG_BRANCH, to_branch=dest_branch, theirs=update
+                )
+            self.journal.record(
+                "cherry_pick_base", commit=self._source_git_commit(dest_branch)
+            )
+
+        added = self.journal.get("add_sources")
+        if added:
+            self._reset_source_git(dest_branch, added["commit"])
+        else:
+            # configure packit
+            self.add_packit_config(
+                upstream_ref=source_git_tag,
+                lookaside_branch=origin_branch,
+                commit=True,
+            )
+            self.copy_spec()
+            self.source_git.stage(add="SPECS")
+            self.source_git.commit(message="Add spec-file for the distribution")
+
+            self.remove_gitlab_ci_config()
+
+            self.copy_all_sources()
+            self.copy_conditional_patches()
+            self.source_git.stage(add="SPECS")
+            self.source_git.commit(message="Add sources defined in the spec file")
+
+            # mark the last upstream commit
+            self.source_git.create_tag(tag=source_git_tag, branch=dest_branch)
+            self.journal.record(
+                "add_sources", commit=self._source_git_commit(dest_branch)
+            )
+
+        # get all the patch-commits
+        self.rebase_patches(from_branch=TEMP_SG_BRANCH, to_branch=dest_branch)
+        self.journal.record("rebase_patches")
+
+    def _start_source_git_branch(self, dest_branch: str) -> bool:
+        """
+        check out the branch to convert to, as it was at the start
+        of the conversion
+
+        @return: whether the conversion updates an existing branch
+        """
+        started = self.journal.get("start")
+        if started:
+            self._abort_cherry_pick()
+            if started["commit"]:
+                self._reset_source_git(dest_branch, started["commit"])
+            else:
+                if self.source_git.has_ref(dest_branch):
+                    # created by the cherry-pick of the interrupted conversion
+                    self.source_git.repo.git.update_ref(
+                        "-d", f"refs/heads/{dest_branch}"
+                    )
+                    self.source_git.invalidate()
+                self.source_git.checkout(branch=dest_branch, orphan=True)
+            return started["update"]
+
         if self.source_git.repo.active_branch.name != dest_branch:
             if self.source_git.has_ref(dest_branch):
                 update = True
@@ -517,44 +901,46 @@ class Dist2Src:
                 self.source_git.checkout(branch=dest_branch, orphan=True)
         else:
             update = True
-
-        # expand dist-git and pull the history
-        self.fetch_archive()
-        self.run_prep()
-        if not (self.BUILD_repo_path / ".git").is_dir():
-            raise RuntimeError(
-                ".git repo not present in the BUILD/ dir after running %prep"
-            )
-        BUILD_repo = GitRepo(self.BUILD_repo_path)
-        # since this is not a patch, we want packit to ignore it
-        BUILD_repo.commit_all(message="Changes after running %prep\n\nignore: true")
-        self.fetch_branch(source_branch="master", dest_branch=TEMP_SG_BRANCH)
-        self.source_git.cherry_pick_base(
-            from_branch=TEMP_SG_BRANCH, to_branch=dest_branch, theirs=update
-        )
-
-        # configure packit
-        self.add_packit_config(
-            upstream_ref=source_git_tag,
-            lookaside_branch=origin_branch,
-            commit=True,
+        self.journal.record(
+            "start", update=update, commit=self._source_git_commit(dest_branch)
         )
-        self.copy_spec()
-        self.source_git.stage(add="SPECS")
-        self.source_git.commit(message="Add spec-file for the distribution")
-
-        self.remove_gitlab_ci_config()
+        return update
 
-        self.copy_all_sources()
-        self.copy_conditional_patches()
-        self.source_git.stage(add="SPECS")
-        self.source_git.commit(message="Add sources defined in the spec file")
+    def _source_git_commit(self, ref: str) -> Optional[str]:
+        """the commit 'ref' points to in the source-git repo, None if it does not exist"""
+        try:
+            return self.source_git.repo.git.rev_parse(
+                "--verify", "-q", f"{ref}^{{commit}}"
+            )
+        except GitCommandError:
+            return None
 
-        # mark the last upstream commit
-        self.source_git.create_tag(tag=source_git_tag, branch=dest_branch)
+    def _open_BUILD_repo(self) -> GitRepo:
+        """the repo created by %prep, git runs with the profile of the conversion"""
+        BUILD_repo = GitRepo(self.BUILD_repo_path)
+        BUILD_repo.set_environment(config_env(self.git_profile))
+        return BUILD_repo
 
-        # get all the patch-commits
-        self.rebase_patches(from_branch=TEMP_SG_BRANCH, to_branch=dest_branch)
+    def _BUILD_repo_commit(self) -> Optional[str]:
+        try:
+            return git.Repo(self.BUILD_repo_path).head.commit.hexsha
+        except Exception:
+            # no BUILD dir, no repo or no commit
+            return None
+
+    def _abort_cherry_pick(self):
+        """abort a cherry-pick an interrupted conversion left behind, if any"""
+        if (self.source_git_path / ".git" / "CHERRY_PICK_HEAD").exists():
+            logger.info("Aborting the cherry-pick of the interrupted conversion.")
+            self.source_git.repo.git.cherry_pick("--abort")
+            self.source_git.invalidate()
+
+    def _reset_source_git(self, branch: str, commit: str):
+        """reset 'branch' to 'commit', as recorded by a completed stage"""
+        self._abort_cherry_pick()
+        self.source_git.repo.git.checkout("-B", branch, commit, force=True)
+        self.source_git.invalidate()
+        self.source_git.clean()
 
     def convert(self, origin_branch: str, dest_branch: str):
         """
@@ -562,12 +948,67 @@ class Dist2Src:
         Update the source-git repo if it exists.
 
         This is the entrypoint method.
+
+        On SIGTERM, the conversion stops at the next checkpoint and
+        can be resumed by running it again. A failed one starts over.
+
+        The same Dist2Src can convert several branches, one after the other,
+        sharing the repos, the downloaded sources and the spec cache.
         """
-        if self.package_name in VERY_VERY_HARD_PACKAGES:
+        # the dist-git branch might have been switched since the last conversion
+        self._dist_git_spec = None
+        self._lookaside_sources = None
+        self.journal = self._open_journal(origin_branch, dest_branch)
+        env = config_env(self.git_profile)
+        previous_env = [
+            (repo, repo.set_environment(env))
+            for repo in (self.dist_git, self.source_git)
+        ]
+        try:
+            with stop_on_signals():
+                self._convert(origin_branch, dest_branch)
+            self.journal.clear()
+        except ConversionInterrupted:
+            raise
+        except Exception:
+            # resuming would most likely fail the same way, start over next time
+            self.journal.clear()
+            raise
+        finally:
+            # the repos might be pushed after this
+            for repo, previous in previous_env:
+                repo.set_environment(previous)
+            if (self.dist_git_path / "BUILD").is_symlink():
+                # don't keep the scratch space, a resumed conversion runs %prep again
+                self.remove_build_dir()
+            self.timings.observe()
+
+    def _open_journal(self, origin_branch: str, dest_branch: str) -> Journal:
+        try:
+            dist_git_commit = self.dist_git.repo.git.rev_parse(
+                "--verify", "-q", f"{origin_branch}^{{commit}}"
+            )
+        except GitCommandError:
+            # not checked out yet, only in the remote
+            dist_git_commit = self.dist_git.repo.git.rev_parse(
+                f"origin/{origin_branch}^{{commit}}"
+            )
+        return Journal(
+            self.source_git_path,
+            conversion={
+                "origin_branch": origin_branch,
+                "dest_branch": dest_branch,
+                "dist_git_commit": dist_git_commit,
+            },
+        )
+
+    def _convert(self, origin_branch: str, dest_branch: str):
+        if self.needs_single_commit(origin_branch, dest_branch):
             self.convert_single_commit(origin_branch, dest_branch)
-        elif self.source_git_path.exists() and self.source_git.has_ref(dest_branch):
+        elif self._is_update(dest_branch):
             logger.info(
-                "The source-git repository and branch exist. Updating existing source-git..."
+                "The source-git repository and branch exist. "
+                "Updating existing source-git..."
             )
             self.update_source_git(origin_branch, dest_branch)
         else:
@@ -577,6 +1018,71 @@ class Dist2Src:
                 START_TAG_TEMPLATE.format(branch=dest_branch),
             )
 
+    def _is_update(self, dest_branch: str) -> bool:
+        if self.journal.get("start") and not self.journal.get("revert_to_ref"):
+            # 'dest_branch' was created by the interrupted conversion
+            return False
+        return self.source_git_path.exists() and self.source_git.has_ref(dest_branch)
+
+    def needs_single_commit(
+        self, origin_branch: str, dest_branch: Optional[str] = None
+    ) -> bool:
+        """
+        Can't the package be converted commit by commit?
+        Analyze the %prep section of the spec file on the origin branch
+        to find out, unless the package is known to be hard or
+        the source-git branch exists already.
+
+        @param origin_branch: the dist-git branch to convert
+        @param dest_branch: the source-git branch, updates keep its strategy
+        """
+        if self.package_name in VERY_VERY_HARD_PACKAGES:
+            return True
+        single_commit = self._converted_as_single_commit(dest_branch)
+        if single_commit is not None:
+            return single_commit
+        try:
+            spec_content = self.dist_git.repo.git.show(
+                f"{origin_branch}:{self.relative_specfile_path}"
+            )
+        except GitCommandError as ex:
+            # e.g. the branch is not checked out yet, convert it commit by commit
+            logger.info(f"Unable to analyze the spec file: {ex}")
+            return False
+        verdict = get_prep_verdict(spec_content)
+        if verdict.single_commit:
+            logger.info(
+                f"{self.package_name} will be converted into a single commit: "
+                + "; ".join(verdict.reasons)
+            )
+        return verdict.single_commit
+
+    def _converted_as_single_commit(self, dest_branch: Optional[str]) -> Optional[bool]:
+        """
+        How was the existing source-git branch converted?
+
+        @param dest_branch: the source-git branch
+        @return: None if the branch was not converted yet
+        """
+        if not (
+            dest_branch
+            and self.source_git_path
+            and self.source_git_path.exists()
+            and self.source_git.has_ref(dest_branch)
+        ):
+            return None
+        try:
+            # the start tag marks the single commit or the commit with the sources
+            subject = self.source_git.repo.git.log(
+                "-1",
+                "--format=%s",
+                f"refs/tags/{START_TAG_TEMPLATE.format(branch=dest_branch)}",
+                "--",
+            )
+        except GitCommandError:
+            return None
+        return subject.startswith("Source-git repo for ")
+
     def move_prep_content(self):
         """
         For the single-commit source-git repos, we don't care about the
@@ -657,14 +1163,16 @@ class Dist2Src:
         @param branch: pick up a lookaside sources from this branch (e.g. c8 or c8s)
         """
         sources: List[Dict[str, str]] = []
+        lookaside_url = os.getenv("DIST2SRC_LOOKASIDE_URL", LOOKASIDE_URL)
+        session = get_session("lookaside")
         for path, sha in self.lookaside_sources().items():
-            url = f"https://git.centos.org/sources/{self.package_name}/{branch}/{sha}"
-            response = requests.head(url)
+            url = f"{lookaside_url}/{self.package_name}/{branch}/{sha}"
+            response = session.head(url)
             if response.status_code == 404:
                 # so it's c8 then
                 # ltrace, wireshark and more have this problem
-                url = f"https://git.centos.org/sources/{self.package_name}/c8/{sha}"
-                response = requests.head(url)
+                url = f"{lookaside_url}/{self.package_name}/c8/{sha}"
+                response = session.head(url)
             if not response.ok:
                 raise RuntimeError(
                     f"Source {url} does not exist - we can't locate the proper branch."
@@ -676,6 +1184,7 @@ class Dist2Src:
             sources.append({"url": url, "path": path})
         return sources
 
+    @timed_stage("add_packit_config")
     def add_packit_config(
         self, upstream_ref: str, lookaside_branch: str, commit: bool = False
     ):
@@ -726,6 +1235,7 @@ class Dist2Src:
             self.source_git.stage(add=".packit.yaml")
             self.source_git.commit(message=".packit.yaml")
 
+    @timed_stage("copy_all_sources")
     def copy_all_sources(self, with_patches: bool = False):
         """
         Copy 'SOURCES/*' from a dist-git repo to a source-git repo.
@@ -736,27 +1246,29 @@ class Dist2Src:
         sg_path = self.source_git_path / "SPECS"
         logger.info(f"Copy all sources from {dg_path} to {sg_path}.")
 
-        sources: List[str] = self.dist_git_spec.get_sources()[:]
+        sources: List[str] = self.spec_metadata.sources[:]
         lookaside_source_paths = self.lookaside_sources().keys()
         if with_patches:
-            sources += (x.path for x in self.dist_git_spec.get_patches())
-
-        for source in sources:
-            # sources are absolute paths as str, lookaside_paths are relative within the repo
-            relative = Path(source).relative_to(self.dist_git_path)
-            if str(relative) in lookaside_source_paths:
-                if self.dist_git.is_file_tracked(str(relative)):
-                    raise RuntimeError(
-                        f"File {relative} is stored in the lookaside cache and in git"
-                        ", which one should we use?"
+            sources += (x.path for x in self.spec_metadata.patches)
+
+        # a single `git ls-files` for all the sources
+        with self.dist_git.snapshot():
+            for source in sources:
+                # sources are absolute paths as str, lookaside_paths are relative within the repo
+                relative = Path(source).relative_to(self.dist_git_path)
+                if str(relative) in lookaside_source_paths:
+                    if self.dist_git.is_file_tracked(str(relative)):
+                        raise RuntimeError(
+                            f"File {relative} is stored in the lookaside cache and in git"
+                            ", which one should we use?"
+                        )
+                    logger.debug(
+                        f"Source {source} will be fetched from lookaside cache, skipping."
                     )
-                logger.debug(
-                    f"Source {source} will be fetched from lookaside cache, skipping."
-                )
-                continue
-            source_dest = sg_path / Path(source).name
-            logger.debug(f"copying {source} to {source_dest}")
-            shutil.copy2(source, source_dest)
+                    continue
+                source_dest = sg_path / Path(source).name
+                logger.debug(f"copying {source} to {source_dest}")
+                shutil.copy2(source, source_dest)
 
     def copy_conditional_patches(self):
         """
@@ -775,9 +1287,7 @@ class Dist2Src:
             if p.present_in_specfile:  # base commit doesn't have any metadata
                 patch_files_in_commits.add(p.name)
 
-        all_defined_patches = set(
-            x.get_patch_name() for x in self.dist_git_spec.get_patches()
-        )
+        all_defined_patches = set(x.name for x in self.spec_metadata.patches)
 
         for patch_name in all_defined_patches - patch_files_in_commits:
             file_src = self.dist_git_path / "SOURCES" / patch_name
@@ -799,6 +1309,7 @@ class Dist2Src:
             sg_spec,
         )
 
+    @timed_stage("rebase_patches")
     def rebase_patches(self, from_branch, to_branch):
         """Rebase FROM_BRANCH to TO_BRANCH
 
@@ -822,6 +1333,7 @@ class Dist2Src:
                 strategy_option="theirs",
             )
         self.source_git.repo.git.branch("-D", from_branch)
+        self.source_git.invalidate()
 
     def update_source_git(self, origin_branch: str, dest_branch: str):
         """
@@ -834,23 +1346,34 @@ class Dist2Src:
         :param origin_branch: branch used as a dist-git source
         :param dest_branch: source-git branch we need to update
         """
-        self.dist_git.clean()
-        self.dist_git.checkout(branch=origin_branch)
-
-        dg_tags_for_head = self.dist_git.get_tags_for_head()
-        new_dest_branch = (
-            dg_tags_for_head[0]
-            if dg_tags_for_head
-            else f"{dest_branch}-{self.dist_git.repo.head.commit.hexsha:.8}"
-        )
-        self.source_git.checkout(dest_branch)
-        self.source_git.checkout(branch=new_dest_branch, create_branch=True)
-        self.source_git.revert_to_ref(
-            self.source_git.packit_upstream_ref,
-            commit_message="Prepare for a new update",
-            commit_body="Reverting patches so we can apply the latest update\n"
-            "and changes can be seen in the spec file and sources.",
-        )
+        reverted = self.journal.get("revert_to_ref") if self.journal else None
+        if reverted:
+            # an interrupted update, keep what was downloaded and prepped
+            self.dist_git.checkout(branch=origin_branch)
+            new_dest_branch = reverted["branch"]
+        else:
+            with self.dist_git.snapshot():
+                # keep the sources downloaded for another branch, if they match
+                self.dist_git.clean(keep=self.downloaded_sources)
+                self.dist_git.checkout(branch=origin_branch)
+
+                dg_tags_for_head = self.dist_git.get_tags_for_head()
+                new_dest_branch = (
+                    dg_tags_for_head[0]
+                    if dg_tags_for_head
+                    else f"{dest_branch}-{self.dist_git.repo.head.commit.hexsha:.8}"
+                )
+            self.source_git.checkout(dest_branch)
+            self.source_git.checkout(branch=new_dest_branch, create_branch=True)
+            with self.timings.stage("revert_to_ref"), self.source_git.snapshot():
+                self.source_git.revert_to_ref(
+                    self.source_git.packit_upstream_ref,
+                    commit_message="Prepare for a new update",
+                    commit_body="Reverting patches so we can apply the latest update\n"
+                    "and changes can be seen in the spec file and sources.",
+                )
+            if self.journal:
+                self.journal.record("revert_to_ref", branch=new_dest_branch)
         self.perform_convert(
             origin_branch=origin_branch,
             dest_branch=new_dest_branch,
@@ -0,0 +1,266 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+Backends running the git operations of GitRepo.
+
+SubprocessBackend runs git (through GitPython) for every operation.
+
+LibGit2Backend does the read-mostly and object-level operations (refs,
+tags, the index, commits) in-process with libgit2 (pygit2), instead of
+forking git dozens to hundreds of times per conversion. The operations on
+the working tree (checkout, add, which apply filters and pathspec magic)
+are still run by git, and so is anything which libgit2 would not do the
+same way git does (e.g. committing during a cherry-pick, commit hooks).
+
+$DIST2SRC_GIT_BACKEND selects the backend, libgit2 is used by default
+if pygit2 is installed.
+"""
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Type
+
+import git
+from git import GitCommandError
+
+try:
+    import pygit2
+except ImportError:
+    pygit2 = None
+
+logger = logging.getLogger(__name__)
+
+# pathspec characters which git would expand
+PATHSPEC_MAGIC = re.compile(r"[*?\[\]\\:]")
+# GIT_REPOSITORY_STATE_NONE, no merge, cherry-pick, revert... in progress
+REPOSITORY_STATE_NONE = 0
+
+
+class SubprocessBackend:
+    name = "subprocess"
+
+    def __init__(self, repo: git.Repo):
+        self.repo = repo
+
+    def has_ref(self, ref: str) -> bool:
+        if ref in self.repo.branches:
+            return True
+        # .branches does not contain all remote refs = branches
+        # (Pdb) self.source_git.repo.branches
+        # [<git.Head "refs/heads/master">]
+        # (Pdb) self.source_git.repo.remotes["origin"].refs
+        # [<git.RemoteReference "refs/remotes/origin/HEAD">,
+        #  <git.RemoteReference "refs/remotes/origin/c8">,
+        #  <git.RemoteReference "refs/remotes/origin/master">]
+        if "origin" in self.repo.remotes:
+            return ref in self.repo.remotes["origin"].refs
+        return False
+
+    def is_file_tracked(self, path: str) -> bool:
+        try:
+            self.repo.git.ls_files("--error-unmatch", path)
+        except GitCommandError:
+            return False
+        return True
+
+    def get_tags_for_head(self) -> List[str]:
+        # a single command, instead of reading the commit of every tag
+        output = self.repo.git.tag(points_at="HEAD")
+        return output.splitlines()
+
+    def create_tag(self, tag: str, ref: str):
+        self.repo.create_tag(tag, ref=ref, force=True)
+
+    def commit(self, message: str, body: Optional[str] = None):
+        other_message_kwargs = {"message": body} if body else {}
+        self.repo.git.commit(allow_empty=True, m=message, **other_message_kwargs)
+
+    def checkout(self, branch: str, orphan: bool = False, create_branch: bool = False):
+        if orphan:
+            self.repo.git.checkout("--orphan", branch)
+            # when creating an orphan branch, git preserves files in the index
+            # we don't want those, hush!
+            if self.repo.index.entries:
+                for entry in self.repo.index.entries:
+                    # entry = (path, stage number) -- see BaseIndexEntry.stage
+                    self.repo.index.remove(entry[0], working_tree=True, r=True, f=True)
+        elif create_branch:
+            self.repo.git.checkout("-B", branch)
+        else:
+            self.repo.git.checkout(branch, force=True)
+
+    def stage(self, add=None, rm=None, exclude=None):
+        if exclude:
+            exclude = f":(exclude){exclude}"
+            logger.debug(exclude)
+        if rm:
+            self.repo.git.rm(rm, "-f", exclude)
+        else:
+            self.repo.git.add(add or ".", "-f", exclude)
+
+
+class LibGit2Backend(SubprocessBackend):
+    name = "libgit2"
+
+    def __init__(self, repo: git.Repo):
+        super().__init__(repo)
+        self.libgit2_repo = pygit2.Repository(str(repo.git_dir))
+
+    def has_ref(self, ref: str) -> bool:
+        references = self.libgit2_repo.references
+        if f"refs/heads/{ref}" in references:
+            return True
+        if "origin" in self.libgit2_repo.remotes.names():
+            return f"refs/remotes/origin/{ref}" in references
+        return False
+
+    def is_file_tracked(self, path: str) -> bool:
+        if is_pathspec(path):
+            # let git expand it
+            return super().is_file_tracked(path)
+        index = self.libgit2_repo.index
+        # the index is changed by git
+        index.read()
+        if path in index:
+            return True
+        # a directory with tracked files in it
+        return any(entry.path.startswith(f"{path}/") for entry in index)
+
+    def get_tags_for_head(self) -> List[str]:
+        try:
+            head = self.libgit2_repo.head.peel(pygit2.Commit).id
+            tags = []
+            # sorted, in the same order as git lists them
+            for name in sorted(self.libgit2_repo.references):
+                if not name.startswith("refs/tags/"):
+                    continue
+                reference = self.libgit2_repo.references[name]
+                if reference.peel(pygit2.Commit).id == head:
+                    tags.append(name.split("/", 2)[2])
+        except (ValueError, pygit2.GitError):
+            # no HEAD (git fails), or a tag of a tree or a blob (git skips it)
+            return super().get_tags_for_head()
+        return tags
+
+    def create_tag(self, tag: str, ref: str):
+        target = self.libgit2_repo.revparse_single(ref).id
+        self.libgit2_repo.references.create(f"refs/tags/{tag}", target, force=True)
+
+    def commit(self, message: str, body: Optional[str] = None):
+        repo = self.libgit2_repo
+        index = repo.index
+        index.read()
+        env = {**os.environ, **self.repo.git.environment()}
+        config = self._get_config(env)
+        author = self._get_signature("AUTHOR", env, config)
+        committer = self._get_signature("COMMITTER", env, config)
+        if (
+            author is None
+            or committer is None
+            # e.g. a cherry-pick, git takes the author from it
+            or repo.state() != REPOSITORY_STATE_NONE
+            or index.conflicts
+            or self._has_commit_hooks(config)
+            or config.get("commit.gpgsign", "false") not in ("false", "no", "off", "0")
+        ):
+            return super().commit(message, body)
+
+        full_message = cleanup_message(f"{message}\n\n{body}" if body else message)
+        if not full_message:
+            # git refuses it
+            return super().commit(message, body)
+        parents = [] if repo.head_is_unborn else [repo.head.target]
+        repo.create_commit(
+            "HEAD", author, committer, full_message, index.write_tree(), parents
+        )
+
+    def _get_config(self, env: Dict[str, str]) -> Dict[str, str]:
+        """the config of the repo, with the settings passed via the environment"""
+        config = {entry.name: entry.value for entry in self.libgit2_repo.config}
+        for i in range(int(env.get("GIT_CONFIG_COUNT") or 0)):
+            config[env[f"GIT_CONFIG_KEY_{i}"].lower()] = env[f"GIT_CONFIG_VALUE_{i}"]
+        return config
+
+    @staticmethod
+    def _get_signature(role: str, env: Dict[str, str], config: Dict[str, str]):
+        """
+        the signature git would use for AUTHOR or COMMITTER,
+        None if there is none (git fails) or git would set its date
+        """
+        if env.get(f"GIT_{role}_DATE"):
+            return None
+        name = (
+            env.get(f"GIT_{role}_NAME")
+            or config.get(f"{role.lower()}.name")
+            or config.get("user.name")
+        )
+        email = (
+            env.get(f"GIT_{role}_EMAIL")
+            or config.get(f"{role.lower()}.email")
+            or config.get("user.email")
+            or env.get("EMAIL")
+        )
+        if not name or not email:
+            return None
+        return pygit2.Signature(name, email)
+
+    def _has_commit_hooks(self, config: Dict[str, str]) -> bool:
+        hooks_path = config.get("core.hookspath")
+        if hooks_path:
+            # relative to the top of the working tree, where git runs the hooks
+            hooks = os.path.join(
+                str(self.repo.working_dir), os.path.expanduser(hooks_path)
+            )
+        else:
+            hooks = os.path.join(self.libgit2_repo.path, "hooks")
+        return any(
+            os.access(os.path.join(hooks, hook), os.X_OK)
+            for hook in ("pre-commit", "prepare-commit-msg", "commit-msg")
+        )
+
+
+def is_pathspec(path: str) -> bool:
+    """isn't 'path' a plain relative path, which git would match as it is?"""
+    return bool(
+        PATHSPEC_MAGIC.search(path)
+        or os.path.normpath(path) != path
+        or path.startswith(("/", "../"))
+        or path in (".", "..")
+    )
+
+
+def cleanup_message(message: str) -> str:
+    """
+    clean up a commit message the way `git commit -m` does (--cleanup=whitespace):
+    no trailing whitespace, no leading, trailing and consecutive empty lines
+    """
+    lines: List[str] = []
+    for line in message.split("\n"):
+        line = line.rstrip()
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    while lines and not lines[-1]:
+        lines.pop()
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+BACKENDS: Dict[str, Type[SubprocessBackend]] = {
+    SubprocessBackend.name: SubprocessBackend,
+    LibGit2Backend.name: LibGit2Backend,
+}
+
+
+def get_backend(repo: git.Repo) -> SubprocessBackend:
+    """
+    the backend for 'repo', $DIST2SRC_GIT_BACKEND (libgit2 or subprocess),
+    libgit2 if pygit2 is installed by default
+    """
+    name = os.getenv("DIST2SRC_GIT_BACKEND")
+    if name is None:
+        name = LibGit2Backend.name if pygit2 else SubprocessBackend.name
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown git backend {name!r}, use one of {list(BACKENDS)}")
+    if name == LibGit2Backend.name and not pygit2:
+        logger.warning("pygit2 is not installed, running git instead of libgit2.")
+        name = SubprocessBackend.name
+    return BACKENDS[name](repo)
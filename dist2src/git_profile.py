@@ -0,0 +1,60 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+Git settings for bulk conversions.
+
+The repos created during a conversion (the BUILD repo created by %prep)
+or touched by it (dist-git, source-git) are short-lived or pushed right
+after the conversion, so git doesn't need to fsync every object, run
+auto-gc in the middle of a conversion or compress the objects hard.
+
+The profile is passed to git via the environment (GIT_CONFIG_COUNT), never
+written to the repo config: the git commands run by Dist2Src and by rpmbuild
+(macros.packit, packitpatch) use it only during the conversion, the push
+which follows it runs with the settings of the repo.
+"""
+import os
+from typing import Dict, Mapping
+
+# feature.manyFiles is not used: it switches to index version 4,
+# which GitPython can't read, hence only its other settings are here
+BULK_CONVERSION: Dict[str, str] = {
+    # no auto-gc in the middle of a conversion
+    "gc.auto": "0",
+    "maintenance.auto": "false",
+    # no fsync of the objects and refs (git >= 2.36)
+    "core.fsync": "none",
+    # cache the untracked files, `git status` and `git add .` are run a lot
+    "core.untrackedCache": "true",
+    # 0/true = as many threads as CPUs
+    "index.threads": "true",
+    "checkout.workers": "0",
+    "pack.threads": "0",
+    # cheap compression
+    "core.looseCompression": "1",
+    "pack.compression": "1",
+}
+
+
+def get_profile() -> Dict[str, str]:
+    """the profile to use, $DIST2SRC_GIT_PROFILE=default turns it off"""
+    if os.getenv("DIST2SRC_GIT_PROFILE", "bulk") == "default":
+        return {}
+    return dict(BULK_CONVERSION)
+
+
+def config_env(settings: Mapping[str, str]) -> Dict[str, str]:
+    """
+    environment variables passing the 'settings' to git
+    as GIT_CONFIG_KEY_<n>/GIT_CONFIG_VALUE_<n> (git >= 2.31)
+
+    They are added after the settings already passed this way, if any.
+    """
+    count = int(os.getenv("GIT_CONFIG_COUNT") or 0)
+    env = {}
+    for key, value in settings.items():
+        env[f"GIT_CONFIG_KEY_{count}"] = key
+        env[f"GIT_CONFIG_VALUE_{count}"] = value
+        count += 1
+    env["GIT_CONFIG_COUNT"] = str(count)
+    return env
@@ -0,0 +1,116 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+In-memory index of the refs and the tracked files of a git repo.
+
+The refs (with the commits the tags point to) are read by a single
+`git for-each-ref`, the tracked files by a single `git ls-files -z`,
+each one when it's first needed, so that the lookups done by an operation
+(has_ref, get_tags_for_head, is_file_tracked, is_dirty) are dict and set
+lookups, instead of a git command or reading every tag's commit each.
+
+The index doesn't notice the changes of the repo: it has to be invalidated
+after every write, GitRepo does that for the writes it runs.
+"""
+import os
+from typing import Dict, List, Optional, Set
+
+import git
+
+from dist2src.git_backend import is_pathspec
+
+# %(*...) are the values of the object an annotated tag points to
+REF_FORMAT = (
+    "%(refname)%00%(objecttype)%00%(objectname)%00%(*objecttype)%00%(*objectname)"
+)
+
+
+class GitSnapshot:
+    def __init__(self, repo: git.Repo):
+        self.repo = repo
+        # refname: the commit it points to, None if not a commit
+        self._refs: Optional[Dict[str, Optional[str]]] = None
+        self._has_origin: Optional[bool] = None
+        self._head: Optional[str] = None
+        # tracked files and the directories with tracked files
+        self._tracked: Optional[Set[str]] = None
+        self._dirty: Optional[bool] = None
+
+    def invalidate(self):
+        """forget everything, the repo was changed"""
+        self._refs = None
+        self._has_origin = None
+        self._head = None
+        self._tracked = None
+        self._dirty = None
+
+    @property
+    def refs(self) -> Dict[str, Optional[str]]:
+        if self._refs is None:
+            self._refs = {}
+            output = self.repo.git.for_each_ref(format=REF_FORMAT)
+            for line in output.splitlines():
+                refname, type_, sha, peeled_type, peeled_sha = line.split("\0")
+                if peeled_type:
+                    type_, sha = peeled_type, peeled_sha
+                self._refs[refname] = sha if type_ == "commit" else None
+        return self._refs
+
+    @property
+    def head(self) -> str:
+        """the commit HEAD points to"""
+        if self._head is None:
+            self._head = git.SymbolicReference.dereference_recursive(self.repo, "HEAD")
+        return self._head
+
+    @property
+    def tracked(self) -> Set[str]:
+        if self._tracked is None:
+            self._tracked = set()
+            for path in self.repo.git.ls_files("-z").split("\0"):
+                while path and path not in self._tracked:
+                    self._tracked.add(path)
+                    path = os.path.dirname(path)
+        return self._tracked
+
+    def has_ref(self, ref: str) -> bool:
+        """is 'ref' a branch, or a branch of origin?"""
+        if f"refs/heads/{ref}" in self.refs:
+            return True
+        if self._has_origin is None:
+            self._has_origin = "origin" in self.repo.remotes
+        return self._has_origin and f"refs/remotes/origin/{ref}" in self.refs
+
+    def get_tags_for_head(self) -> List[str]:
+        head = self.head
+        return [
+            refname.split("/", 2)[2]
+            for refname, commit in sorted(self.refs.items())
+            if refname.startswith("refs/tags/") and commit == head
+        ]
+
+    def is_file_tracked(self, path: str) -> Optional[bool]:
+        """
+        is the file, or a file in the directory, 'path' tracked?
+
+        @return: None for a pathspec (e.g. a glob) which only git can match
+        """
+        if is_pathspec(path):
+            return None
+        return path in self.tracked
+
+    def is_dirty(self) -> bool:
+        """are there changes in the index or in the tracked files?"""
+        if self._dirty is None:
+            self._dirty = has_changes(self.repo)
+        return self._dirty
+
+
+def has_changes(repo: git.Repo) -> bool:
+    """
+    are there changes in the index or in the tracked files?
+
+    The same as repo.is_dirty(), with a single `git status`
+    instead of a `git diff` for the index and one for the working tree.
+    """
+    return bool(repo.git.status("--porcelain", "-z", "--untracked-files=no"))
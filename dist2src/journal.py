@@ -0,0 +1,128 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+Checkpoints of a conversion, so that an interrupted one (an evicted worker,
+a killed task, SIGTERM) can resume from its last completed stage instead of
+starting over.
+
+The journal is kept in the .git directory of the source-git repo, so it goes
+away with the repo, and it's only valid for the same conversion: the same
+dist-git commit and branches.
+"""
+import json
+import logging
+import signal
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+from dist2src.spec_cache import write_entry
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILE = "dist2src-journal.json"
+
+
+class ConversionInterrupted(Exception):
+    """the conversion was stopped by a signal, at a checkpoint"""
+
+
+class Journal:
+    def __init__(self, repo_path: Path, conversion: Dict[str, str]):
+        """
+        @param repo_path: the source-git repo
+        @param conversion: identifies the conversion, e.g. the dist-git commit
+        """
+        self.path = repo_path / ".git" / JOURNAL_FILE
+        self.conversion = conversion
+        self.stages: Dict[str, Dict[str, Any]] = OrderedDict()
+        data = self.read(repo_path)
+        if data and data.get("conversion") == conversion:
+            self.stages.update(data["stages"])
+            logger.info(f"Resuming the conversion after: {', '.join(self.stages)}")
+        elif data:
+            logger.info(f"Discarding the journal of a different conversion: {data}")
+            self.clear()
+
+    @staticmethod
+    def read(repo_path: Path) -> Optional[dict]:
+        """content of the journal in the repo, None if there is none"""
+        path = repo_path / ".git" / JOURNAL_FILE
+        try:
+            return json.loads(path.read_text(), object_pairs_hook=OrderedDict)
+        except FileNotFoundError:
+            return None
+        except ValueError as ex:
+            logger.warning(f"Ignoring the invalid journal {path}: {ex!r}")
+            return None
+
+    def get(self, stage: str) -> Optional[Dict[str, Any]]:
+        """outputs of a completed stage, None if it was not completed"""
+        return self.stages.get(stage)
+
+    def record(self, stage: str, **outputs):
+        """
+        Record a completed stage and its outputs. The stages recorded after it
+        (by a previous attempt) are dropped, they need to be done again.
+
+        This is a checkpoint: the conversion stops here if it was asked to.
+        """
+        if stage in self.stages:
+            index = list(self.stages).index(stage)
+            for name in list(self.stages)[index:]:
+                del self.stages[name]
+        self.stages[stage] = outputs
+        if self.path.parent.is_dir():
+            write_entry(
+                self.path, {"conversion": self.conversion, "stages": self.stages}
+            )
+        check_stop()
+
+    def clear(self):
+        """the conversion is finished"""
+        self.stages.clear()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+# set by the signal handler, checked at the checkpoints
+_stop = threading.Event()
+
+
+def check_stop():
+    if _stop.is_set():
+        _stop.clear()
+        raise ConversionInterrupted(
+            "Stopped at a checkpoint, the conversion can be resumed."
+        )
+
+
+@contextmanager
+def stop_on_signals(*signals: int) -> Iterator[None]:
+    """
+    On the 'signals' (SIGTERM by default), stop at the next checkpoint,
+    instead of right away.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        # signal handlers can be only set in the main thread
+        yield
+        return
+
+    def handler(signum, frame):
+        logger.warning(
+            f"Received {signal.Signals(signum).name}, stopping at the next checkpoint."
+        )
+        _stop.set()
+
+    signals = signals or (signal.SIGTERM,)
+    original = {signum: signal.signal(signum, handler) for signum in signals}
+    try:
+        yield
+    finally:
+        for signum, original_handler in original.items():
+            signal.signal(signum, original_handler)
+        _stop.clear()
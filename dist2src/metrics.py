@@ -0,0 +1,125 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+Metrics of the conversion process.
+
+They are kept in a single registry per process, which the worker pushes to
+Pushgateway and the CLI can dump to a file.
+"""
+import functools
+import logging
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from prometheus_client import CollectorRegistry, Histogram
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = CollectorRegistry()
+
+STAGE_DURATION = Histogram(
+    "dist2src_stage_duration_seconds",
+    "Time spent in the stages of the conversion",
+    ["stage", "size"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600),
+    registry=REGISTRY,
+)
+
+# upper limits (in bytes) of the package-size buckets,
+# based on the size of the sources in the lookaside cache
+SIZE_BUCKETS = (
+    (10 * 1024**2, "small"),
+    (100 * 1024**2, "medium"),
+    (1024**3, "large"),
+)
+
+
+def size_bucket(size: Optional[int]) -> str:
+    """Categorize a package by the size of its sources (in bytes)."""
+    if size is None:
+        return "unknown"
+    for limit, name in SIZE_BUCKETS:
+        if size < limit:
+            return name
+    return "huge"
+
+
+# timings which were not observed yet
+_pending: "weakref.WeakSet[StageTimings]" = weakref.WeakSet()
+
+
+class StageTimings:
+    """
+    Durations of the stages of a single conversion.
+
+    The package size is usually only known after the sources are
+    downloaded, so the durations are collected first and observed
+    in the STAGE_DURATION histogram by calling 'observe()'.
+    """
+
+    def __init__(self):
+        self.durations: Dict[str, float] = OrderedDict()
+        # all the durations observed so far
+        self.observed: Dict[str, float] = OrderedDict()
+        # size of the sources in bytes, set once known
+        self.size: Optional[int] = None
+        # stage: time spent in the stages nested in it, see add_nested()
+        self.nested: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Measure the time spent in a stage; repeated stages add up."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start - self.nested.pop(name, 0.0)
+            self.add(name, max(elapsed, 0.0))
+
+    def add(self, name: str, elapsed: float):
+        """Add a duration measured elsewhere, e.g. by a subprocess."""
+        logger.debug(f"Stage {name!r} took {elapsed:.3f}s.")
+        self.durations[name] = self.durations.get(name, 0.0) + elapsed
+        _pending.add(self)
+
+    def add_nested(self, name: str, elapsed: float, within: str):
+        """
+        Add a duration measured elsewhere, which is part of the running stage
+        'within': it's not counted in 'within', so the stages don't overlap.
+        """
+        self.add(name, elapsed)
+        self.nested[within] = self.nested.get(within, 0.0) + elapsed
+
+    def observe(self):
+        """Observe the collected durations and forget them."""
+        bucket = size_bucket(self.size)
+        for name, duration in self.durations.items():
+            STAGE_DURATION.labels(stage=name, size=bucket).observe(duration)
+            self.observed[name] = self.observed.get(name, 0.0) + duration
+        self.durations.clear()
+        _pending.discard(self)
+
+
+def observe_pending():
+    """Observe the durations of all the timings which were not observed yet."""
+    for timings in list(_pending):
+        timings.observe()
+
+
+def timed_stage(name: str):
+    """
+    Measure a method as a conversion stage, in 'self.timings'.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.timings.stage(name):
+                return func(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,164 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+Static analysis of %prep: can a package be converted commit by commit
+(a commit per patch), or only into a single commit?
+
+This spots the packages which would otherwise be found "hard" only after
+a failed conversion. VERY_VERY_HARD_PACKAGES stays as the override for the
+cases the analysis misses.
+"""
+import hashlib
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+from dist2src.spec_cache import get_cache_dir, mark_used, prune, write_entry
+
+logger = logging.getLogger(__name__)
+
+# bump when the analysis changes, so that the cached verdicts are not used
+ANALYZER_VERSION = 2
+
+SECTION = re.compile(
+    r"^%(prep|build|install|check|clean|files|changelog|description|package|"
+    r"pre|post|preun|postun|pretrans|posttrans|verifyscript|trigger\w*|"
+    r"filetrigger\w*|transfiletrigger\w*|generate_buildrequires|conf)\b"
+)
+# simple (non-parametric) macros defined in the spec file
+MACRO_DEFINITION = re.compile(r"^\s*%(?:global|define)\s+(\w+)\s+(.*?)\s*$")
+SCM_MACRO_DEFINITION = re.compile(r"^\s*%(?:global|define)\s+__scm_", re.MULTILINE)
+# -a N, also combined with other options, e.g. -qa N
+SETUP_A_OPTION = re.compile(r"\s-[a-zA-Z]*a\s*\d+")
+PATCH = re.compile(
+    r"^\s*(%patch|%\{patch|%apply_patch|%\{apply_patch|%autopatch|%\{autopatch)"
+)
+ARCHIVE_TOOL = re.compile(r"\b(tar|bsdtar|unzip|7za?|cpio|rpm2cpio)\b")
+SOURCE_REFERENCE = re.compile(r"%\{?(SOURCE\d+|S:\d+)")
+COMMAND_SEPARATOR = re.compile(r";|&&")
+
+
+class PrepVerdict(NamedTuple):
+    # convert into a single commit (Dist2Src.convert_single_commit)
+    single_commit: bool
+    # why, empty for the packages which can be converted commit by commit
+    reasons: List[str]
+
+
+def get_prep(spec_content: str) -> Optional[List[str]]:
+    """lines of the %prep section, None if the spec file has none"""
+    prep: Optional[List[str]] = None
+    for line in spec_content.splitlines():
+        if SECTION.match(line):
+            if prep is not None:
+                break
+            if line.startswith("%prep"):
+                prep = []
+        elif prep is not None:
+            prep.append(line)
+    return prep
+
+
+def expand_macros(lines: List[str], spec_content: str, depth: int = 5) -> List[str]:
+    """expand the simple macros defined in the spec file itself"""
+    macros: Dict[str, str] = {}
+    for line in spec_content.splitlines():
+        match = MACRO_DEFINITION.match(line)
+        if match:
+            macros[match.group(1)] = match.group(2)
+    if not macros:
+        return lines
+
+    pattern = re.compile(
+        r"%\{\??(" + "|".join(map(re.escape, macros)) + r")\}"
+        r"|%(" + "|".join(map(re.escape, macros)) + r")\b"
+    )
+
+    def replace(match) -> str:
+        return macros[match.group(1) or match.group(2)]
+
+    expanded = []
+    for line in lines:
+        for _ in range(depth):
+            new_line = pattern.sub(replace, line)
+            if new_line == line:
+                break
+            line = new_line
+        expanded.append(line)
+    return expanded
+
+
+def commands(lines: List[str]) -> Iterator[str]:
+    """shell commands in the lines, e.g. 'cd src; make' is two"""
+    for line in lines:
+        for command in COMMAND_SEPARATOR.split(line):
+            yield command.strip()
+
+
+def analyze_prep(spec_content: str) -> PrepVerdict:
+    """decide how a package with this spec file can be converted"""
+    reasons: List[str] = []
+    prep = get_prep(spec_content)
+    if not prep:
+        reasons.append("no %prep section")
+    if SCM_MACRO_DEFINITION.search(spec_content):
+        reasons.append("%__scm_* macros are redefined")
+
+    # how many directories deep we went with cd/pushd since %setup
+    depth = 0
+    # nested archives unpacked so far, a problem only if patches follow them
+    archives: List[str] = []
+    for line in commands(expand_macros(prep or [], spec_content)):
+        if line.startswith(("%setup", "%autosetup")):
+            depth = 0
+            if len(SETUP_A_OPTION.findall(f" {line}")) >= 2:
+                reasons.append(f"multiple archives unpacked by {line!r}")
+        elif line.startswith("pushd "):
+            depth += 1
+        elif line.startswith("popd"):
+            depth = max(depth - 1, 0)
+        elif line in ("cd ..", "cd -"):
+            depth = max(depth - 1, 0)
+        elif line.startswith("cd "):
+            depth += 1
+        elif PATCH.match(line):
+            if depth:
+                reasons.append(f"{line!r} is not applied in the top-level directory")
+            reasons.extend(
+                f"nested archive unpacked by {archive!r} before patching"
+                for archive in archives
+            )
+        elif (
+            ARCHIVE_TOOL.search(line) and SOURCE_REFERENCE.search(line)
+        ) or "%{uncompress:" in line:
+            archives.append(line)
+    # the same line can be a problem several times
+    reasons = list(dict.fromkeys(reasons))
+    return PrepVerdict(single_commit=bool(reasons), reasons=reasons)
+
+
+def get_prep_verdict(
+    spec_content: str, cache_dir: Optional[Path] = None
+) -> PrepVerdict:
+    """
+    the verdict of analyze_prep(), cached per content of the spec file
+
+    @param cache_dir: see dist2src.spec_cache.get_cache_dir() for the default
+    """
+    digest = hashlib.sha256(f"v{ANALYZER_VERSION}\n{spec_content}".encode())
+    path = (cache_dir or get_cache_dir()) / "prep" / f"{digest.hexdigest()}.json"
+    prune(path.parent)
+    try:
+        verdict = PrepVerdict(**json.loads(path.read_text()))
+        mark_used(path)
+        return verdict
+    except FileNotFoundError:
+        pass
+    except (ValueError, TypeError) as ex:
+        logger.warning(f"Ignoring the invalid cached verdict {path}: {ex!r}")
+
+    verdict = analyze_prep(spec_content)
+    write_entry(path, verdict._asdict())
+    return verdict
@@ -0,0 +1,234 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+Profile dist2src runs: time spent in the methods of the given classes
+and in the external commands (git, rpmbuild, get_sources.sh...).
+"""
+import cProfile
+import functools
+import json
+import logging
+import os
+import resource
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import git
+import sh
+
+logger = logging.getLogger(__name__)
+
+
+def _constant(name: str) -> Callable[..., str]:
+    return lambda *args, **kwargs: name
+
+
+def _command_name(command, *args, **kwargs) -> str:
+    """'git checkout' for ['git', 'checkout', 'branch']"""
+    if isinstance(command, (list, tuple)):
+        return " ".join(str(part) for part in command[:2])
+    return str(command)
+
+
+def _children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Profiler:
+    """
+    Record a timeline of calls with their wall time, CPU time,
+    CPU time of child processes and the peak RSS reached.
+
+    Usage:
+        profiler = Profiler()
+        profiler.instrument(Dist2Src, GitRepo)
+        profiler.start()
+        ...
+        profiler.stop()
+        profiler.write(Path("profile.json"))
+    """
+
+    def __init__(self, cprofile: bool = False):
+        self.events: List[Dict[str, Any]] = []
+        self._classes: List[type] = []
+        # (owner, attribute name, original value)
+        self._patched: List[Tuple[Any, str, Any]] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._started_at: Optional[float] = None
+        self._cprofile = cProfile.Profile() if cprofile else None
+
+    @property
+    def _stack(self) -> List[str]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name: str, kind: str):
+        """Record the time spent in the block as a call of 'name'."""
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        children_cpu_start = _children_cpu()
+        self._stack.append(name)
+        stack = ";".join(self._stack)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            wall = time.perf_counter() - wall_start
+            event = {
+                "name": name,
+                "kind": kind,
+                "stack": stack,
+                "start": wall_start - (self._started_at or wall_start),
+                "wall": wall,
+                "cpu": time.process_time() - cpu_start,
+                "children_cpu": _children_cpu() - children_cpu_start,
+                # high-water marks, in kilobytes
+                "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                "children_max_rss": resource.getrusage(
+                    resource.RUSAGE_CHILDREN
+                ).ru_maxrss,
+            }
+            with self._lock:
+                self.events.append(event)
+
+    def _wrap(self, func: Callable, name_func: Callable[..., str], kind: str):
+        profiler = self
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profiler.span(name_func(*args, **kwargs), kind):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def _patch(self, owner: Any, attr: str, new: Any):
+        self._patched.append((owner, attr, owner.__dict__[attr]))
+        setattr(owner, attr, new)
+
+    def instrument(self, *classes: type):
+        """Profile all the public methods of these classes, once started."""
+        self._classes.extend(classes)
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        for cls in self._classes:
+            for attr, value in list(cls.__dict__.items()):
+                if (
+                    attr.startswith("_")
+                    or isinstance(value, (type, property, staticmethod, classmethod))
+                    or not callable(value)
+                ):
+                    continue
+                self._patch(
+                    cls,
+                    attr,
+                    self._wrap(value, _constant(f"{cls.__name__}.{attr}"), "method"),
+                )
+
+        self._patch(
+            git.cmd.Git,
+            "execute",
+            self._wrap(
+                git.cmd.Git.execute,
+                lambda _, *args, **kwargs: _command_name(*args, **kwargs),
+                "command",
+            ),
+        )
+        self._patch(
+            sh.Command,
+            "__call__",
+            self._wrap(
+                sh.Command.__call__,
+                lambda cmd, *a, **kw: os.path.basename(str(cmd)),
+                "command",
+            ),
+        )
+        for func_name in ("check_call", "check_output"):
+            func = getattr(subprocess, func_name)
+            self._patch(
+                subprocess,
+                func_name,
+                self._wrap(func, _command_name, "command"),
+            )
+        if self._cprofile:
+            self._cprofile.enable()
+
+    def stop(self):
+        if self._cprofile:
+            self._cprofile.disable()
+        for owner, attr, original in reversed(self._patched):
+            setattr(owner, attr, original)
+        self._patched.clear()
+
+    def aggregate(self) -> "OrderedDict[Tuple[str, str], Dict[str, float]]":
+        """Per (kind, name) totals, the slowest first."""
+        totals: Dict[Tuple[str, str], Dict[str, float]] = {}
+        for event in self.events:
+            total = totals.setdefault(
+                (event["kind"], event["name"]),
+                {"calls": 0, "wall": 0.0, "cpu": 0.0, "children_cpu": 0.0},
+            )
+            total["calls"] += 1
+            for key in ("wall", "cpu", "children_cpu"):
+                total[key] += event[key]
+        return OrderedDict(
+            sorted(totals.items(), key=lambda item: item[1]["wall"], reverse=True)
+        )
+
+    def summary(self) -> str:
+        """Human-readable summary; the times of methods include their callees."""
+        lines = [
+            f"{'calls':>6} {'wall[s]':>10} {'cpu[s]':>10} {'child cpu[s]':>13}  "
+            "kind     name"
+        ]
+        for (kind, name), total in self.aggregate().items():
+            lines.append(
+                f"{total['calls']:>6} {total['wall']:>10.3f} {total['cpu']:>10.3f} "
+                f"{total['children_cpu']:>13.3f}  {kind:<8} {name}"
+            )
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        lines.append(
+            f"Peak RSS: {self_usage.ru_maxrss} kB, "
+            f"peak RSS of a child process: {children_usage.ru_maxrss} kB"
+        )
+        return "\n".join(lines)
+
+    def collapsed_stacks(self) -> str:
+        """
+        Stacks in the 'collapsed' format used to generate flamegraphs,
+        weighted by the self wall time in microseconds.
+        """
+        self_times: Dict[str, float] = OrderedDict()
+        for event in self.events:
+            stack = event["stack"]
+            self_times[stack] = self_times.get(stack, 0.0) + event["wall"]
+            parent = stack.rpartition(";")[0]
+            if parent:
+                self_times[parent] = self_times.get(parent, 0.0) - event["wall"]
+        return "".join(
+            f"{stack} {max(int(wall * 1e6), 0)}\n" for stack, wall in self_times.items()
+        )
+
+    def write(self, path: Path, dump: Optional[str] = None):
+        """
+        Write the timeline as JSON to 'path' and the summary next to it.
+
+        @param dump: also write "cprofile" (a pstats file) or "collapsed" stacks
+        """
+        path.write_text(json.dumps({"events": self.events}, indent=2))
+        path.with_name(f"{path.name}.txt").write_text(self.summary() + "\n")
+        if dump == "cprofile" and self._cprofile:
+            self._cprofile.dump_stats(str(path.with_name(f"{path.name}.prof")))
+        elif dump == "collapsed":
+            path.with_name(f"{path.name}.folded").write_text(self.collapsed_stacks())
+        logger.info(f"Profile written to {path}.")
@@ -0,0 +1,149 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+HTTP sessions and clients shared by a process.
+
+The requests to the same host (the forges, the lookaside cache) reuse
+the kept-alive connections of a shared session, instead of doing a new
+TLS handshake, and authenticating, for every task.
+
+Nothing is shared with the forked processes: a process which finds out
+it was forked starts with new sessions and clients.
+
+The number of requests and new connections of every session are exported
+as dist2src_http_requests_total and dist2src_http_connections_total,
+the connection reuse rate is 1 - connections / requests.
+"""
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple, TypeVar
+
+import requests
+from prometheus_client.core import CounterMetricFamily
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from dist2src.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SessionPool:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.sessions: Dict[str, requests.Session] = {}
+        # name: (parameters, client)
+        self.clients: Dict[str, Tuple[Hashable, Any]] = {}
+        # name: held while the client is created
+        self.client_locks: Dict[str, threading.Lock] = {}
+
+    def check_fork(self):
+        if self.pid != os.getpid():
+            logger.debug("Forked, not reusing the sessions of the parent process.")
+            self.pid = os.getpid()
+            self.sessions.clear()
+            self.clients.clear()
+            self.client_locks.clear()
+
+
+_pool = SessionPool()
+
+
+def get_pool_size() -> int:
+    """connections kept per host, $D2S_HTTP_POOL_SIZE"""
+    return int(os.getenv("D2S_HTTP_POOL_SIZE", 10))
+
+
+def get_session(name: str, retries: Optional[Retry] = None) -> requests.Session:
+    """
+    the session 'name' of this process, e.g. "lookaside"
+
+    @param retries: used when the session is created
+    """
+    with _pool.lock:
+        _pool.check_fork()
+        session = _pool.sessions.get(name)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_maxsize=get_pool_size(),
+                max_retries=retries if retries is not None else 0,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _pool.sessions[name] = session
+        return session
+
+
+def get_client(name: str, parameters: Hashable, create: Callable[[], T]) -> T:
+    """
+    the client 'name' of this process, e.g. a forge service
+
+    @param parameters: e.g. the URL and the token, when they change
+                       (a refreshed token), the client is created again
+    @param create: creates the client
+    """
+    with _pool.lock:
+        _pool.check_fork()
+        client_lock = _pool.client_locks.setdefault(name, threading.Lock())
+    # only one thread creates (and authenticates) the client,
+    # the others wait for it, without blocking the other clients and sessions
+    with client_lock:
+        with _pool.lock:
+            if name in _pool.clients:
+                current_parameters, client = _pool.clients[name]
+                if current_parameters == parameters:
+                    return client
+                logger.info(
+                    f"The parameters of the {name} client changed, recreating it."
+                )
+        client = create()
+        with _pool.lock:
+            _pool.clients[name] = (parameters, client)
+        return client
+
+
+def connection_stats() -> Iterator[Tuple[str, int, int]]:
+    """(session name, requests, new connections) of the sessions of this process"""
+    with _pool.lock:
+        sessions = list(_pool.sessions.items())
+    for name, session in sessions:
+        adapters = {id(a): a for a in session.adapters.values()}.values()
+        total_requests = total_connections = 0
+        for adapter in adapters:
+            if not isinstance(adapter, HTTPAdapter):
+                # no connection pools
+                continue
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    total_requests += pool.num_requests
+                    total_connections += pool.num_connections
+        yield name, total_requests, total_connections
+
+
+class ConnectionReuseCollector:
+    def collect(self):
+        http_requests = CounterMetricFamily(
+            "dist2src_http_requests",
+            "Number of HTTP requests made by a shared session",
+            labels=["session"],
+        )
+        http_connections = CounterMetricFamily(
+            "dist2src_http_connections",
+            "Number of HTTP connections opened by a shared session",
+            labels=["session"],
+        )
+        for name, total_requests, total_connections in connection_stats():
+            http_requests.add_metric([name], total_requests)
+            http_connections.add_metric([name], total_connections)
+        yield http_requests
+        yield http_connections
+
+
+REGISTRY.register(ConnectionReuseCollector())
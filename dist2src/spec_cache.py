@@ -0,0 +1,202 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+Cache of the metadata parsed from spec files.
+
+Parsing a spec file (rebasehelper + rpm macro expansion) is slow, and the
+separate steps of a conversion (and the CLI subcommands) need the same
+sources and patches over and over. The parsed metadata are stored as JSON
+files, keyed by the content of the spec file and the macro environment,
+so a changed spec file (e.g. by Dist2Src._enforce_autosetup) or changed
+rpm macros never hit a stale entry.
+
+The entries which were not used for $DIST2SRC_CACHE_MAX_AGE days (30 by
+default) are removed, once per process, so the cache doesn't keep growing
+with the entries of old spec files.
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# bump when the format of the entries changes
+CACHE_VERSION = 1
+
+# files defining the rpm macros which are used when parsing the spec files
+MACRO_FILES = (
+    "/usr/lib/rpm/macros",
+    "/usr/lib/rpm/macros.d/*",
+    "/usr/lib/rpm/redhat/macros",
+    "/etc/rpm/*",
+    "~/.rpmmacros",
+)
+
+
+# days after which an unused entry is removed
+DEFAULT_MAX_AGE = 30
+
+# the directories pruned by this process
+_pruned: Set[Path] = set()
+
+
+class Patch(NamedTuple):
+    # the N of PatchN
+    number: int
+    name: str
+    # absolute path of the patch file
+    path: str
+
+
+class SpecMetadata(NamedTuple):
+    # absolute paths of the sources
+    sources: List[str]
+    patches: List[Patch]
+    # raw lines of the %prep section
+    prep: List[str]
+
+
+def get_cache_dir() -> Path:
+    """$DIST2SRC_CACHE_DIR or the dist2src directory in the user's cache"""
+    cache_dir = os.getenv("DIST2SRC_CACHE_DIR")
+    if cache_dir:
+        return Path(cache_dir)
+    return Path(os.getenv("XDG_CACHE_HOME", "~/.cache")).expanduser() / "dist2src"
+
+
+def macro_environment(sources_dir: Path) -> str:
+    """
+    a fingerprint of everything besides the spec file
+    which affects the parsed metadata
+    """
+    parts = [f"sources_dir={sources_dir}"]
+    for pattern in MACRO_FILES:
+        for path in sorted(glob.glob(os.path.expanduser(pattern))):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            parts.append(f"{path}:{stat.st_size}:{stat.st_mtime_ns}")
+    return "\n".join(parts)
+
+
+def get_max_age() -> float:
+    """$DIST2SRC_CACHE_MAX_AGE, in seconds"""
+    return float(os.getenv("DIST2SRC_CACHE_MAX_AGE", DEFAULT_MAX_AGE)) * 24 * 3600
+
+
+def prune(directory: Path):
+    """remove the entries in 'directory' which were not used recently, once per process"""
+    if directory in _pruned:
+        return
+    _pruned.add(directory)
+    oldest = time.time() - get_max_age()
+    removed = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # the interrupted writes (*.tmp) too
+                if entry.is_file() and entry.stat().st_mtime < oldest:
+                    os.unlink(entry.path)
+                    removed += 1
+    except FileNotFoundError:
+        pass
+    except OSError as ex:
+        logger.warning(f"Unable to prune the cache {directory}: {ex!r}")
+    if removed:
+        logger.debug(f"Removed {removed} unused entries from {directory}.")
+
+
+def mark_used(path: Path):
+    """keep a cache entry which was just used from being pruned"""
+    try:
+        os.utime(path)
+    except OSError as ex:
+        logger.debug(f"Unable to update the time of the cache entry {path}: {ex!r}")
+
+
+def write_entry(path: Path, data: dict):
+    """
+    write a cache entry as JSON, logging the failures: the cache is
+    an optimization, the conversion can go on without it
+    """
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write and rename, so that parallel conversions never read a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w") as tmp_file:
+            json.dump(data, tmp_file)
+        os.replace(tmp_path, path)
+    except OSError as ex:
+        logger.warning(f"Unable to write the cache entry {path}: {ex!r}")
+
+
+class SpecCache:
+    """
+    Metadata of spec files, kept in memory and persisted in 'cache_dir'
+    (one JSON file per entry), so they are shared between steps and runs.
+    """
+
+    def __init__(self, cache_dir: Optional[Path] = None):
+        """
+        @param cache_dir: where to persist the entries, see get_cache_dir() for the default
+        """
+        self.cache_dir = (cache_dir or get_cache_dir()) / "specs"
+        prune(self.cache_dir)
+        self._entries: Dict[str, SpecMetadata] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(spec_path: Path, sources_dir: Path) -> str:
+        digest = hashlib.sha256(f"v{CACHE_VERSION}\n".encode())
+        digest.update(macro_environment(sources_dir).encode())
+        digest.update(b"\0")
+        digest.update(spec_path.read_bytes())
+        return digest.hexdigest()
+
+    def get(
+        self,
+        spec_path: Path,
+        sources_dir: Path,
+        parse: Callable[[], SpecMetadata],
+    ) -> SpecMetadata:
+        """
+        metadata of the spec file in its current state
+
+        @param parse: called to parse the spec file if there is no entry for it yet
+        """
+        key = self.key(spec_path, sources_dir)
+        metadata = self._entries.get(key) or self._load(key)
+        if metadata:
+            self.hits += 1
+        else:
+            self.misses += 1
+            logger.debug(f"Parsing {spec_path} (no cached metadata).")
+            metadata = parse()
+            write_entry(self.cache_dir / f"{key}.json", metadata._asdict())
+        self._entries[key] = metadata
+        return metadata
+
+    def _load(self, key: str) -> Optional[SpecMetadata]:
+        path = self.cache_dir / f"{key}.json"
+        try:
+            data = json.loads(path.read_text())
+            metadata = SpecMetadata(
+                sources=data["sources"],
+                patches=[Patch(*patch) for patch in data["patches"]],
+                prep=data["prep"],
+            )
+            mark_used(path)
+            return metadata
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError) as ex:
+            logger.warning(f"Ignoring the invalid spec cache entry {path}: {ex!r}")
+            return None
@@ -0,0 +1,103 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+Warm up the worker, so that the tasks don't pay for it.
+
+The main worker process imports the heavy modules and sets up Sentry,
+the configuration and the forge clients before the pool processes are
+forked from it (see the signal handlers in celerizer.py). The state
+a task can leave behind is reset after each task.
+"""
+import importlib
+import logging
+import os
+import tempfile
+import time
+from typing import List, Optional
+
+from dist2src.worker.config import Configuration
+from dist2src.worker.monitoring import Pushgateway
+from dist2src.worker.sentry import configure_sentry
+
+logger = logging.getLogger(__name__)
+
+# imported on the first use otherwise, i.e. in the first task of every process
+PRELOADED_MODULES = (
+    "rpm",
+    "rebasehelper.specfile",
+    "packit.specfile",
+    "dist2src.core",
+    "dist2src.worker.processor",
+    "gitlab",
+    "ogr.services.gitlab",
+    "ogr.services.pagure",
+)
+
+
+class WorkerState:
+    def __init__(self):
+        self.configuration: Optional[Configuration] = None
+        # working directory and log handlers to return to after the task
+        self.cwd: Optional[str] = None
+        self.log_handlers: List[logging.Handler] = []
+        # monotonic time the current task started at
+        self.task_started: Optional[float] = None
+        # number of tasks started by this process
+        self.tasks = 0
+
+
+state = WorkerState()
+
+
+def preload():
+    """import the heavy modules and set up the clients, before forking"""
+    start = time.monotonic()
+    for module in PRELOADED_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError as ex:
+            logger.warning(f"Unable to preload {module!r}: {ex!r}")
+    configure_sentry(runner_type="worker")
+    # the forge clients are created in the pool processes,
+    # they are shared by the tasks there, see dist2src.sessions
+    state.configuration = Configuration()
+    logger.info(f"Worker preloaded in {time.monotonic() - start:.2f}s.")
+
+
+def get_configuration() -> Configuration:
+    """the preloaded configuration, or a new one if the worker was not preloaded"""
+    return state.configuration or Configuration()
+
+
+def start_task():
+    state.task_started = time.monotonic()
+    state.tasks += 1
+    state.cwd = os.getcwd()
+    state.log_handlers = list(logging.getLogger("dist2src").handlers)
+
+
+def observe_time_to_first_work():
+    """
+    Observe the time from the start of the task to its first useful work
+    (e.g. cloning the repos), once per task.
+    """
+    if state.task_started is None:
+        return
+    seconds = time.monotonic() - state.task_started
+    state.task_started = None
+    logger.debug(f"Task started working after {seconds:.3f}s.")
+    Pushgateway().push_time_to_first_work(seconds, first_task=state.tasks == 1)
+
+
+def reset_task_state():
+    """reset what a task could have left behind, so the next one starts clean"""
+    if state.cwd and os.getcwd() != state.cwd:
+        logger.debug(f"Changing the working directory back to {state.cwd}.")
+        os.chdir(state.cwd)
+    tempfile.tempdir = None
+    dist2src_logger = logging.getLogger("dist2src")
+    for handler in dist2src_logger.handlers[:]:
+        if handler not in state.log_handlers:
+            dist2src_logger.removeHandler(handler)
+            handler.close()
+    state.task_started = None
@@ -4,6 +4,9 @@
 from os import getenv
 
 from celery import Celery
+from celery.signals import task_postrun, task_prerun, worker_init, worker_process_init
+from dist2src.worker import bootstrap
+from dist2src.worker.monitoring import start_metrics_server
 from dist2src.worker.sentry import configure_sentry
 from lazy_object_proxy import Proxy
 
@@ -31,3 +34,25 @@ def get_celery_application():
 
 
 celery_app: Celery = Proxy(get_celery_application)
+
+
+@worker_process_init.connect
+def expose_metrics(**kwargs):
+    # Tasks run in the pool processes, so their metrics live there.
+    start_metrics_server()
+
+
+@worker_init.connect
+def preload(**kwargs):
+    # The main process, before forking the pool processes.
+    bootstrap.preload()
+
+
+@task_prerun.connect
+def start_task(**kwargs):
+    bootstrap.start_task()
+
+
+@task_postrun.connect
+def reset_task_state(**kwargs):
+    bootstrap.reset_task_state()
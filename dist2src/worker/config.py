@@ -3,11 +3,32 @@
 
 import os
 from pathlib import Path
+from typing import NamedTuple
 
+import gitlab
 from ogr import GitlabService, PagureService
 from requests.packages.urllib3.util import Retry
 
 from dist2src.constants import GITLAB_SRC_NAMESPACE
+from dist2src.sessions import get_client, get_session
+
+
+class Queue(NamedTuple):
+    """Celery queue for update tasks, with the time limits (in seconds) of its tasks"""
+
+    name: str
+    soft_time_limit: int
+    time_limit: int
+
+    @classmethod
+    def from_env(cls, prefix: str, name: str, soft_time_limit: int) -> "Queue":
+        soft_time_limit = int(os.getenv(f"{prefix}_SOFT_TIME_LIMIT", soft_time_limit))
+        return cls(
+            name=os.getenv(f"{prefix}_QUEUE", name),
+            soft_time_limit=soft_time_limit,
+            # leave some time to clean up after the soft limit
+            time_limit=int(os.getenv(f"{prefix}_TIME_LIMIT", soft_time_limit + 300)),
+        )
 
 
 class Configuration:
@@ -15,6 +36,12 @@ class Configuration:
         self.workdir = Path(os.getenv("D2S_WORKDIR", "/workdir"))
         self.dist_git_host = os.getenv("D2S_DIST_GIT_HOST", "git.centos.org")
         self.src_git_host = os.getenv("D2S_SRC_GIT_HOST", "gitlab.com")
+        # Base URLs of the forges, override them to point to other instances
+        # (e.g. local ones for testing) which don't use https://HOST.
+        self.dist_git_url = os.getenv(
+            "D2S_DIST_GIT_URL", f"https://{self.dist_git_host}"
+        )
+        self.src_git_url = os.getenv("D2S_SRC_GIT_URL", f"https://{self.src_git_host}")
         self.src_git_token = os.getenv("D2S_SRC_GIT_TOKEN")
         self.dist_git_token = os.getenv("D2S_DIST_GIT_TOKEN")
         self.dist_git_namespace = os.getenv("D2S_DIST_GIT_NAMESPACE", "rpms")
@@ -24,32 +51,99 @@ class Configuration:
         self.branches_watched = os.getenv("D2S_BRANCHES_WATCHED", "c8s,c8").split(",")
         self.update_task_expires = os.getenv("D2S_UPDATE_TASK_EXPIRES")
         self.logs_dir = Path(os.getenv("D2S_LOGS_DIR", "/log-files/"))
+        # How to find out-of-date branches: using the forge APIs ("api")
+        # or with 'git ls-remote' ("git").
+        self.out_of_date_backend = os.getenv("D2S_OUT_OF_DATE_BACKEND", "api")
         if self.update_task_expires is not None:
             self.update_task_expires = int(self.update_task_expires)
+        # Route update tasks to the small or the large queue by their estimated cost.
+        self.task_routing = os.getenv("D2S_TASK_ROUTING", "false").lower() == "true"
+        # Without routing, scheduled update tasks go to the '<prefix>-scheduled' queue.
+        self.scheduled_queue_prefix = os.getenv(
+            "D2S_SCHEDULED_QUEUE_PREFIX", "dist2src"
+        )
 
-        self._src_git_svc = None
-        self._dist_git_svc = None
         self._retries = Retry(
             total=5,
             backoff_factor=1,
         )
 
+    @property
+    def small_queue(self) -> Queue:
+        return Queue.from_env("D2S_SMALL", "dist2src-small", 30 * 60)
+
+    @property
+    def large_queue(self) -> Queue:
+        return Queue.from_env("D2S_LARGE", "dist2src-large", 4 * 60 * 60)
+
+    @property
+    def log_head_size(self) -> int:
+        """how much (uncompressed, in bytes) of the beginning of a conversion log to keep"""
+        return int(os.getenv("D2S_LOG_HEAD_SIZE", 8 * 1024**2))
+
+    @property
+    def log_tail_size(self) -> int:
+        """how much (uncompressed, in bytes) of the end of a conversion log to keep"""
+        return int(os.getenv("D2S_LOG_TAIL_SIZE", 8 * 1024**2))
+
+    @property
+    def logs_max_age(self) -> int:
+        """the logs in logs_dir older than this (in seconds) are removed"""
+        return int(os.getenv("D2S_LOGS_MAX_AGE_DAYS", 30)) * 24 * 3600
+
+    @property
+    def logs_max_size(self) -> int:
+        """the oldest logs in logs_dir are removed to keep them under this size (in bytes)"""
+        return int(os.getenv("D2S_LOGS_MAX_SIZE", 10 * 1024**3))
+
+    @property
+    def large_size_threshold(self) -> int:
+        """packages with sources of this size (in bytes) or more are large"""
+        return int(os.getenv("D2S_LARGE_SIZE_THRESHOLD", 100 * 1024**2))
+
+    @property
+    def large_patches_threshold(self) -> int:
+        """packages with this many patches or more are large"""
+        return int(os.getenv("D2S_LARGE_PATCHES_THRESHOLD", 200))
+
     @property
     def src_git_svc(self) -> GitlabService:
-        if self._src_git_svc is None:
-            self._src_git_svc = GitlabService(
-                instance_url=f"https://{self.src_git_host}",
-                token=self.src_git_token,
-                max_retries=self._retries,
-            )
-        return self._src_git_svc
+        """shared by the process, see dist2src.sessions"""
+        return get_client(
+            "src-git",
+            (self.src_git_url, self.src_git_token),
+            self._create_src_git_svc,
+        )
+
+    def _create_src_git_svc(self) -> GitlabService:
+        service = GitlabService(instance_url=self.src_git_url, token=self.src_git_token)
+        # ogr would create the python-gitlab client with a session of its own,
+        # without retries, and has no way to pass one: set it up the way ogr does
+        # (authenticated, so that service.user works) with the shared session
+        instance = gitlab.Gitlab(
+            url=self.src_git_url,
+            private_token=self.src_git_token,
+            session=get_session("src-git", retries=self._retries),
+        )
+        if self.src_git_token:
+            instance.auth()
+        service._gitlab_instance = instance
+        return service
 
     @property
     def dist_git_svc(self) -> PagureService:
-        if self._dist_git_svc is None:
-            self._dist_git_svc = PagureService(
-                instance_url=f"https://{self.dist_git_host}",
-                token=self.dist_git_token,
-                max_retries=self._retries,
-            )
-        return self._dist_git_svc
+        """shared by the process, see dist2src.sessions"""
+        return get_client(
+            "dist-git",
+            (self.dist_git_url, self.dist_git_token),
+            self._create_dist_git_svc,
+        )
+
+    def _create_dist_git_svc(self) -> PagureService:
+        service = PagureService(
+            instance_url=self.dist_git_url,
+            token=self.dist_git_token,
+            max_retries=self._retries,
+        )
+        service.session = get_session("dist-git", retries=self._retries)
+        return service
@@ -1,27 +1,226 @@
+import gzip
 import logging
+import os
+import queue
+import sys
+import time
+from collections import deque
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+from typing import Deque, Dict, Optional, Tuple
 
+logger = logging.getLogger(__name__)
 
-def set_logging_to_file(repo_name: str, commit_sha: str, logs_dir: Path):
+# how much (uncompressed) of the beginning and the end of a conversion log is kept
+LOG_HEAD_SIZE = 8 * 1024**2
+LOG_TAIL_SIZE = 8 * 1024**2
+# how often, in seconds, what was logged is written to the disk
+LOG_FLUSH_INTERVAL = 10
+# how often, in seconds, the old logs are looked for
+REMOVE_OLD_LOGS_INTERVAL = 3600
+
+# {logs_dir: when (time.monotonic()) the old logs were removed from it}
+_old_logs_removed: Dict[Path, float] = {}
+
+
+class CappedGzipHandler(logging.Handler):
+    """
+    Write the records into a gzip-compressed file, keeping only
+    the first 'head_size' and the last 'tail_size' bytes (UTF-8 encoded)
+    of them.
+
+    The tail is appended when the handler is closed. Until then it's
+    written to a side file (the suffix .gz replaced by .tail) every
+    'flush_interval' seconds, so that a killed task (time limit, OOM)
+    keeps the end of its log.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        head_size: int,
+        tail_size: int,
+        flush_interval: float = LOG_FLUSH_INTERVAL,
+    ):
+        super().__init__()
+        self.path = path
+        self.tail_path = path.with_suffix(".tail")
+        self.head_size = head_size
+        self.tail_size = tail_size
+        self.flush_interval = flush_interval
+        self.stream = gzip.open(path, "wt", encoding="utf-8")
+        self.written = 0
+        # (line, its size in bytes)
+        self.tail: Deque[Tuple[str, int]] = deque()
+        self.tail_written = 0
+        self.tail_changed = False
+        self.skipped_records = 0
+        self.skipped_size = 0
+        self.flushed = time.monotonic()
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            line = self.format(record) + "\n"
+            size = len(line.encode("utf-8", errors="replace"))
+            if self.written + size <= self.head_size and not self.tail:
+                self.stream.write(line)
+                self.written += size
+            else:
+                self.tail.append((line, size))
+                self.tail_written += size
+                self.tail_changed = True
+                while self.tail_written > self.tail_size:
+                    _, dropped = self.tail.popleft()
+                    self.tail_written -= dropped
+                    self.skipped_records += 1
+                    self.skipped_size += dropped
+            if time.monotonic() - self.flushed >= self.flush_interval:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def skipped_line(self) -> str:
+        if not self.skipped_records:
+            return ""
+        return (
+            f"[... {self.skipped_records} records "
+            f"({self.skipped_size} B) skipped ...]\n"
+        )
+
+    def flush(self):
+        """write the head, and the tail to the side file, to the disk"""
+        self.acquire()
+        try:
+            if not self.stream:
+                return
+            self.flushed = time.monotonic()
+            self.stream.flush()
+            if self.tail_changed:
+                # write and rename, never leave a partial tail behind
+                tmp_path = self.tail_path.with_suffix(".tail-tmp")
+                tmp_path.write_text(
+                    self.skipped_line() + "".join(line for line, _ in self.tail),
+                    encoding="utf-8",
+                )
+                os.replace(tmp_path, self.tail_path)
+                self.tail_changed = False
+        finally:
+            self.release()
+
+    def close(self):
+        self.acquire()
+        try:
+            if self.stream:
+                self.stream.write(self.skipped_line())
+                self.stream.writelines(line for line, _ in self.tail)
+                self.stream.close()
+                self.stream = None
+                # the log is complete
+                try:
+                    self.tail_path.unlink()
+                except FileNotFoundError:
+                    pass
+        finally:
+            self.release()
+            super().close()
+
+
+class ConversionLogHandler(QueueHandler):
+    """
+    Pass the records to a background thread which writes them,
+    so that logging doesn't wait for the disk.
+
+    Closing the handler writes the remaining records and closes the file.
+    """
+
+    def __init__(self, target: logging.Handler):
+        super().__init__(queue.Queue())
+        self.target = target
+        self.listener = QueueListener(self.queue, target, respect_handler_level=True)
+        self.listener.start()
+
+    def close(self):
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+            self.target.close()
+        super().close()
+
+
+def remove_old_logs(logs_dir: Path, max_age: float, max_size: int):
+    """
+    Remove the conversion logs older than 'max_age' seconds,
+    then the oldest ones, until all of them fit into 'max_size' bytes.
+    """
+    logs = []
+    for path in logs_dir.glob("*/*.log*"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            # removed by another worker
+            continue
+        logs.append((stat.st_mtime, stat.st_size, path))
+    logs.sort(reverse=True)
+
+    now = time.time()
+    total_size = 0
+    for mtime, size, path in logs:
+        total_size += size
+        if now - mtime > max_age or total_size > max_size:
+            logger.debug(f"Removing the old log {path}")
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def set_logging_to_file(
+    repo_name: str,
+    commit_sha: str,
+    logs_dir: Path,
+    head_size: int = LOG_HEAD_SIZE,
+    tail_size: int = LOG_TAIL_SIZE,
+    max_age: Optional[float] = None,
+    max_size: Optional[int] = None,
+):
     """
     Set logging to a file for conversion.
     :param repo_name: name of the repository
     :param commit_sha: commit SHA
     :param logs_dir: dir where the logs are stored
-    :return: file handler
+    :param head_size: keep this many bytes of the beginning of the log
+    :param tail_size: and this many bytes of its end
+    :param max_age: remove the logs older than this many seconds from logs_dir
+    :param max_size: and the oldest ones, if all of them are bigger than this,
+        at most once per REMOVE_OLD_LOGS_INTERVAL
+    :return: file handler, close it when the conversion is done
     """
+    removed = _old_logs_removed.get(logs_dir)
+    if (max_age is not None or max_size is not None) and (
+        removed is None or time.monotonic() - removed >= REMOVE_OLD_LOGS_INTERVAL
+    ):
+        _old_logs_removed[logs_dir] = time.monotonic()
+        remove_old_logs(
+            logs_dir,
+            max_age=float("inf") if max_age is None else max_age,
+            max_size=sys.maxsize if max_size is None else max_size,
+        )
+
     logger = logging.getLogger("dist2src")
     logger.setLevel(logging.DEBUG)
     log_dir = logs_dir / repo_name
     log_dir.mkdir(parents=True, exist_ok=True)
-    filename = f"{commit_sha}_{datetime.now().isoformat(timespec='seconds')}.log"
+    filename = f"{commit_sha}_{datetime.now().isoformat(timespec='seconds')}.log.gz"
 
-    file_handler = logging.FileHandler(log_dir / filename)
+    gzip_handler = CappedGzipHandler(log_dir / filename, head_size, tail_size)
     formatter = logging.Formatter(
         "[%(asctime)s %(filename)s %(levelname)s] %(message)s"
     )
-    file_handler.setFormatter(formatter)
+    gzip_handler.setFormatter(formatter)
+    gzip_handler.setLevel(logging.DEBUG)
+
+    file_handler = ConversionLogHandler(gzip_handler)
     file_handler.setLevel(logging.DEBUG)
 
     logger.addHandler(file_handler)
@@ -1,66 +1,214 @@
+import atexit
 import logging
 import os
+import socket
+import threading
+import time
+from typing import Optional
 
-from prometheus_client import CollectorRegistry, Counter, push_to_gateway
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    push_to_gateway,
+    start_http_server,
+)
+
+# A single registry per process, so that metrics accumulate
+# during the lifetime of the process. It's shared with the conversion
+# metrics, see dist2src.metrics.
+from dist2src.metrics import REGISTRY
 
 logger = logging.getLogger(__name__)
 
+RECEIVED_MESSAGES = Counter(
+    "received_messages",
+    "Number of received messages from listener",
+    ["result"],
+    registry=REGISTRY,
+)
 
-class Pushgateway:
-    def __init__(self):
-        self.pushgateway_address = os.getenv("PUSHGATEWAY_ADDRESS")
-        self.registry = CollectorRegistry()
+ABANDONED_UPDATES = Counter(
+    "abandoned_updates",
+    "Number of updates abandoned",
+    registry=REGISTRY,
+)
 
-        # metrics
-        self.received_messages = Counter(
-            "received_messages",
-            "Number of received messages from listener",
-            ["result"],
-            registry=self.registry,
-        )
+CLONES_AVOIDED = Counter(
+    "dist2src_clones_avoided",
+    "Number of dist-git clones avoided by checking the branch head remotely first.",
+    registry=REGISTRY,
+)
 
-        self.abandoned_updates = Counter(
-            "abandoned_updates",
-            "Number of updates abandoned",
-            registry=self.registry,
-        )
+CREATED_UPDATES = Counter(
+    "created_updates",
+    "Number of created updates",
+    registry=REGISTRY,
+)
 
-        self.created_updates = Counter(
-            "created_updates",
-            "Number of created updates",
-            registry=self.registry,
-        )
+FOUND_MISSING_DIST_GIT_REPO = Counter(
+    "found_missing_dist_git_repo",
+    "Number of dist-git repositories found missing by the scheduled updater.",
+    registry=REGISTRY,
+)
 
-        self.found_missing_dist_git_repo = Counter(
-            "found_missing_dist_git_repo",
-            "Number of dist-git repositories found missing by the scheduled updater.",
-            registry=self.registry,
-        )
+CREATED_UPDATE_TASK = Counter(
+    "created_update_task",
+    "Number of update tasks created for out-of-date source-git repos.",
+    registry=REGISTRY,
+)
+
+DIST2SRC_FINISHED_CHECKING_UPDATES = Counter(
+    "dist2src_finished_checking_updates",
+    "Number of times check_updates finished checking all source-git repos.",
+    registry=REGISTRY,
+)
+
+TASK_QUEUE_WAIT = Histogram(
+    "dist2src_task_queue_wait_seconds",
+    "Time update tasks spent waiting in the queue, per lane (realtime, scheduled).",
+    ["lane"],
+    buckets=(1, 10, 30, 60, 300, 600, 1800, 3600, 7200, 14400, 28800, 86400),
+    registry=REGISTRY,
+)
+
+TASK_TIME_TO_FIRST_WORK = Histogram(
+    "dist2src_task_time_to_first_work_seconds",
+    "Time from the start of update tasks to their first useful work (cloning).",
+    ["first_task"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60),
+    registry=REGISTRY,
+)
 
-        self.created_update_task = Counter(
-            "created_update_task",
-            "Number of update tasks created for out-of-date source-git repos.",
-            registry=self.registry,
-        )
 
-        self.dist2src_finished_checking_updates = Counter(
-            "dist2src_finished_checking_updates",
-            "Number of times check_updates finished checking all source-git repos.",
-            registry=self.registry,
+class BackgroundPusher:
+    """
+    Push the registry to Pushgateway from a background thread.
+
+    Push requests made while a push is in progress, or during the
+    'interval' after it, are coalesced into a single push, so a slow
+    Pushgateway never blocks the caller.
+    """
+
+    def __init__(
+        self,
+        registry: CollectorRegistry,
+        job: str = "dist2src-update",
+        interval: Optional[float] = None,
+    ):
+        self.registry = registry
+        self.job = job
+        self.interval = (
+            interval
+            if interval is not None
+            else float(os.getenv("PUSHGATEWAY_PUSH_INTERVAL", "5"))
         )
+        self._requested = threading.Event()
+        self._lock = threading.Lock()
+        self._push_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        # the thread doesn't survive a fork, remember who started it
+        self._pid: Optional[int] = None
+
+    @property
+    def address(self) -> Optional[str]:
+        return os.getenv("PUSHGATEWAY_ADDRESS")
+
+    @property
+    def grouping_key(self):
+        # Every process pushes its own counters, don't let them overwrite each other.
+        return {"instance": os.getenv("PUSHGATEWAY_INSTANCE", socket.gethostname())}
+
+    def request_push(self):
+        """Ask for the metrics to be pushed, without waiting for it."""
+        if not self.address:
+            logger.debug("Pushgateway address not defined.")
+            return
+
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, name="pushgateway-pusher", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.flush)
+        self._requested.set()
+
+    def flush(self):
+        """
+        Push pending metrics synchronously (e.g. before the process exits),
+        waiting for a push in progress to finish.
+        """
+        with self._push_lock:
+            if self._requested.is_set():
+                self._requested.clear()
+                self._push()
+
+    def _run(self):
+        while True:
+            self._requested.wait()
+            with self._push_lock:
+                if self._requested.is_set():
+                    self._requested.clear()
+                    self._push()
+            # requests made in the meantime are pushed together
+            time.sleep(self.interval)
+
+    def _push(self):
+        try:
+            push_to_gateway(
+                self.address,
+                job=self.job,
+                registry=self.registry,
+                grouping_key=self.grouping_key,
+            )
+        except Exception as ex:
+            logger.warning(f"Failed to push metrics to {self.address!r}: {ex}")
+
+
+pusher = BackgroundPusher(REGISTRY)
+
+
+def start_metrics_server(port: Optional[int] = None):
+    """
+    Expose the metrics of this process for scraping,
+    if 'port' or $D2S_METRICS_PORT is set.
+    """
+    port = port or int(os.getenv("D2S_METRICS_PORT") or 0)
+    if not port:
+        logger.debug("Metrics port not defined.")
+        return
+    try:
+        start_http_server(port, registry=REGISTRY)
+    except OSError as ex:
+        logger.warning(f"Unable to expose metrics on port {port}: {ex}")
+        return
+    logger.info(f"Metrics exposed on port {port}.")
+
+
+class Pushgateway:
+    def __init__(self):
+        self.pushgateway_address = os.getenv("PUSHGATEWAY_ADDRESS")
+        self.registry = REGISTRY
+
+        # metrics
+        self.received_messages = RECEIVED_MESSAGES
+        self.abandoned_updates = ABANDONED_UPDATES
+        self.clones_avoided = CLONES_AVOIDED
+        self.created_updates = CREATED_UPDATES
+        self.found_missing_dist_git_repo = FOUND_MISSING_DIST_GIT_REPO
+        self.created_update_task = CREATED_UPDATE_TASK
+        self.dist2src_finished_checking_updates = DIST2SRC_FINISHED_CHECKING_UPDATES
+        self.task_queue_wait = TASK_QUEUE_WAIT
+        self.task_time_to_first_work = TASK_TIME_TO_FIRST_WORK
 
     def push(self):
         """
-        Push collected metrics to Pushgateway
+        Push collected metrics to Pushgateway, in the background
         :return:
         """
-        if not self.pushgateway_address:
-            logger.debug("Pushgateway address not defined.")
-            return
-
-        push_to_gateway(
-            self.pushgateway_address, job="dist2src-update", registry=self.registry
-        )
+        pusher.request_push()
 
     def push_created_update(self):
         """
@@ -98,13 +246,16 @@ class Pushgateway:
         self.created_update_task.inc()
         self.push()
 
-    def push_abandoned_update(self):
+    def push_abandoned_update(self, clone_avoided: bool = False):
         """
         Push info about abandoning an update because the dist-git repo
         has different content than the update event
+        :param clone_avoided: the update was abandoned before cloning dist-git
         :return:
         """
         self.abandoned_updates.inc()
+        if clone_avoided:
+            self.clones_avoided.inc()
         self.push()
 
     def push_dist2src_finished_checking_updates(self):
@@ -115,3 +266,25 @@ class Pushgateway:
         """
         self.dist2src_finished_checking_updates.inc()
         self.push()
+
+    def push_task_queue_wait(self, lane: str, seconds: float):
+        """
+        Push the time a task waited in the queue to Pushgateway
+        :param lane: lane of the task, realtime or scheduled
+        :param seconds: time between sending and starting the task
+        :return:
+        """
+        self.task_queue_wait.labels(lane=lane).observe(max(seconds, 0))
+        self.push()
+
+    def push_time_to_first_work(self, seconds: float, first_task: bool):
+        """
+        Push the time a task took to start its first useful work to Pushgateway
+        :param seconds: time between the start of the task and its first work
+        :param first_task: whether this was the first task of the worker process
+        :return:
+        """
+        self.task_time_to_first_work.labels(
+            first_task="true" if first_task else "false"
+        ).observe(seconds)
+        self.push()
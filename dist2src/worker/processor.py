@@ -4,49 +4,60 @@
 import shutil
 from logging import getLogger
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional
 
 import git
 from ogr.services.gitlab import GitlabProject
 
-from dist2src.constants import IGNORED_PACKAGES
+from dist2src.constants import IGNORED_PACKAGES, START_TAG_TEMPLATE
 from dist2src.core import Dist2Src
+from dist2src.git_snapshot import GitSnapshot
+from dist2src.journal import Journal
+from dist2src.metrics import StageTimings
+from dist2src.worker import bootstrap
 from dist2src.worker import logging as worker_logging
 from dist2src.worker import sentry
 from dist2src.worker.config import Configuration
 from dist2src.worker.monitoring import Pushgateway
+from dist2src.worker.remote import get_existing_tags, ls_remote
 
 logger = getLogger(__name__)
 
 
 class Processor:
-    def __init__(self):
-        self.cfg = Configuration()
+    def __init__(self, cfg: Optional[Configuration] = None):
+        self.cfg = cfg or Configuration()
 
         self.fullname: Optional[str] = None
         self.name: Optional[str] = None
-        self.branch: Optional[str] = None
-        self.end_commit: Optional[str] = None
+        # {branch: end commit} to convert, in this order
+        self.branches: Dict[str, str] = {}
         self.dist_git_dir: Optional[Path] = None
         self.src_git_dir: Optional[Path] = None
 
     def process_message(self, event: dict, **kwargs):
         self.fullname = event["repo"]["fullname"]
         self.name = event["repo"]["name"]
-        self.branch = event["branch"]
-        self.end_commit = event["end_commit"]
+        # Several branches of the package can be converted by a single task,
+        # 'branch' and 'end_commit' are the first one of them.
+        self.branches = dict(
+            event.get("branches") or {event["branch"]: event["end_commit"]}
+        )
         self.dist_git_dir = self.cfg.workdir / self.cfg.dist_git_namespace / self.name
         self.src_git_dir = self.cfg.workdir / self.cfg.src_git_namespace / self.name
         sentry.set_tag("repo", self.fullname)
-        sentry.set_tag("branch", self.branch)
+        sentry.set_tag("branch", ",".join(self.branches))
 
         logger.info(f"Processing message with {event}")
         # Should this package and branch be ignored?
-        if (self.name, self.branch) in IGNORED_PACKAGES:
-            logger.info(
-                f"Ignore update event for {self.fullname}. "
-                f"{self.name!r}, branch {self.branch!r} is configured to be ignored."
-            )
+        for branch in list(self.branches):
+            if (self.name, branch) in IGNORED_PACKAGES:
+                logger.info(
+                    f"Ignore update event for {self.fullname}. "
+                    f"{self.name!r}, branch {branch!r} is configured to be ignored."
+                )
+                del self.branches[branch]
+        if not self.branches:
             Pushgateway().push_received_message(ignored=True)
             return
 
@@ -60,12 +71,15 @@ class Processor:
             return
 
         # Should this branch be updated?
-        if self.branch not in self.cfg.branches_watched:
-            logger.info(
-                f"Ignore update event for {self.fullname}. "
-                f"Branch {self.branch!r} is not one of the "
-                f"watched branches: {self.cfg.branches_watched}."
-            )
+        for branch in list(self.branches):
+            if branch not in self.cfg.branches_watched:
+                logger.info(
+                    f"Ignore update event for {self.fullname}. "
+                    f"Branch {branch!r} is not one of the "
+                    f"watched branches: {self.cfg.branches_watched}."
+                )
+                del self.branches[branch]
+        if not self.branches:
             Pushgateway().push_received_message(ignored=True)
             return
 
@@ -83,87 +97,211 @@ class Processor:
             return
 
         # check if the repository is up to date
-        conversion_tag = f"convert/{self.branch}/{self.end_commit}"
-        if conversion_tag in src_git_project.get_tags():
-            logger.info(
-                f"Ignore update event for {self.fullname}. "
-                "The source-git repo is already up to date."
-            )
+        existing_tags = get_existing_tags(
+            src_git_project, list(self.conversion_tags.values())
+        )
+        for branch, conversion_tag in self.conversion_tags.items():
+            if conversion_tag in existing_tags:
+                logger.info(
+                    f"Ignore update event for {self.fullname}, branch {branch!r}. "
+                    "The source-git repo is already up to date."
+                )
+                del self.branches[branch]
+        if not self.branches:
             Pushgateway().push_received_message(ignored=True)
             return
 
         Pushgateway().push_received_message(ignored=False)
         file_handler = worker_logging.set_logging_to_file(
-            repo_name=self.name, commit_sha=self.end_commit, logs_dir=self.cfg.logs_dir
+            repo_name=self.name,
+            commit_sha=event["end_commit"],
+            logs_dir=self.cfg.logs_dir,
+            head_size=self.cfg.log_head_size,
+            tail_size=self.cfg.log_tail_size,
+            max_age=self.cfg.logs_max_age,
+            max_size=self.cfg.logs_max_size,
         )
 
         try:
-            self.update_project(src_git_project, conversion_tag)
+            self.update_project(src_git_project)
         finally:
             getLogger("dist2src").removeHandler(file_handler)
-            self.cleanup()
+            # writes the rest of the log
+            file_handler.close()
+            if Journal.read(self.src_git_dir):
+                logger.info("Keeping the workdir, the conversion can be resumed.")
+            else:
+                self.cleanup()
 
-    def update_project(self, project: GitlabProject, conversion_tag: str):
-        self.cleanup()
-        # Clone repo from rpms/ and checkout the branch.
-        dist_git_repo = git.Repo.clone_from(
-            f"https://{self.cfg.dist_git_host}/{self.fullname}.git", self.dist_git_dir
-        )
-        dist_git_repo.git.checkout(self.branch)
-
-        # Check if the commit is the one we are expecting.
-        if dist_git_repo.branches[self.branch].commit.hexsha != self.end_commit:
-            logger.warning(
-                f"Abandon updating {self.name}. "
-                f"HEAD of {self.branch!r} is not matching commit "
-                f"{self.end_commit!r} for which this updated was started."
-            )
-            Pushgateway().push_abandoned_update()
+    @property
+    def conversion_tags(self) -> Dict[str, str]:
+        """{branch: tag marking the conversion of its end commit}"""
+        return {
+            branch: f"convert/{branch}/{commit}"
+            for branch, commit in self.branches.items()
+        }
+
+    def update_project(self, project: GitlabProject):
+        timings = StageTimings()
+        try:
+            self._update_project(project, timings)
+        finally:
+            timings.observe()
+
+    def _update_project(self, project: GitlabProject, timings: StageTimings):
+        resumed_branch = self.get_resumed_branch()
+        resume = resumed_branch is not None
+        if not resume:
+            self.cleanup()
+        bootstrap.observe_time_to_first_work()
+        for branch in self.get_stale_branches():
+            del self.branches[branch]
+            Pushgateway().push_abandoned_update(clone_avoided=True)
+        if not self.branches:
             return
+        if resume:
+            logger.info(f"Resuming the interrupted conversion of {self.name}.")
+            dist_git_repo = git.Repo(self.dist_git_dir)
+        else:
+            # Clone repo from rpms/ and checkout the branches.
+            with timings.stage("clone"):
+                dist_git_repo = git.Repo.clone_from(
+                    f"{self.cfg.dist_git_url}/{self.fullname}.git",
+                    self.dist_git_dir,
+                )
+                for branch in self.branches:
+                    dist_git_repo.git.checkout(branch)
 
-        # Clone repo from source-git/ using ssh, so it can be pushed later on.
-        src_git_ssh_url = project.get_git_urls()["ssh"]
-        src_git_repo = git.Repo.clone_from(
-            src_git_ssh_url,
-            self.src_git_dir,
-        )
+        # Check if the commits are the ones we are expecting.
+        for branch, commit in list(self.branches.items()):
+            if dist_git_repo.branches[branch].commit.hexsha != commit:
+                logger.warning(
+                    f"Abandon updating {self.name}. "
+                    f"HEAD of {branch!r} is not matching commit "
+                    f"{commit!r} for which this updated was started."
+                )
+                Pushgateway().push_abandoned_update()
+                del self.branches[branch]
+        if not self.branches:
+            return
 
-        # Check-out the source-git branch, if already exists,
-        # so that 'convert' knows that this is an update.
-        remote_heads = [
-            ref.remote_head
-            for ref in src_git_repo.references
-            if isinstance(ref, git.RemoteReference)
-        ]
-        if self.branch in remote_heads:
-            src_git_repo.git.checkout(self.branch)
+        if resume:
+            src_git_repo = git.Repo(self.src_git_dir)
+        else:
+            src_git_repo = self._clone_src_git(project, timings)
 
+        # The clones, the downloaded sources and the spec cache
+        # are shared by the conversions of the branches.
         d2s = Dist2Src(
             dist_git_path=self.dist_git_dir,
             source_git_path=self.src_git_dir,
+            timings=timings,
         )
-        d2s.convert(self.branch, self.branch)
+        # All the refs at once. The loop below only adds the tags
+        # of the branches it's done with, so they don't need to be read again.
+        src_git_refs = GitSnapshot(src_git_repo).refs
+        remote_heads = [
+            ref.split("/", 3)[3]
+            for ref in src_git_refs
+            if ref.startswith("refs/remotes/origin/")
+        ]
+        for branch, conversion_tag in self.conversion_tags.items():
+            if resume and f"refs/tags/{conversion_tag}" in src_git_refs:
+                logger.info(f"{branch!r} was converted before the interruption.")
+                continue
+            if branch != resumed_branch and branch in remote_heads:
+                # Check-out the source-git branch, if already exists,
+                # so that 'convert' knows that this is an update.
+                src_git_repo.git.checkout(branch)
+            d2s.convert(branch, branch)
+            try:
+                src_git_repo.git.tag(
+                    "--annotate",
+                    "--message",
+                    f"Converted from commit {self.branches[branch]},\n"
+                    f"from branch {branch}.",
+                    conversion_tag,
+                    src_git_repo.heads[branch].commit,
+                )
+            except git.GitCommandError as ex:
+                if "already exists" in ex.stderr:
+                    # It might happen that an another task already updated the branch.
+                    # If this is the case, don't push it, but go on with the others.
+                    logger.info(f"{branch!r} was already converted by another task.")
+                    del self.branches[branch]
+                else:
+                    raise
+        if not self.branches:
+            return
+
+        # Push the result to source-git, all the branches or none of them.
+        # Only the tags of these branches: the conversion of a dropped one
+        # might have moved its upstream ref tag, which is not pushed then.
+        # Update moves the upstream ref tag, we need --force to move it in remote.
+        refspecs = []
+        for branch, conversion_tag in self.conversion_tags.items():
+            refspecs += [
+                branch,
+                f"refs/tags/{conversion_tag}",
+                f"refs/tags/{START_TAG_TEMPLATE.format(branch=branch)}",
+            ]
+        with timings.stage("push"):
+            src_git_repo.git.push("origin", *refspecs, force=True, atomic=True)
+        for _ in self.branches:
+            Pushgateway().push_created_update()
+
+    def _clone_src_git(self, project: GitlabProject, timings: StageTimings) -> git.Repo:
+        # Clone repo from source-git/ using ssh, so it can be pushed later on.
+        src_git_ssh_url = project.get_git_urls()["ssh"]
+        with timings.stage("clone"):
+            src_git_repo = git.Repo.clone_from(
+                src_git_ssh_url,
+                self.src_git_dir,
+            )
+        return src_git_repo
+
+    def get_stale_branches(self) -> List[str]:
+        """
+        Branches in dist-git which are not at the commit of the event anymore.
 
+        Checked with 'git ls-remote', to abandon stale events without cloning.
+        When the check fails, the commits are checked after cloning instead.
+        """
+        refs = {f"refs/heads/{branch}": branch for branch in self.branches}
         try:
-            src_git_repo.git.tag(
-                "--annotate",
-                "--message",
-                f"Converted from commit {self.end_commit},\nfrom branch {self.branch}.",
-                conversion_tag,
-                src_git_repo.heads[self.branch].commit,
+            heads = ls_remote(
+                f"{self.cfg.dist_git_url}/{self.fullname}.git", *refs, heads=True
             )
-        except git.GitCommandError as ex:
-            if "already exists" in ex.stderr:
-                # It might happen that an another task already updated the repo.
-                # If this is the case, do nothing.
-                return
-            else:
-                raise
+        except Exception as ex:
+            logger.info(f"Unable to check the heads of {self.name} remotely: {ex!r}")
+            return []
+        stale = []
+        for ref, branch in refs.items():
+            commit = self.branches[branch]
+            if heads.get(ref) != commit:
+                logger.warning(
+                    f"Abandon updating {self.name}. "
+                    f"HEAD of {branch!r} ({heads.get(ref)}) is not matching commit "
+                    f"{commit!r} for which this updated was started."
+                )
+                stale.append(branch)
+        return stale
 
-        # Push the result to source-git.
-        # Update moves the upstream ref tag, we need --tags --force to move it in remote.
-        src_git_repo.git.push("origin", self.branch, tags=True, force=True)
-        Pushgateway().push_created_update()
+    def get_resumed_branch(self) -> Optional[str]:
+        """
+        Is there an interrupted conversion of one of the commits
+        in the workdir (kept by a previous attempt)?
+
+        :return: the branch of the interrupted conversion, None if there is none
+        """
+        journal = Journal.read(self.src_git_dir)
+        if not journal or not self.dist_git_dir.is_dir():
+            return None
+        conversion = journal["conversion"]
+        branch = conversion.get("origin_branch")
+        if self.branches.get(branch) != conversion.get("dist_git_commit"):
+            return None
+        return branch
 
     def cleanup(self):
         """
@@ -0,0 +1,87 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+import os
+import subprocess
+from logging import getLogger
+from typing import Dict, Iterable, Set
+
+from gitlab import GitlabGetError
+from ogr.services.gitlab import GitlabProject
+
+logger = getLogger(__name__)
+
+
+class RemoteNotFound(Exception):
+    """The remote repository does not exist."""
+
+
+def ls_remote(
+    url: str, *patterns: str, heads: bool = False, tags: bool = False
+) -> Dict[str, str]:
+    """
+    Run 'git ls-remote' on a remote repository.
+
+    Protocol v2 is requested, so that the server only advertises the refs
+    under 'refs/heads/' and/or 'refs/tags/' (ref-prefix), instead of
+    all the refs in the repository.
+
+    :param url: URL (or path) of the remote repository
+    :param patterns: only list refs matching these patterns
+    :param heads: limit to refs/heads
+    :param tags: limit to refs/tags
+    :return: {ref: sha} for the refs found, peeled tags ('^{}') are omitted
+    :raises RemoteNotFound: when the remote repository does not exist
+    """
+    cmd = ["git", "-c", "protocol.version=2", "ls-remote"]
+    if heads:
+        cmd.append("--heads")
+    if tags:
+        cmd.append("--tags")
+    cmd += [url, *patterns]
+    logger.debug(f"Running {cmd}")
+    try:
+        output = subprocess.check_output(
+            cmd,
+            stderr=subprocess.PIPE,
+            # never block on asking for credentials
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+        )
+    except subprocess.CalledProcessError as ex:
+        stderr = ex.stderr.decode()
+        if "not found" in stderr or "does not appear to be a git repository" in stderr:
+            raise RemoteNotFound(f"{url}: {stderr.strip()}") from ex
+        raise
+
+    refs: Dict[str, str] = {}
+    for line in output.decode().splitlines():
+        sha, ref = line.split("\t", 1)
+        if ref.endswith("^{}"):
+            continue
+        refs[ref] = sha
+    return refs
+
+
+def get_existing_tags(project: GitlabProject, names: Iterable[str]) -> Set[str]:
+    """
+    Find out which of the tags exist in a GitLab project.
+
+    Each tag is looked up by its name, instead of listing all the tags,
+    which grow with every update of the repository.
+
+    :param project: the project to look in
+    :param names: names of the tags
+    :return: names of the tags which exist
+    :raises GitlabGetError: when the project does not exist (404)
+    """
+    tags = project.gitlab_repo.tags
+    existing = set()
+    for name in names:
+        try:
+            tags.get(name)
+        except GitlabGetError as ex:
+            if ex.response_code == 404:
+                continue
+            raise
+        existing.add(name)
+    return existing
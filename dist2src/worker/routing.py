@@ -0,0 +1,148 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+Route the update tasks to queues by their estimated cost, so that long
+conversions (kernel, gcc...) don't block the small ones, and by their lane,
+so that the scheduled catch-up work doesn't delay the real-time events.
+"""
+import os
+import re
+import time
+from logging import getLogger
+from typing import NamedTuple, Optional
+
+from celery.result import AsyncResult
+
+from dist2src.constants import LOOKASIDE_URL, VERY_VERY_HARD_PACKAGES
+from dist2src.prep_analysis import get_prep_verdict
+from dist2src.sessions import get_session
+from dist2src.worker import singular_fork
+from dist2src.worker.config import Configuration, Queue
+
+logger = getLogger(__name__)
+
+PATCH_TAG = re.compile(r"^Patch\d*\s*:", re.IGNORECASE | re.MULTILINE)
+
+# lanes: tasks for events from dist-git and tasks created by the scheduled updater
+REALTIME = "realtime"
+SCHEDULED = "scheduled"
+
+
+class Cost(NamedTuple):
+    """estimated cost of converting a package"""
+
+    # total size of the lookaside sources in bytes, None if unknown
+    size: Optional[int]
+    # number of patches in the spec file, None if unknown
+    patches: Optional[int]
+    # one of the VERY_VERY_HARD_PACKAGES, or its %prep can't be converted commit by commit
+    hard: bool
+
+
+def estimate_cost(cfg: Configuration, name: str, ref: str) -> Cost:
+    """
+    estimate the cost of converting a dist-git repo at 'ref',
+    without cloning it
+
+    :param name: name of the dist-git repo (package)
+    :param ref: branch or commit to estimate the cost of
+    """
+    if name in VERY_VERY_HARD_PACKAGES:
+        return Cost(size=None, patches=None, hard=True)
+    project = cfg.dist_git_svc.get_project(
+        namespace=singular_fork(cfg.dist_git_namespace), repo=name, username="packit"
+    )
+    size: Optional[int] = None
+    patches: Optional[int] = None
+    hard = False
+    try:
+        metadata = project.get_file_content(f".{name}.metadata", ref=ref)
+        size = sum(_source_size(name, ref, line) for line in metadata.splitlines())
+    except Exception as ex:
+        logger.info(f"Unable to find out the size of the sources of {name}: {ex!r}")
+    try:
+        spec = project.get_file_content(f"SPECS/{name}.spec", ref=ref)
+        patches = len(PATCH_TAG.findall(spec))
+        hard = get_prep_verdict(spec).single_commit
+    except Exception as ex:
+        logger.info(f"Unable to count the patches of {name}: {ex!r}")
+    return Cost(size=size, patches=patches, hard=hard)
+
+
+def _source_size(name: str, branch: str, metadata_line: str) -> int:
+    """size of a source listed in the lookaside metadata file, 0 for empty lines"""
+    if not metadata_line.strip():
+        return 0
+    sha = metadata_line.split()[0]
+    lookaside_url = os.getenv("DIST2SRC_LOOKASIDE_URL", LOOKASIDE_URL)
+    session = get_session("lookaside")
+    response = session.head(f"{lookaside_url}/{name}/{branch}/{sha}")
+    if response.status_code == 404:
+        # sources of some packages are only in c8, see Dist2Src.get_lookaside_sources
+        response = session.head(f"{lookaside_url}/{name}/c8/{sha}")
+    response.raise_for_status()
+    return int(response.headers["Content-Length"])
+
+
+def select_queue(cfg: Configuration, cost: Cost) -> Queue:
+    """the large queue for hard, big or heavily patched packages, or when unsure"""
+    if (
+        cost.hard
+        or cost.size is None
+        or cost.patches is None
+        or cost.size >= cfg.large_size_threshold
+        or cost.patches >= cfg.large_patches_threshold
+    ):
+        return cfg.large_queue
+    return cfg.small_queue
+
+
+def lane_queue(queue_name: str, lane: str) -> str:
+    """name of the queue for the tasks of 'lane', scheduled tasks have their own"""
+    return queue_name if lane == REALTIME else f"{queue_name}-{lane}"
+
+
+def send_update_task(
+    cfg: Configuration,
+    task_name: str,
+    event: dict,
+    expires: Optional[int] = None,
+    lane: str = SCHEDULED,
+) -> AsyncResult:
+    """
+    send a task to update a source-git repo for the dist-git 'event',
+    to the queue of its lane, and matching its cost if routing is enabled
+
+    Real-time tasks go to the default queue, if routing is disabled.
+
+    :param task_name: name of the Celery task processing the event
+    :param expires: seconds after which the task expires
+    :param lane: REALTIME or SCHEDULED
+    """
+    # Introduce the celery_app as a dependency only when sending tasks.
+    from dist2src.worker.celerizer import celery_app
+
+    options = {}
+    if cfg.task_routing:
+        cost = estimate_cost(cfg, event["repo"]["name"], event["branch"])
+        queue = select_queue(cfg, cost)
+        options = {
+            "queue": lane_queue(queue.name, lane),
+            "soft_time_limit": queue.soft_time_limit,
+            "time_limit": queue.time_limit,
+        }
+        logger.info(f"Routing {event['repo']['name']} ({cost}) to {options['queue']!r}")
+    elif lane != REALTIME:
+        options = {"queue": lane_queue(cfg.scheduled_queue_prefix, lane)}
+    kwargs = {
+        "event": event,
+        # don't route again
+        "routed": True,
+        # to measure how long the task waits in the queue
+        "lane": lane,
+        "queued_at": time.time(),
+    }
+    logger.debug(f"Sending task {task_name!r}, with payload: {event}")
+    return celery_app.send_task(
+        name=task_name, expires=expires, kwargs=kwargs, **options
+    )
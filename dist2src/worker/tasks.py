@@ -1,13 +1,27 @@
 # Copyright Contributors to the Packit project.
 # SPDX-License-Identifier: MIT
 
+import time
 from os import getenv
 from typing import Optional
 
+from dist2src.worker.bootstrap import get_configuration
 from dist2src.worker.celerizer import celery_app
+from dist2src.worker.monitoring import Pushgateway
 from dist2src.worker.processor import Processor
+from dist2src.worker.routing import REALTIME, send_update_task
 
 
 @celery_app.task(name=getenv("CELERY_TASK_NAME"))
 def process_message(event: dict, **kwargs) -> Optional[dict]:
-    return Processor().process_message(event=event)
+    cfg = get_configuration()
+    if cfg.task_routing and not kwargs.get("routed"):
+        # Events from the message listener come to the default queue,
+        # pass them on to the queue matching their cost.
+        send_update_task(cfg, process_message.name, event, lane=REALTIME)
+        return None
+    if "queued_at" in kwargs:
+        Pushgateway().push_task_queue_wait(
+            kwargs.get("lane", REALTIME), time.time() - kwargs["queued_at"]
+        )
+    return Processor(cfg).process_message(event=event)
@@ -2,8 +2,9 @@
 # SPDX-License-Identifier: MIT
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
-from typing import List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 from gitlab import GitlabGetError
 from gitlab.v4.objects import Group
@@ -13,6 +14,8 @@ from dist2src.worker import sentry
 from dist2src.worker import singular_fork, plural_fork
 from dist2src.worker.config import Configuration
 from dist2src.worker.monitoring import Pushgateway
+from dist2src.worker.remote import RemoteNotFound, get_existing_tags, ls_remote
+from dist2src.worker.routing import SCHEDULED, send_update_task
 
 logger = getLogger(__name__)
 
@@ -28,9 +31,15 @@ class Updater:
 
     def __init__(self, configuration: Optional[Configuration] = None):
         self.cfg = configuration or Configuration()
+        # Cursor of the page of projects being checked,
+        # can be used to resume checking updates from this page.
+        self.cursor: Optional[str] = None
 
     def check_updates(
-        self, project: Optional[str] = None, branch: Optional[str] = None
+        self,
+        project: Optional[str] = None,
+        branch: Optional[str] = None,
+        cursor: Optional[str] = None,
     ):
         """
         Check if repositories in a source-git namespace need to be updated
@@ -38,6 +47,8 @@ class Updater:
 
         Limit the checks to 'project' and 'branch', if the arguments are
         specified.
+
+        Start from the page of projects pointed to by 'cursor', if specified.
         """
         logger.debug(f"Source-git instance: {self.cfg.src_git_svc.instance_url!r}")
         logger.debug(f"Source-git namespace: {self.cfg.src_git_namespace!r}")
@@ -52,39 +63,82 @@ class Updater:
         else:
             logger.debug("Celery tasks created never expire")
 
-        src_gitlab_group = self.cfg.src_git_svc.gitlab_instance.groups.get(
-            self.cfg.src_git_namespace
-        )
-
         # Check and update only 'project' if defined, otherwise
         # check and update all the projects in the namespace.
-        n = 1
         if project:
-            projects = [project]
+            projects: Iterable[str] = [project]
         else:
-            projects = self._get_project_name_in_group_for_page(src_gitlab_group, n)
+            src_gitlab_group = self.cfg.src_git_svc.gitlab_instance.groups.get(
+                self.cfg.src_git_namespace
+            )
+            projects = self._iter_project_names_in_group(src_gitlab_group, cursor)
 
-        while projects:
-            for project_to_be_processed in projects:
-                self._check_and_update_project(project_to_be_processed, branch=branch)
-            if project:
-                # there is only a single project to check
-                break
-            n += 1
-            projects = self._get_project_name_in_group_for_page(src_gitlab_group, n)
+        for project_to_be_processed in projects:
+            self._check_and_update_project(project_to_be_processed, branch=branch)
 
         Pushgateway().push_dist2src_finished_checking_updates()
 
-    def _get_project_name_in_group_for_page(
-        self, gitlab_group: Group, page: int
-    ) -> List[str]:
-        """return a list of project names in a GitLab namespace for a given page"""
-        return [
-            p.name
-            for p in gitlab_group.projects.list(
-                page=page, per_page=self.PROJECTS_PER_PAGE
+    def _get_project_names_page(
+        self, gitlab_group: Group, cursor: Optional[str] = None
+    ) -> Tuple[List[str], Optional[str]]:
+        """
+        return the project names on a page of a GitLab group
+        and the cursor pointing to the next page (None for the last page)
+
+        :param gitlab_group: group to list the projects from
+        :param cursor: URL of the page, as returned by a previous call,
+            None to start from the first page
+        """
+        gitlab_instance = gitlab_group.projects.gitlab
+        if cursor:
+            response = gitlab_instance.http_request("get", cursor)
+        else:
+            response = gitlab_instance.http_request(
+                "get",
+                gitlab_group.projects.path,
+                query_data={
+                    # Keyset pagination doesn't slow down at deep pages and
+                    # doesn't skip or repeat projects created during a scan.
+                    "pagination": "keyset",
+                    "order_by": "id",
+                    "sort": "asc",
+                    "per_page": self.PROJECTS_PER_PAGE,
+                    # Only the names are needed, skip the rest.
+                    "simple": True,
+                },
             )
-        ]
+        next_cursor = response.links.get("next", {}).get("url")
+        return [p["name"] for p in response.json()], next_cursor
+
+    def _iter_project_names_in_group(
+        self, gitlab_group: Group, cursor: Optional[str] = None
+    ) -> Iterator[str]:
+        """
+        yield the names of all the projects in a GitLab group
+
+        The next page is fetched in the background, while the projects
+        of the current page are being processed.
+
+        :param gitlab_group: group to list the projects from
+        :param cursor: start from this page, see 'Updater.cursor'
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            page = executor.submit(self._get_project_names_page, gitlab_group, cursor)
+            while page is not None:
+                names, next_cursor = page.result()
+                page = (
+                    executor.submit(
+                        self._get_project_names_page, gitlab_group, next_cursor
+                    )
+                    if next_cursor
+                    else None
+                )
+                if cursor:
+                    logger.debug(f"Checking projects from page {cursor!r}")
+                self.cursor = cursor
+                yield from names
+                cursor = next_cursor
+        self.cursor = None
 
     def _check_and_update_project(self, project: str, branch: Optional[str] = None):
         """check selected src repo and queue update tasks for branch which are out of date"""
@@ -96,11 +150,17 @@ class Updater:
             )
             Pushgateway().push_found_missing_dist_git_repo()
             return
-        for branch, commit in self._get_out_of_date_branches(project, branch):
+        out_of_date = sorted(self._get_out_of_date_branches(project, branch))
+        for branch, commit in out_of_date:
             logger.info(
                 f"Branch {branch!r} from project {project!r} needs to be updated."
             )
-            self._create_task(dist_git_project, branch, commit)
+        if out_of_date:
+            # all the branches of the project are converted by one task
+            branch, commit = out_of_date[0]
+            self._create_task(
+                dist_git_project, branch, commit, branches=dict(out_of_date)
+            )
 
     def _get_dist_git(self, project: str) -> PagureProject:
         """get corresponding dist-git repo for a src repo"""
@@ -119,55 +179,116 @@ class Updater:
         the branches are out of date against their dist-git counterparts and need updating
         """
         logger.debug(f"Checking project {project!r}...")
+        branches_watched = [
+            b for b in self.cfg.branches_watched if branch is None or b == branch
+        ]
         # Get branches with commits from their HEAD from dist-git
-        url = (
-            f"{self.cfg.dist_git_svc.api_url}"
-            f"{singular_fork(self.cfg.dist_git_namespace)}/{project}/git/branches"
-        )
-        r = self.cfg.dist_git_svc.call_api(url, params={"with_commits": True})
-
-        branch_filter = None
-        if branch:
-            branch_filter = lambda x: x == branch  # noqa
+        if self.cfg.out_of_date_backend == "git":
+            dist_git_branches = self._get_dist_git_branches_from_git(
+                project, branches_watched
+            )
+        else:
+            dist_git_branches = self._get_dist_git_branches_from_api(project)
 
         # Use a dict here, to save the branch corresponding to each convert-tag,
         # so that it doesn't need to be calculated again.
         expected_tags = {
             f"convert/{b}/{c}": (b, c)
-            for b, c in r["branches"].items()
-            if b in filter(branch_filter, self.cfg.branches_watched)
+            for b, c in dist_git_branches.items()
+            if b in branches_watched
         }
         expected_tags_set = set(expected_tags)
         logger.debug(f"Tags expected in source-git: {expected_tags_set}")
 
+        # Look up only the expected tags in source-git
+        if self.cfg.out_of_date_backend == "git":
+            src_git_tags = self._get_src_git_tags_from_git(project, expected_tags_set)
+        else:
+            src_git_tags = self._get_src_git_tags_from_api(project, expected_tags_set)
+        logger.debug(f"Expected tags found in source-git: {src_git_tags}")
+        missing_tags = expected_tags_set - src_git_tags
+        logger.debug(f"Tags missing from source-git: {missing_tags}")
+        return [expected_tags[tag] for tag in missing_tags]
+
+    def _get_dist_git_branches_from_api(self, project: str) -> Dict[str, str]:
+        """return {branch: commit} of a dist-git repo using the Pagure API"""
+        url = (
+            f"{self.cfg.dist_git_svc.api_url}"
+            f"{singular_fork(self.cfg.dist_git_namespace)}/{project}/git/branches"
+        )
+        r = self.cfg.dist_git_svc.call_api(url, params={"with_commits": True})
+        return r["branches"]
+
+    def _get_src_git_tags_from_api(self, project: str, tags: Set[str]) -> Set[str]:
+        """return which of the 'tags' exist in a source-git repo using the GitLab API"""
+        if not tags:
+            return set()
         src_git_project = self.cfg.src_git_svc.get_project(
             repo=project, namespace=self.cfg.src_git_namespace
         )
-        # Get tags from source-git
         try:
-            src_git_tags = set(tag.name for tag in src_git_project.get_tags())
+            return get_existing_tags(src_git_project, tags)
         except GitlabGetError as ex:
             logger.info(f"Unable to obtain tags of {project}: {ex}")
             if ex.response_code == 404:
-                src_git_tags = set()
-            else:
-                raise
-        logger.debug(f"Current tags in source-git: {src_git_tags}")
-        missing_tags = expected_tags_set - src_git_tags
-        logger.debug(f"Tags missing from source-git: {missing_tags}")
-        return [expected_tags[tag] for tag in missing_tags]
+                return set()
+            raise
+
+    def _dist_git_url(self, project: str) -> str:
+        return (
+            f"{self.cfg.dist_git_url}/"
+            f"{plural_fork(self.cfg.dist_git_namespace)}/{project}.git"
+        )
+
+    def _src_git_url(self, project: str) -> str:
+        return f"{self.cfg.src_git_url}/{self.cfg.src_git_namespace}/{project}.git"
+
+    def _get_dist_git_branches_from_git(
+        self, project: str, branches: List[str]
+    ) -> Dict[str, str]:
+        """return {branch: commit} of a dist-git repo using 'git ls-remote'"""
+        heads = ls_remote(
+            self._dist_git_url(project),
+            *(f"refs/heads/{b}" for b in branches),
+            heads=True,
+        )
+        return {ref.replace("refs/heads/", "", 1): sha for ref, sha in heads.items()}
 
-    def _create_task(self, project: PagureProject, branch: str, commit: str):
-        """create a task to update selected (project, branch, commit)"""
+    def _get_src_git_tags_from_git(self, project: str, tags: Set[str]) -> Set[str]:
+        """return which of the 'tags' exist in a source-git repo using 'git ls-remote'"""
+        if not tags:
+            return set()
+        try:
+            # git filters the advertised tags on the client side,
+            # only the expected ones are kept
+            found = ls_remote(
+                self._src_git_url(project),
+                *(f"refs/tags/{tag}" for tag in sorted(tags)),
+                tags=True,
+            )
+        except RemoteNotFound as ex:
+            logger.info(f"Unable to obtain tags of {project}: {ex}")
+            return set()
+        return {ref.replace("refs/tags/", "", 1) for ref in found} & tags
+
+    def _create_task(
+        self,
+        project: PagureProject,
+        branch: str,
+        commit: str,
+        branches: Optional[Dict[str, str]] = None,
+    ):
+        """
+        create a task to update selected (project, branch, commit)
+
+        :param branches: {branch: commit} to update by the same task,
+                         including 'branch'
+        """
         task_name = os.getenv("CELERY_TASK_NAME")
         if task_name is None:
             logger.debug("No task name is set, skip creating a Celery task.")
             return
 
-        # Introduce the celery_app as a dependency only if there is a
-        # Celery task name configured.
-        from dist2src.worker.celerizer import celery_app
-
         event = {
             "repo": {
                 "fullname": plural_fork(project.full_repo_name),
@@ -176,11 +297,14 @@ class Updater:
             "branch": branch,
             "end_commit": commit,
         }
-        logger.debug(f"Sending task {task_name!r}, with payload: {event}")
-        r = celery_app.send_task(
-            name=task_name,
+        if branches and len(branches) > 1:
+            event["branches"] = branches
+        r = send_update_task(
+            self.cfg,
+            task_name,
+            event,
             expires=self.cfg.update_task_expires,
-            kwargs={"event": event},
+            lane=SCHEDULED,
         )
         logger.info(f"Task UUID={r.id} sent to Celery.")
         Pushgateway().push_created_update_task()
@@ -32,7 +32,14 @@ grep -q "${D2S_DIST_GIT_HOST}" known_hosts || ssh-keyscan "${D2S_DIST_GIT_HOST}"
 grep -q "${D2S_SRC_GIT_HOST}" known_hosts || ssh-keyscan "${D2S_SRC_GIT_HOST}" >>known_hosts
 popd
 
+# queues: Comma-separated list of queues to consume from, e.g. only the large
+# or only the real-time update tasks, see dist2src/worker/routing.py.
+# All the queues by default.
+DEFAULT_QUEUES="celery,dist2src-small,dist2src-large"
+DEFAULT_QUEUES+=",dist2src-scheduled,dist2src-small-scheduled,dist2src-large-scheduled"
+CELERY_QUEUES="${CELERY_QUEUES:-$DEFAULT_QUEUES}"
+
 # concurrency: Number of concurrent worker processes/threads/green threads executing tasks.
 # prefetch-multiplier: How many messages to prefetch at a time multiplied by the number of concurrent processes.
 # http://docs.celeryproject.org/en/latest/userguide/optimizing.html#prefetch-limits
-exec celery worker --app="${APP}" --loglevel=${LOGLEVEL} --concurrency=1 --prefetch-multiplier=1
+exec celery worker --app="${APP}" --loglevel=${LOGLEVEL} --concurrency=1 --prefetch-multiplier=1 --queues="${CELERY_QUEUES}"
@@ -3,10 +3,13 @@
 import os
 import subprocess
 from pathlib import Path
+from typing import Callable
 
+import pytest
 from click.testing import CliRunner
 
 from dist2src.cli import cli
+from dist2src.core import GitRepo
 from packit.cli.packit_base import packit_base
 from packit.utils import cwd
 
@@ -66,6 +69,30 @@ TEST_PROJECTS_WITH_BRANCHES_SINGLE_COMMIT = [
 MOCK_BUILD = bool(os.environ.get("MOCK_BUILD"))
 
 
+@pytest.fixture()
+def git_identity(monkeypatch):
+    """commit as Packit, without any git config"""
+    for role in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv(f"GIT_{role}_NAME", "Packit")
+        monkeypatch.setenv(f"GIT_{role}_EMAIL", "packit@example.com")
+
+
+@pytest.fixture()
+def create_repo(git_identity) -> Callable[[Path], GitRepo]:
+    """creates a repo in the path, with a commit of a spec file and a patch"""
+
+    def create(path: Path) -> GitRepo:
+        repo = GitRepo(path, create=True)
+        (path / "SOURCES").mkdir()
+        (path / "SOURCES" / "acl.patch").write_text("patch")
+        (path / "acl.spec").write_text("Name: acl")
+        repo.stage()
+        repo.commit("Initial commit")
+        return repo
+
+    return create
+
+
 def run_dist2src(*args, working_dir=None, **kwargs):
     working_dir = working_dir or Path.cwd()
     with cwd(working_dir):
@@ -0,0 +1,540 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+Local stand-ins for the services dist2src talks to, so that the updater
+and the worker can be exercised offline:
+
+- Pagure (dist-git): project and branches API, raw files, under /pagure
+- GitLab (source-git): group, projects and tags API, under /gitlab
+- the lookaside cache, under /sources
+- git-over-HTTP (clone, fetch, push) of the repositories of both forges
+
+Projects are either only known to the APIs (cheap, for load tests with
+thousands of projects), or backed by bare git repositories on disk,
+which can also be cloned and pushed to.
+
+Usage:
+    with FakeServices(tmp_path) as services:
+        services.add_project("acl", branches={"c8s": "0a0c838..."})
+        monkeypatch.setenv("D2S_DIST_GIT_URL", services.dist_git_url)
+        ...
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import socketserver
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Pattern, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlencode, urlsplit
+
+from dist2src.constants import GITLAB_SRC_NAMESPACE
+
+
+class FailureRule:
+    """respond with 'status' to requests matching 'pattern', 'count' times"""
+
+    def __init__(self, pattern: Pattern, status: int, count: Optional[int]):
+        self.pattern = pattern
+        self.status = status
+        self.count = count
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeServices:
+    """
+    @param root: directory to keep the git repositories and lookaside sources in
+    @param latency: seconds to wait before answering every request
+    @param failure_rate: probability of answering a request with HTTP 503
+    @param seed: seed of the random failures
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        dist_git_namespace: str = "rpms",
+        src_git_namespace: str = GITLAB_SRC_NAMESPACE,
+        latency: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.root = root
+        self.dist_git_namespace = dist_git_namespace
+        self.src_git_namespace = src_git_namespace
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failures: List[FailureRule] = []
+        # (method, path) of all the requests received
+        self.requests: List[Tuple[str, str]] = []
+        # API-only projects: {name: {branch: commit}} and {name: {tag: commit}}
+        self.dist_git_branches: Dict[str, Dict[str, str]] = {}
+        self.src_git_tags: Dict[str, Dict[str, str]] = {}
+        # source-git project names in the order they were created (~ by id)
+        self.src_git_projects: List[str] = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[_Server] = None
+        self._thread: Optional[threading.Thread] = None
+
+    # URLs to configure dist2src with
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def dist_git_url(self) -> str:
+        return f"{self.url}/pagure"
+
+    @property
+    def src_git_url(self) -> str:
+        return f"{self.url}/gitlab"
+
+    @property
+    def lookaside_url(self) -> str:
+        return f"{self.url}/sources"
+
+    @property
+    def environ(self) -> Dict[str, str]:
+        """environment variables pointing dist2src to these services"""
+        return {
+            "D2S_DIST_GIT_URL": self.dist_git_url,
+            "D2S_SRC_GIT_URL": self.src_git_url,
+            "D2S_DIST_GIT_NAMESPACE": self.dist_git_namespace,
+            "D2S_SRC_GIT_NAMESPACE": self.src_git_namespace,
+            "DIST2SRC_LOOKASIDE_URL": self.lookaside_url,
+        }
+
+    # setting up the content
+
+    @property
+    def dist_git_root(self) -> Path:
+        return self.root / "dist-git"
+
+    @property
+    def src_git_root(self) -> Path:
+        return self.root / "src-git"
+
+    def dist_git_path(self, name: str) -> Path:
+        return self.dist_git_root / self.dist_git_namespace / f"{name}.git"
+
+    def src_git_path(self, name: str) -> Path:
+        return self.src_git_root / self.src_git_namespace / f"{name}.git"
+
+    def add_project(
+        self,
+        name: str,
+        branches: Dict[str, str],
+        tags: Optional[Dict[str, str]] = None,
+        src_git: bool = True,
+    ):
+        """
+        add a project known only to the APIs
+
+        @param branches: {branch: commit} of the dist-git repo
+        @param tags: {tag: commit} of the source-git repo
+        @param src_git: whether the source-git project exists
+        """
+        self.dist_git_branches[name] = dict(branches)
+        if src_git:
+            self.src_git_tags[name] = dict(tags or {})
+            self.src_git_projects.append(name)
+
+    def add_git_project(
+        self, name: str, dist_git: Optional[Path] = None, src_git: Optional[Path] = None
+    ):
+        """
+        add a project backed by bare git repositories
+
+        @param dist_git: repository to create the dist-git repo from, empty if None
+        @param src_git: repository to create the source-git repo from, empty if None
+        """
+        for origin, path in (
+            (dist_git, self.dist_git_path(name)),
+            (src_git, self.src_git_path(name)),
+        ):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if origin:
+                _git("clone", "-q", "--bare", "--no-local", str(origin), str(path))
+                # clone doesn't copy the remote-tracking branches of the origin
+                _git("remote", "remove", "origin", cwd=path)
+            else:
+                _git("init", "-q", "--bare", str(path))
+        self.src_git_projects.append(name)
+
+    def add_lookaside_source(self, name: str, branch: str, path: Path) -> str:
+        """store a file in the lookaside cache and return its hash"""
+        sha = hashlib.sha512(path.read_bytes()).hexdigest()
+        target = self.root / "lookaside" / name / branch / sha
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(path, target)
+        return sha
+
+    def fail(self, pattern: str, status: int = 503, count: Optional[int] = 1):
+        """
+        answer requests with a path matching 'pattern' with 'status',
+        'count' times (forever if None)
+        """
+        with self._lock:
+            self.failures.append(FailureRule(re.compile(pattern), status, count))
+
+    # reading the state
+
+    def get_branches(self, name: str) -> Optional[Dict[str, str]]:
+        """{branch: commit} of a dist-git project, None if it doesn't exist"""
+        path = self.dist_git_path(name)
+        if path.is_dir():
+            return _refs(path, "refs/heads/")
+        return self.dist_git_branches.get(name)
+
+    def get_tags(self, name: str) -> Optional[Dict[str, str]]:
+        """{tag: commit} of a source-git project, None if it doesn't exist"""
+        path = self.src_git_path(name)
+        if path.is_dir():
+            return _refs(path, "refs/tags/")
+        return self.src_git_tags.get(name)
+
+    # running
+
+    def start(self) -> "FakeServices":
+        self.root.mkdir(parents=True, exist_ok=True)
+        handler = type("Handler", (_Handler,), {"services": self})
+        self._server = _Server(("127.0.0.1", 0), handler)
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-services", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self) -> "FakeServices":
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _injected_failure(self, path: str) -> Optional[int]:
+        with self._lock:
+            for rule in self.failures:
+                if rule.count != 0 and rule.pattern.search(path):
+                    if rule.count is not None:
+                        rule.count -= 1
+                    return rule.status
+            if self.failure_rate and self._random.random() < self.failure_rate:
+                return 503
+        return None
+
+
+def _git(*args: str, cwd: Optional[Path] = None, **kwargs) -> bytes:
+    return subprocess.check_output(["git", *args], cwd=cwd, **kwargs)
+
+
+def _refs(path: Path, prefix: str) -> Dict[str, str]:
+    """{name: commit} of the refs under 'prefix', tags are peeled"""
+    output = _git(
+        "for-each-ref",
+        "--format=%(refname) %(objectname) %(*objectname)",
+        prefix,
+        cwd=path,
+    ).decode()
+    refs = {}
+    for line in output.splitlines():
+        ref, sha, peeled = (line.split(" ") + [""])[:3]
+        refs[ref.replace(prefix, "", 1)] = peeled or sha
+    return refs
+
+
+class _Handler(BaseHTTPRequestHandler):
+    services: FakeServices
+    protocol_version = "HTTP/1.1"
+    # answers are written in several chunks, don't wait for ACKs in between
+    disable_nagle_algorithm = True
+
+    # routing
+
+    def do_GET(self):
+        self._handle()
+
+    def do_HEAD(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        services = self.services
+        url = urlsplit(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        with services._lock:
+            services.requests.append((self.command, url.path))
+        if services.latency:
+            time.sleep(services.latency)
+        status = services._injected_failure(url.path)
+        if status:
+            return self._json({"message": "Injected failure"}, status)
+
+        parts = url.path.strip("/").split("/")
+        if parts[0] in ("pagure", "gitlab") and any(p.endswith(".git") for p in parts):
+            root = (
+                services.dist_git_root
+                if parts[0] == "pagure"
+                else services.src_git_root
+            )
+            return self._git_http_backend(root, "/" + "/".join(parts[1:]), url.query)
+        if parts[:3] == ["pagure", "api", "0"]:
+            return self._pagure(parts[3:])
+        if parts[0] == "pagure" and "raw" in parts:
+            return self._pagure_raw("/".join(parts[1:]))
+        if parts[:3] == ["gitlab", "api", "v4"]:
+            return self._gitlab([unquote(p) for p in parts[3:]])
+        if parts[0] == "sources" and len(parts) == 4:
+            return self._lookaside(*parts[1:])
+        self._json({"message": "404 Not Found"}, 404)
+
+    # responses
+
+    def _respond(self, body: bytes, status: int = 200, headers: Optional[dict] = None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _json(self, data, status: int = 200, headers: Optional[dict] = None):
+        self._respond(
+            json.dumps(data).encode(),
+            status,
+            {"Content-Type": "application/json", **(headers or {})},
+        )
+
+    # Pagure
+
+    def _pagure(self, parts: List[str]):
+        services = self.services
+        namespace = services.dist_git_namespace
+        path = "/".join(parts)
+        if not path.startswith(f"{namespace}/"):
+            return self._pagure_not_found()
+        name, *rest = path.replace(f"{namespace}/", "", 1).split("/")
+        branches = services.get_branches(name)
+        if branches is None:
+            return self._pagure_not_found()
+        if not rest:
+            return self._json(
+                {
+                    "name": name,
+                    "namespace": namespace,
+                    "fullname": f"{namespace}/{name}",
+                }
+            )
+        if rest == ["git", "branches"]:
+            if self.query.get("with_commits", "").lower() in ("1", "true"):
+                return self._json(
+                    {"branches": branches, "total_branches": len(branches)}
+                )
+            return self._json(
+                {"branches": sorted(branches), "total_branches": len(branches)}
+            )
+        self._json({"error": "Invalid or incomplete input submitted"}, 400)
+
+    def _pagure_raw(self, path: str):
+        """NAMESPACE/NAME/raw/REF/f/PATH, from git-backed projects"""
+        match = re.match(
+            rf"^{re.escape(self.services.dist_git_namespace)}/([^/]+)/raw/([^/]+)/f/(.+)$",
+            path,
+        )
+        repo = self.services.dist_git_path(match.group(1)) if match else None
+        if not repo or not repo.is_dir():
+            return self._respond(b"Not Found", 404)
+        try:
+            content = _git(
+                "show",
+                f"{match.group(2)}:{match.group(3)}",
+                cwd=repo,
+                stderr=subprocess.DEVNULL,
+            )
+        except subprocess.CalledProcessError:
+            return self._respond(b"Not Found", 404)
+        self._respond(content, headers={"Content-Type": "text/plain"})
+
+    def _pagure_not_found(self):
+        self._json({"error": "Project not found", "error_code": "ENOPROJECT"}, 404)
+
+    # GitLab
+
+    def _gitlab(self, parts: List[str]):
+        services = self.services
+        if parts == ["user"]:
+            return self._json({"id": 1, "username": "packit"})
+        if parts[:1] == ["groups"] and len(parts) >= 2:
+            if parts[1] not in ("1", services.src_git_namespace):
+                return self._json({"message": "404 Group Not Found"}, 404)
+            if len(parts) == 2:
+                return self._json(
+                    {
+                        "id": 1,
+                        "name": services.src_git_namespace.rpartition("/")[2],
+                        "path": services.src_git_namespace.rpartition("/")[2],
+                        "full_path": services.src_git_namespace,
+                    }
+                )
+            if parts[2:] == ["projects"]:
+                return self._gitlab_group_projects()
+        if parts[:1] == ["projects"] and len(parts) >= 2:
+            index = self._gitlab_project_index(parts[1])
+            if index is None:
+                return self._json({"message": "404 Project Not Found"}, 404)
+            if len(parts) == 2:
+                return self._json(self._gitlab_project(index))
+            if parts[2:] == ["repository", "tags"]:
+                return self._gitlab_tags(services.src_git_projects[index])
+            if parts[2:4] == ["repository", "tags"] and len(parts) == 5:
+                return self._gitlab_tag(services.src_git_projects[index], parts[4])
+        self._json({"message": "404 Not Found"}, 404)
+
+    def _gitlab_project_index(self, id_or_path: str) -> Optional[int]:
+        projects = self.services.src_git_projects
+        if id_or_path.isdigit():
+            index = int(id_or_path) - 1
+            return index if 0 <= index < len(projects) else None
+        namespace, _, name = id_or_path.rpartition("/")
+        if namespace != self.services.src_git_namespace or name not in projects:
+            return None
+        return projects.index(name)
+
+    def _gitlab_project(self, index: int) -> dict:
+        services = self.services
+        name = services.src_git_projects[index]
+        git_url = f"{services.src_git_url}/{services.src_git_namespace}/{name}.git"
+        return {
+            "id": index + 1,
+            "name": name,
+            "path": name,
+            "path_with_namespace": f"{services.src_git_namespace}/{name}",
+            "visibility": "public",
+            "http_url_to_repo": git_url,
+            # pushes go over HTTP as well
+            "ssh_url_to_repo": git_url,
+        }
+
+    def _gitlab_group_projects(self):
+        """keyset pagination only, ordered by id"""
+        per_page = int(self.query.get("per_page", 20))
+        start = int(self.query.get("id_after", 0))
+        end = min(start + per_page, len(self.services.src_git_projects))
+        projects = [self._gitlab_project(index) for index in range(start, end)]
+        headers = {}
+        if start + per_page < len(self.services.src_git_projects):
+            query = {**self.query, "id_after": start + per_page}
+            headers["Link"] = (
+                f"<{self.services.url}{urlsplit(self.path).path}?{urlencode(query)}>; "
+                'rel="next"'
+            )
+        self._json(projects, headers=headers)
+
+    def _gitlab_tags(self, name: str):
+        """offset pagination, like GitLab does for tags"""
+        tags = sorted(self.services.get_tags(name).items())
+        per_page = int(self.query.get("per_page", 20))
+        page = int(self.query.get("page", 1))
+        start, end = (page - 1) * per_page, page * per_page
+        items = tags[start:end]
+        pages = max((len(tags) + per_page - 1) // per_page, 1)
+        headers = {
+            "X-Page": str(page),
+            "X-Per-Page": str(per_page),
+            "X-Total": str(len(tags)),
+            "X-Total-Pages": str(pages),
+        }
+        if page < pages:
+            query = {**self.query, "page": page + 1}
+            headers["X-Next-Page"] = str(page + 1)
+            headers["Link"] = (
+                f"<{self.services.url}{urlsplit(self.path).path}?{urlencode(query)}>; "
+                'rel="next"'
+            )
+        self._json(
+            [{"name": tag, "commit": {"id": sha}} for tag, sha in items],
+            headers=headers,
+        )
+
+    def _gitlab_tag(self, name: str, tag: str):
+        sha = self.services.get_tags(name).get(tag)
+        if sha is None:
+            return self._json({"message": "404 Tag Not Found"}, 404)
+        self._json({"name": tag, "commit": {"id": sha}})
+
+    # lookaside cache
+
+    def _lookaside(self, name: str, branch: str, sha: str):
+        path = self.services.root / "lookaside" / name / branch / sha
+        if not path.is_file():
+            return self._respond(b"Not Found", 404)
+        self._respond(
+            path.read_bytes(), headers={"Content-Type": "application/octet-stream"}
+        )
+
+    # git
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _git_http_backend(self, root: Path, path_info: str, query: str):
+        env = {
+            "PATH": os.environ["PATH"],
+            "GIT_PROJECT_ROOT": str(root),
+            "GIT_HTTP_EXPORT_ALL": "1",
+            # enables receive-pack, i.e. pushing
+            "REMOTE_USER": "packit",
+            "REMOTE_ADDR": self.client_address[0],
+            "PATH_INFO": quote(path_info),
+            "QUERY_STRING": query,
+            "REQUEST_METHOD": self.command,
+            "CONTENT_TYPE": self.headers.get("Content-Type", ""),
+            "HTTP_CONTENT_ENCODING": self.headers.get("Content-Encoding", ""),
+            "GIT_PROTOCOL": self.headers.get("Git-Protocol", ""),
+        }
+        body = self._read_body() if self.command == "POST" else b""
+        output = subprocess.run(
+            ["git", "http-backend"],
+            input=body,
+            env=env,
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout
+        head, _, body = output.partition(b"\r\n\r\n")
+        headers = dict(
+            line.split(": ", 1) for line in head.decode().split("\r\n") if line
+        )
+        status = int(headers.pop("Status", "200").split(" ")[0])
+        self._respond(body, status, headers)
+
+    def log_message(self, format, *args):
+        pass
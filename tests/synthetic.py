@@ -0,0 +1,204 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+Generate synthetic dist-git repositories, so that conversions can be
+run offline and reproducibly (e.g. for benchmarks).
+"""
+import io
+import random
+import subprocess
+import tarfile
+from pathlib import Path
+from typing import List
+
+# how the spec file applies the patches in %prep
+PREP_STYLES = {
+    "autosetup": "%autosetup -p1",
+    "setup_patch": "%setup -q\n{patches}",
+    "git_am": "%autosetup -S git_am -p1",
+    "p0": "%setup -q\n{patches}",
+}
+
+SPEC_TEMPLATE = """\
+Name:           {name}
+Version:        {version}
+Release:        {release}%{{?dist}}
+Summary:        Synthetic package {name}
+License:        MIT
+Source0:        {name}-{version}.tar.gz
+{patch_tags}
+
+%description
+Synthetic package generated to benchmark dist2src.
+
+%prep
+{prep}
+
+%build
+
+%install
+
+%files
+
+%changelog
+* Mon Jan 01 2024 Packit <packit@example.com> - {version}-{release}
+- Synthetic release {release}
+"""
+
+LINE_LENGTH = 64
+
+
+def _git(path: Path, *args: str):
+    subprocess.check_call(
+        [
+            "git",
+            "-c",
+            "user.name=Packit",
+            "-c",
+            "user.email=packit@example.com",
+            *args,
+        ],
+        cwd=path,
+    )
+
+
+def _file_lines(seed: int, size: int) -> List[str]:
+    """hex lines (not very compressible, like real sources) of about 'size' bytes"""
+    rng = random.Random(seed)
+    count = max(size // (LINE_LENGTH + 1), 2)
+    return [f"{rng.getrandbits(LINE_LENGTH * 4):0{LINE_LENGTH}x}" for _ in range(count)]
+
+
+class SyntheticDistGit:
+    """
+    A dist-git repository of a package with a single archive
+    and patches modifying the files in the archive.
+
+    The lookaside metadata file is empty, so no network access is needed:
+    the archive is already in SOURCES/ and is copied to source-git.
+
+    @param path: where to create the repo, the name of the package is path.name
+    @param archive_size: approximate size of the (uncompressed) archive in bytes
+    @param file_count: number of files in the archive
+    @param patch_count: number of patches, each modifies a different file
+    @param prep_style: one of PREP_STYLES
+    @param branch: dist-git branch to commit to
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        archive_size: int = 1024**2,
+        file_count: int = 100,
+        patch_count: int = 10,
+        prep_style: str = "autosetup",
+        branch: str = "c8s",
+        version: str = "1.0",
+    ):
+        if prep_style not in PREP_STYLES:
+            raise ValueError(f"Unknown %prep style: {prep_style}")
+        self.path = path
+        self.name = path.name
+        self.version = version
+        self.archive_size = archive_size
+        self.file_count = max(file_count, 1)
+        self.prep_style = prep_style
+        self.branch = branch
+        self.release = 1
+        self.patches: List[str] = []
+        # last line and number of lines of every file, patches append after it
+        self._last_lines: List[str] = []
+        self._line_counts: List[int] = []
+        self._initial_patch_count = patch_count
+
+    def create(self) -> "SyntheticDistGit":
+        (self.path / "SPECS").mkdir(parents=True)
+        (self.path / "SOURCES").mkdir()
+        self._create_archive()
+        for _ in range(self._initial_patch_count):
+            self._add_patch()
+        (self.path / f".{self.name}.metadata").write_text("")
+        self._write_spec()
+        _git(self.path, "init", "-q")
+        _git(self.path, "checkout", "-q", "-b", self.branch)
+        _git(self.path, "add", ".")
+        _git(self.path, "commit", "-q", "-m", f"Import {self.name}-{self.version}")
+        return self
+
+    def update(self, patch_count: int = 1) -> "SyntheticDistGit":
+        """add new patches and bump the release in a new dist-git commit"""
+        for _ in range(patch_count):
+            self._add_patch()
+        self.release += 1
+        self._write_spec()
+        _git(self.path, "add", ".")
+        _git(self.path, "commit", "-q", "-m", f"Release {self.release}")
+        return self
+
+    def _file_path(self, index: int) -> str:
+        return f"src/dir{index % 100:02}/file{index}.c"
+
+    def _create_archive(self):
+        top_dir = f"{self.name}-{self.version}"
+        archive = self.path / "SOURCES" / f"{top_dir}.tar.gz"
+        file_size = self.archive_size // self.file_count
+        with tarfile.open(archive, mode="w:gz") as tar:
+            for index in range(self.file_count):
+                lines = _file_lines(seed=index, size=file_size)
+                self._last_lines.append(lines[-1])
+                self._line_counts.append(len(lines))
+                content = ("\n".join(lines) + "\n").encode()
+                info = tarfile.TarInfo(f"{top_dir}/{self._file_path(index)}")
+                info.size = len(content)
+                info.mtime = 0
+                info.mode = 0o644
+                tar.addfile(info, io.BytesIO(content))
+
+    def _add_patch(self):
+        index = len(self.patches)
+        if index >= self.file_count:
+            raise ValueError("Every patch needs its own file, add more files.")
+        number = index + 1
+        path = self._file_path(index)
+        strip = self.prep_style != "p0"
+        old, new = (f"a/{path}", f"b/{path}") if strip else (path, path)
+        last_line = self._last_lines[index]
+        line_number = self._line_counts[index]
+        patch_name = f"{number:04}-synthetic-change-{number}.patch"
+        (self.path / "SOURCES" / patch_name).write_text(
+            f"From {number:040x} Mon Sep 17 00:00:00 2001\n"
+            "From: Packit <packit@example.com>\n"
+            "Date: Mon, 1 Jan 2024 00:00:00 +0000\n"
+            f"Subject: [PATCH] Synthetic change {number}\n"
+            "\n"
+            "---\n"
+            f"diff --git {old} {new}\n"
+            f"--- {old}\n"
+            f"+++ {new}\n"
+            f"@@ -{line_number} +{line_number},2 @@\n"
+            f" {last_line}\n"
+            f"+synthetic change {number}\n"
+            "-- \n"
+            "2.30.0\n"
+            "\n"
+        )
+        self.patches.append(patch_name)
+
+    def _write_spec(self):
+        patch_tags = "\n".join(
+            f"Patch{number:04}:      {name}"
+            for number, name in enumerate(self.patches, start=1)
+        )
+        flag = "-p0" if self.prep_style == "p0" else "-p1"
+        patches = "\n".join(
+            f"%patch{number:04} {flag}" for number in range(1, len(self.patches) + 1)
+        )
+        (self.path / "SPECS" / f"{self.name}.spec").write_text(
+            SPEC_TEMPLATE.format(
+                name=self.name,
+                version=self.version,
+                release=self.release,
+                patch_tags=patch_tags,
+                prep=PREP_STYLES[self.prep_style].format(patches=patches),
+            )
+        )
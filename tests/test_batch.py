@@ -0,0 +1,173 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+import json
+import logging
+import time
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+from flexmock import flexmock
+
+from dist2src import batch
+from dist2src.batch import Job, group_by_repo, read_manifest, run_jobs
+from dist2src.cli import cli
+
+
+def test_read_manifest(tmp_path: Path):
+    manifest = tmp_path / "manifest.yaml"
+    manifest.write_text(
+        "- dist_git: rpms/acl\n"
+        "  source_git: src/acl\n"
+        "  branch: c8s\n"
+        "- dist_git: /rpms/rsync\n"
+        "  source_git: /src/rsync\n"
+        "  branch: c8\n"
+        "  dest_branch: c8-sg\n"
+    )
+    assert read_manifest(manifest) == [
+        Job(tmp_path / "rpms/acl", tmp_path / "src/acl", "c8s"),
+        Job(Path("/rpms/rsync"), Path("/src/rsync"), "c8", "c8-sg"),
+    ]
+
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(
+        json.dumps([{"dist_git": "rpms/acl", "source_git": "src/acl", "branch": "c8s"}])
+    )
+    assert read_manifest(manifest) == [
+        Job(tmp_path / "rpms/acl", tmp_path / "src/acl", "c8s")
+    ]
+
+
+def test_read_manifest_invalid(tmp_path: Path):
+    manifest = tmp_path / "manifest.yaml"
+    manifest.write_text("- dist_git: rpms/acl\n  branch: c8s\n")
+    with pytest.raises(ValueError, match="job #1 is invalid"):
+        read_manifest(manifest)
+
+
+def fake_dist2src(dist_git_path, source_git_path, log_level, timings):
+    def convert(origin_branch, dest_branch):
+        with timings.stage("run_prep"):
+            pass
+        timings.observe()
+        if dist_git_path.name == "broken":
+            raise RuntimeError("rpmbuild failed")
+
+    return flexmock(convert=convert)
+
+
+def test_run_jobs(tmp_path: Path):
+    flexmock(batch).should_receive("Dist2Src").replace_with(fake_dist2src)
+    jobs = [
+        Job(tmp_path / "rpms/acl", tmp_path / "src/acl", "c8s"),
+        Job(tmp_path / "rpms/broken", tmp_path / "src/broken", "c8s"),
+    ]
+    progress = []
+
+    report = run_jobs(
+        jobs,
+        tmp_path / "work",
+        on_result=lambda done, result: progress.append((done, result["status"])),
+    )
+
+    assert progress == [(1, "ok"), (2, "failed")]
+    assert report["jobs"] == 2
+    assert report["succeeded"] == 1
+    assert report["failed"] == 1
+    ok, failed = report["results"]
+    assert ok["status"] == "ok"
+    assert set(ok["stages"]) == {"run_prep"}
+    assert failed["error"] == "RuntimeError('rpmbuild failed')"
+    assert "Converting" in Path(failed["log"]).read_text()
+    # every job has its own workdir
+    assert Path(ok["log"]).parent != Path(failed["log"]).parent
+
+
+def test_run_jobs_in_processes(tmp_path: Path):
+    """results are reported in the order of the jobs, failures are collected"""
+    jobs = [
+        Job(tmp_path / f"rpms/missing{i}", tmp_path / f"src/missing{i}", "c8s")
+        for i in range(3)
+    ]
+    report = run_jobs(jobs, tmp_path / "work", processes=2)
+
+    assert report["failed"] == 3
+    assert [r["dist_git"] for r in report["results"]] == [str(j.dist_git) for j in jobs]
+    assert all(Path(r["log"]).is_file() for r in report["results"])
+
+
+def test_group_by_repo(tmp_path: Path):
+    jobs = [
+        Job(tmp_path / "rpms/acl", tmp_path / "src/acl", "c8"),
+        Job(tmp_path / "rpms/rsync", tmp_path / "src/rsync", "c8s"),
+        Job(tmp_path / "rpms/acl", tmp_path / "src/acl", "c8s"),
+        Job(tmp_path / "rpms/rsync-old", tmp_path / "src/rsync-old", "c8"),
+        # joins the groups of rsync and rsync-old
+        Job(tmp_path / "rpms/rsync-old", tmp_path / "src/../src/rsync", "c8"),
+    ]
+    assert group_by_repo(jobs) == [[0, 2], [1, 3, 4]]
+
+
+def record_run(job, workdir, log_level):
+    """records when the job ran, in the workdir of the job"""
+    start = time.time()
+    time.sleep(0.2)
+    workdir.mkdir(parents=True)
+    (workdir / "run").write_text(json.dumps([start, time.time()]))
+    return {**batch._result(job, workdir / "convert.log"), "status": "ok"}
+
+
+def test_jobs_sharing_a_repo_run_serially(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(batch, "run_job", record_run)
+    jobs = [
+        Job(tmp_path / "rpms/acl", tmp_path / "src/acl", "c8"),
+        Job(tmp_path / "rpms/acl", tmp_path / "src/acl", "c8s"),
+        Job(tmp_path / "rpms/rsync", tmp_path / "src/rsync", "c8s"),
+    ]
+    report = run_jobs(jobs, tmp_path / "work", processes=3)
+
+    c8, c8s, rsync = [
+        json.loads((Path(result["log"]).parent / "run").read_text())
+        for result in report["results"]
+    ]
+    assert c8[1] <= c8s[0]
+    # the others run in parallel
+    assert rsync[0] < c8[1]
+
+
+@pytest.fixture()
+def dist2src_logger():
+    """the CLI sets up the dist2src logger, restore it"""
+    dist2src_logger = logging.getLogger("dist2src")
+    level, handlers = dist2src_logger.level, list(dist2src_logger.handlers)
+    yield dist2src_logger
+    dist2src_logger.setLevel(level)
+    dist2src_logger.handlers = handlers
+
+
+def test_convert_many_cli(tmp_path: Path, dist2src_logger):
+    flexmock(batch).should_receive("Dist2Src").replace_with(fake_dist2src)
+    manifest = tmp_path / "manifest.yaml"
+    manifest.write_text(
+        "- {dist_git: rpms/acl, source_git: src/acl, branch: c8s}\n"
+        "- {dist_git: rpms/broken, source_git: src/broken, branch: c8s}\n"
+    )
+    report = tmp_path / "report.json"
+
+    result = CliRunner().invoke(
+        cli,
+        [
+            "convert-many",
+            "--jobs=1",
+            f"--workdir={tmp_path / 'work'}",
+            f"--report={report}",
+            str(manifest),
+        ],
+    )
+
+    assert result.exit_code == 1
+    assert "[2/2] failed" in result.output
+    assert "1 succeeded, 1 failed" in result.output
+    assert json.loads(report.read_text())["failed"] == 1
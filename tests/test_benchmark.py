@@ -0,0 +1,123 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+Offline benchmarks of the conversion, on synthetic dist-git repos.
+
+They are not run by default, run them with:
+    pytest -m benchmark tests/test_benchmark.py
+(add -m "benchmark and not slow" to leave out the kernel-sized ones)
+
+Set $D2S_BENCHMARK_RESULTS to a path to write the measured durations to.
+Durations depend on the machine, so there are no baselines in the repo:
+set $D2S_BENCHMARK_BASELINES to the results of an earlier run (on the same
+machine) to compare with them, a stage fails when it's slower than its
+baseline times $D2S_BENCHMARK_TOLERANCE (default: 1.5).
+
+The conversions are run with the bulk-conversion git profile and with the
+default git settings (see dist2src.git_profile), to show what the profile saves.
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict
+
+import pytest
+
+from dist2src.core import Dist2Src
+from dist2src.git_profile import BULK_CONVERSION
+from dist2src.metrics import StageTimings
+from tests.synthetic import PREP_STYLES, SyntheticDistGit
+
+pytestmark = [
+    pytest.mark.benchmark,
+    pytest.mark.skipif(not shutil.which("rpmbuild"), reason="rpmbuild is needed"),
+]
+
+# durations below this many seconds are noise
+ABSOLUTE_SLACK = 0.5
+
+FIXTURES = {
+    "small": {"archive_size": 1024**2, "file_count": 100, "patch_count": 10},
+    # roughly the size of a kernel tarball
+    "kernel": {"archive_size": 1024**3, "file_count": 70000, "patch_count": 500},
+}
+
+GIT_PROFILES = {"bulk": BULK_CONVERSION, "default": {}}
+
+_results: Dict[str, Dict[str, float]] = {}
+
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch):
+    # the archives are already in the synthetic dist-git repos
+    monkeypatch.setenv("DIST2SRC_GET_SOURCES", shutil.which("true"))
+
+
+@pytest.fixture(scope="module", autouse=True)
+def results():
+    yield _results
+    if not _results:
+        return
+    if os.getenv("D2S_BENCHMARK_RESULTS"):
+        Path(os.environ["D2S_BENCHMARK_RESULTS"]).write_text(
+            json.dumps(_results, indent=2, sort_keys=True) + "\n"
+        )
+
+
+def convert(
+    dist_git: SyntheticDistGit, source_git_path: Path, git_profile: str
+) -> Dict[str, float]:
+    timings = StageTimings()
+    Dist2Src(
+        dist_git_path=dist_git.path,
+        source_git_path=source_git_path,
+        timings=timings,
+        git_profile=GIT_PROFILES[git_profile],
+    ).convert(dist_git.branch, dist_git.branch)
+    return dict(timings.observed)
+
+
+def check_baseline(name: str, durations: Dict[str, float]):
+    _results[name] = durations
+    baselines_path = os.getenv("D2S_BENCHMARK_BASELINES")
+    if not baselines_path:
+        return
+    baseline = json.loads(Path(baselines_path).read_text()).get(name)
+    if not baseline:
+        pytest.fail(f"No baseline for {name} in {baselines_path}.")
+    tolerance = float(os.getenv("D2S_BENCHMARK_TOLERANCE", "1.5"))
+    regressions = [
+        f"{stage}: {duration:.2f}s, baseline {baseline[stage]:.2f}s"
+        for stage, duration in durations.items()
+        if stage in baseline and duration > baseline[stage] * tolerance + ABSOLUTE_SLACK
+    ]
+    assert not regressions, f"{name} got slower: " + "; ".join(regressions)
+
+
+def run_benchmark(
+    tmp_path: Path, fixture: str, prep_style: str, git_profile: str = "bulk"
+):
+    dist_git = SyntheticDistGit(
+        tmp_path / "d" / "synthetic", prep_style=prep_style, **FIXTURES[fixture]
+    ).create()
+    source_git_path = tmp_path / "s" / "synthetic"
+    source_git_path.mkdir(parents=True)
+
+    name = f"{fixture}-{prep_style}-{git_profile}"
+    check_baseline(f"{name}-initial", convert(dist_git, source_git_path, git_profile))
+
+    dist_git.update(patch_count=2)
+    check_baseline(f"{name}-update", convert(dist_git, source_git_path, git_profile))
+
+
+@pytest.mark.parametrize("git_profile", GIT_PROFILES)
+@pytest.mark.parametrize("prep_style", PREP_STYLES)
+def test_small(tmp_path: Path, prep_style: str, git_profile: str):
+    run_benchmark(tmp_path, "small", prep_style, git_profile)
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("git_profile", GIT_PROFILES)
+def test_kernel(tmp_path: Path, git_profile: str):
+    run_benchmark(tmp_path, "kernel", "git_am", git_profile)
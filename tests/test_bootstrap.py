@@ -0,0 +1,80 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+import importlib
+import logging
+import os
+import time
+from pathlib import Path
+
+import pytest
+from flexmock import flexmock
+
+from dist2src.worker import bootstrap
+from dist2src.worker.bootstrap import WorkerState
+from dist2src.worker.config import Configuration
+from dist2src.worker.monitoring import Pushgateway
+
+
+@pytest.fixture(autouse=True)
+def state(monkeypatch):
+    state = WorkerState()
+    monkeypatch.setattr(bootstrap, "state", state)
+    return state
+
+
+def test_preload(state):
+    for module in bootstrap.PRELOADED_MODULES:
+        flexmock(importlib).should_receive("import_module").with_args(module).once()
+    flexmock(bootstrap).should_receive("configure_sentry").once()
+
+    bootstrap.preload()
+
+    assert bootstrap.get_configuration() is state.configuration
+
+
+def test_get_configuration_not_preloaded():
+    assert isinstance(bootstrap.get_configuration(), Configuration)
+    assert bootstrap.get_configuration() is not bootstrap.get_configuration()
+
+
+def test_reset_task_state(tmp_path: Path):
+    cwd = os.getcwd()
+    dist2src_logger = logging.getLogger("dist2src")
+    handler = logging.NullHandler()
+    dist2src_logger.addHandler(handler)
+    try:
+        bootstrap.start_task()
+        # a task which didn't clean up
+        os.chdir(tmp_path)
+        leftover = logging.FileHandler(tmp_path / "task.log")
+        dist2src_logger.addHandler(leftover)
+
+        bootstrap.reset_task_state()
+
+        assert os.getcwd() == cwd
+        assert leftover not in dist2src_logger.handlers
+        assert leftover.stream is None
+        assert handler in dist2src_logger.handlers
+    finally:
+        os.chdir(cwd)
+        dist2src_logger.removeHandler(handler)
+
+
+def test_time_to_first_work():
+    flexmock(time).should_receive("monotonic").and_return(100.0).and_return(
+        100.5
+    ).and_return(200.0).and_return(200.1)
+    flexmock(Pushgateway).should_receive("push_time_to_first_work").with_args(
+        0.5, first_task=True
+    ).once()
+    flexmock(Pushgateway).should_receive("push_time_to_first_work").with_args(
+        pytest.approx(0.1), first_task=False
+    ).once()
+
+    bootstrap.start_task()
+    bootstrap.observe_time_to_first_work()
+    # only once per task
+    bootstrap.observe_time_to_first_work()
+    bootstrap.start_task()
+    bootstrap.observe_time_to_first_work()
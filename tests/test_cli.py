@@ -0,0 +1,66 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+The CLI should start quickly: batch scripts call it for every step.
+
+The import-time budget (in seconds) can be changed with $D2S_CLI_IMPORT_BUDGET.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# modules which take long to import, and are only needed by some subcommands
+HEAVY_MODULES = (
+    "celery",
+    "git",
+    "gitlab",
+    "ogr",
+    "packit",
+    "prometheus_client",
+    "rebasehelper",
+    "requests",
+    "sh",
+)
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import dist2src.cli
+elapsed = time.perf_counter() - start
+if sys.argv[1:]:
+    from click.testing import CliRunner
+    result = CliRunner().invoke(dist2src.cli.cli, sys.argv[1:])
+    assert result.exit_code == 0, result.output
+print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+def import_cli(*args: str) -> dict:
+    """import the CLI (and run it with 'args') in a fresh interpreter"""
+    output = subprocess.check_output([sys.executable, "-c", SCRIPT, *args])
+    return json.loads(output)
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        (),
+        ("--help",),
+        ("convert", "--help"),
+        ("convert-many", "--help"),
+        ("check-updates", "--help"),
+    ],
+)
+def test_no_heavy_imports(args):
+    modules = import_cli(*args)["modules"]
+    assert not [m for m in modules if m.split(".")[0] in HEAVY_MODULES]
+
+
+def test_import_time_budget():
+    budget = float(os.getenv("D2S_CLI_IMPORT_BUDGET", "0.5"))
+    # the best of a few runs, so that a busy machine doesn't fail the test
+    elapsed = min(import_cli()["elapsed"] for _ in range(3))
+    assert elapsed < budget
@@ -0,0 +1,101 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+import gzip
+import os
+import subprocess
+import time
+from pathlib import Path
+
+import git
+import pytest
+import sh
+from flexmock import flexmock
+
+from dist2src.core import Dist2Src
+
+PACKITDECOMPRESS = Path(__file__).parent.parent / "packitdecompress"
+CONTENT = b"acl-2.2.53/README\n" * 1000
+
+
+@pytest.fixture()
+def archive(tmp_path: Path) -> Path:
+    path = tmp_path / "acl-2.2.53.tar.gz"
+    path.write_bytes(gzip.compress(CONTENT))
+    return path
+
+
+@pytest.fixture()
+def fake_pigz(tmp_path: Path) -> Path:
+    """a 'pigz' which runs gzip, in a directory to be put in $PATH"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    pigz = bin_dir / "pigz"
+    pigz.write_text('#!/usr/bin/bash\nexec gzip "$@"\n')
+    pigz.chmod(0o755)
+    return bin_dir
+
+
+def decompress(profile: str, archive: Path, log: Path, path: str) -> bytes:
+    return subprocess.check_output(
+        [str(PACKITDECOMPRESS), profile, "gzip", "-dc", str(archive)],
+        env={**os.environ, "PATH": path, "PACKIT_DECOMPRESS_LOG": str(log)},
+    )
+
+
+@pytest.mark.parametrize(
+    "profile, pigz_installed, tool",
+    [
+        ("default", True, "gzip"),
+        ("parallel", True, "pigz"),
+        ("parallel", False, "gzip"),
+    ],
+)
+def test_packitdecompress(
+    tmp_path: Path, archive: Path, fake_pigz: Path, profile, pigz_installed, tool
+):
+    log = tmp_path / "decompress.log"
+    path = os.environ["PATH"]
+    if pigz_installed:
+        path = f"{fake_pigz}:{path}"
+    assert decompress(profile, archive, log, path) == CONTENT
+    archive_format, used_tool, nanoseconds = log.read_text().split()
+    assert (archive_format, used_tool) == ("gzip", tool)
+    assert int(nanoseconds) > 0
+
+
+def test_packitdecompress_fails(tmp_path: Path):
+    with pytest.raises(subprocess.CalledProcessError):
+        decompress(
+            "parallel", tmp_path / "missing.tar.gz", tmp_path / "log", "/usr/bin"
+        )
+
+
+def test_run_prep_times_decompression(tmp_path: Path, monkeypatch):
+    dist_git = tmp_path / "rpms" / "acl"
+    (dist_git / "SPECS").mkdir(parents=True)
+    (dist_git / "SPECS" / "acl.spec").write_text("Name: acl\n%prep\n%autosetup\n")
+    repo = git.Repo.init(dist_git)
+    repo.index.add(["SPECS/acl.spec"])
+    repo.index.commit("spec")
+
+    def rpmbuild(*args, _env):
+        assert "_packit_decompress parallel" in args
+        with open(_env["PACKIT_DECOMPRESS_LOG"], "a") as log:
+            # the last line was cut off
+            log.write("gzip pigz 15000000\nxz xz 5000000\nbzip2 lbzip2\nzstd zs")
+        (dist_git / "BUILD" / "acl-1.0").mkdir(parents=True)
+        # decompressing takes time
+        time.sleep(0.03)
+        return flexmock(stderr=b"")
+
+    monkeypatch.setattr(sh, "Command", {"rpmbuild": rpmbuild}.get)
+    monkeypatch.setenv("DIST2SRC_DECOMPRESS_PROFILE", "parallel")
+    d2s = Dist2Src(dist_git, None)
+    start = time.monotonic()
+    d2s.run_prep(ensure_autosetup=False)
+    elapsed = time.monotonic() - start
+
+    assert d2s.timings.durations["decompress"] == 0.02
+    # not counted twice
+    assert 0 <= d2s.timings.durations["run_prep"] <= elapsed - 0.02
@@ -0,0 +1,155 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+"""
+Exercise the updater against the local stand-in services (tests/fake_services.py).
+
+The number of projects in the load test can be changed
+with $D2S_LOAD_TEST_PROJECTS.
+"""
+import os
+import subprocess
+import time
+from pathlib import Path
+
+import pytest
+import requests
+from flexmock import flexmock
+from ogr.exceptions import OgrException
+
+from dist2src.worker import sentry
+from dist2src.worker.celerizer import celery_app
+from dist2src.worker.config import Configuration
+from dist2src.worker.updater import Updater
+from tests.fake_services import FakeServices
+from tests.test_worker_updater import create_bare_repo
+
+
+@pytest.fixture()
+def services(tmp_path: Path, monkeypatch):
+    with FakeServices(tmp_path / "services") as services:
+        for key, value in services.environ.items():
+            monkeypatch.setenv(key, value)
+        monkeypatch.setenv("D2S_BRANCHES_WATCHED", "c8,c8s")
+        monkeypatch.delenv("D2S_SRC_GIT_TOKEN", raising=False)
+        monkeypatch.delenv("D2S_DIST_GIT_TOKEN", raising=False)
+        flexmock(sentry).should_receive("configure_sentry")
+        yield services
+
+
+def sent_tasks(monkeypatch) -> list:
+    """collect the events of the update tasks sent to Celery"""
+    tasks = []
+    monkeypatch.setenv("CELERY_TASK_NAME", "task.run_dist2src")
+    flexmock(celery_app).should_receive("send_task").replace_with(
+        lambda name, expires, kwargs, **options: tasks.append(kwargs["event"])
+        or flexmock(id="uuid")
+    )
+    return tasks
+
+
+@pytest.mark.parametrize("backend", ["api", "git"])
+def test_check_updates_git_projects(services, tmp_path, monkeypatch, backend):
+    monkeypatch.setenv("D2S_OUT_OF_DATE_BACKEND", backend)
+    dist_git = tmp_path / "acl"
+    branches = create_bare_repo(dist_git, branches=["c8", "c8s", "c9s"])
+    src_git = tmp_path / "acl-src"
+    create_bare_repo(src_git, tags=[f"convert/c8s/{branches['c8s']}"])
+    services.add_git_project("acl", dist_git=dist_git, src_git=src_git)
+    tasks = sent_tasks(monkeypatch)
+
+    Updater().check_updates()
+
+    assert tasks == [
+        {
+            "repo": {"fullname": "rpms/acl", "name": "acl"},
+            "branch": "c8",
+            "end_commit": branches["c8"],
+        }
+    ]
+
+
+def test_clone_and_push(services, tmp_path):
+    create_bare_repo(tmp_path / "acl-src", branches=["c8s"])
+    services.add_git_project("acl", src_git=tmp_path / "acl-src")
+    url = f"{services.src_git_url}/{services.src_git_namespace}/acl.git"
+    clone = tmp_path / "clone"
+    subprocess.check_call(["git", "clone", "-q", url, str(clone)])
+    subprocess.check_call(["git", "tag", "convert/c8s/abc"], cwd=clone)
+    subprocess.check_call(["git", "push", "-q", "--tags", "origin"], cwd=clone)
+
+    assert "convert/c8s/abc" in services.get_tags("acl")
+
+
+def test_lookaside(services, tmp_path):
+    archive = tmp_path / "acl-2.2.53.tar.gz"
+    archive.write_bytes(b"archive")
+    sha = services.add_lookaside_source("acl", "c8s", archive)
+
+    assert requests.head(f"{services.lookaside_url}/acl/c8s/{sha}").ok
+    assert requests.get(f"{services.lookaside_url}/acl/c8s/{sha}").content == (
+        b"archive"
+    )
+    assert requests.head(f"{services.lookaside_url}/acl/c8/{sha}").status_code == 404
+
+
+def test_injected_failures_and_latency(services):
+    services.add_project("acl", branches={"c8s": "a" * 40})
+    services.fail("/git/branches$", status=500, count=1)
+    updater = Updater()
+
+    with pytest.raises(OgrException):
+        updater._get_dist_git_branches_from_api("acl")
+    assert updater._get_dist_git_branches_from_api("acl") == {"c8s": "a" * 40}
+
+    services.latency = 0.2
+    start = time.monotonic()
+    updater._get_dist_git_branches_from_api("acl")
+    assert time.monotonic() - start >= 0.2
+
+
+def test_check_updates_load(services, monkeypatch):
+    """
+    The updater goes through all the projects of the namespace
+    and creates tasks for all the out-of-date branches.
+    """
+    count = int(os.getenv("D2S_LOAD_TEST_PROJECTS", "1000"))
+    expected = []
+    for index in range(count):
+        name = f"package{index:05}"
+        branches = {"c8": f"{index:040x}", "c8s": f"{index + count:040x}"}
+        tags = {f"convert/c8/{branches['c8']}": branches["c8"]}
+        if index % 3:
+            # the c8s branch of every third project is out of date
+            tags[f"convert/c8s/{branches['c8s']}"] = branches["c8s"]
+        else:
+            expected.append((name, "c8s", branches["c8s"]))
+        services.add_project(name, branches=branches, tags=tags)
+    # source-git projects without a dist-git counterpart are skipped
+    services.src_git_projects.append("removed")
+    tasks = sent_tasks(monkeypatch)
+
+    updater = Updater(Configuration())
+    updater.check_updates()
+
+    assert sorted(
+        (task["repo"]["name"], task["branch"], task["end_commit"]) for task in tasks
+    ) == sorted(expected)
+    assert updater.cursor is None
+
+
+def test_tag_lookups_are_bounded(services):
+    """
+    Only the expected convert-tags are looked up,
+    no matter how many tags the source-git repo accumulated.
+    """
+    branches = {"c8": "a" * 40, "c8s": "b" * 40}
+    tags = {f"convert/c8s/{index:040x}": f"{index:040x}" for index in range(500)}
+    tags[f"convert/c8/{'a' * 40}"] = "a" * 40
+    services.add_project("acl", branches=branches, tags=tags)
+
+    updater = Updater(Configuration())
+    assert updater._get_out_of_date_branches("acl") == [("c8s", "b" * 40)]
+
+    tag_requests = [path for _, path in services.requests if "/repository/tags" in path]
+    assert len(tag_requests) == 2
+    assert all("/repository/tags/convert" in path for path in tag_requests)
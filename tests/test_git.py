@@ -12,3 +12,15 @@ def test_is_file_tracked(tmp_path: Path):
     g.commit("stuff")
     assert g.is_file_tracked("file")
     assert not g.is_file_tracked("file2")
+
+
+def test_clean_keeps_files(tmp_path: Path):
+    g = GitRepo(tmp_path, create=True)
+    (g.repo_path / "SOURCES").mkdir()
+    for name in ("acl-2.2.53.tar.gz", "acl[1].tar.gz", "BUILD.log"):
+        (g.repo_path / "SOURCES" / name).write_text("asd")
+    g.clean(keep=["SOURCES/acl-2.2.53.tar.gz", "SOURCES/acl[1].tar.gz"])
+    assert sorted(p.name for p in (g.repo_path / "SOURCES").iterdir()) == [
+        "acl-2.2.53.tar.gz",
+        "acl[1].tar.gz",
+    ]
@@ -0,0 +1,258 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+from pathlib import Path
+
+import git
+import pytest
+from flexmock import flexmock
+
+from dist2src import git_backend
+from dist2src.core import GitRepo
+from dist2src.git_backend import LibGit2Backend, SubprocessBackend, cleanup_message
+
+pytestmark = pytest.mark.usefixtures("git_identity")
+
+BACKENDS = [
+    "subprocess",
+    pytest.param(
+        "libgit2",
+        marks=pytest.mark.skipif(
+            git_backend.pygit2 is None, reason="pygit2 is not installed"
+        ),
+    ),
+]
+
+
+@pytest.fixture()
+def no_git_config(tmp_path: Path, monkeypatch):
+    """ignore the global and system git config of the developer"""
+    config = tmp_path / "gitconfig"
+    config.write_text("")
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("GIT_CONFIG_GLOBAL", str(config))
+    monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+    # libgit2 looks the config files up once
+    search_path = git_backend.pygit2.settings.search_path
+    levels = (
+        git_backend.pygit2.GIT_CONFIG_LEVEL_SYSTEM,
+        git_backend.pygit2.GIT_CONFIG_LEVEL_XDG,
+        git_backend.pygit2.GIT_CONFIG_LEVEL_GLOBAL,
+    )
+    previous = [search_path[level] for level in levels]
+    for level in levels:
+        search_path[level] = str(tmp_path)
+    yield
+    for level, path in zip(levels, previous):
+        search_path[level] = path
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch) -> str:
+    monkeypatch.setenv("DIST2SRC_GIT_BACKEND", request.param)
+    return request.param
+
+
+def describe_commit(repo: GitRepo, rev: str = "HEAD") -> dict:
+    commit = repo.repo.commit(rev)
+    return {
+        "message": commit.message,
+        "tree": commit.tree.hexsha,
+        "parents": len(commit.parents),
+        "author": (commit.author.name, commit.author.email),
+        "committer": (commit.committer.name, commit.committer.email),
+    }
+
+
+def test_backend_selection(monkeypatch, tmp_path: Path):
+    repo = git.Repo.init(tmp_path)
+    monkeypatch.setenv("DIST2SRC_GIT_BACKEND", "subprocess")
+    assert type(git_backend.get_backend(repo)) is SubprocessBackend
+    monkeypatch.setenv("DIST2SRC_GIT_BACKEND", "nope")
+    with pytest.raises(ValueError):
+        git_backend.get_backend(repo)
+
+    monkeypatch.delenv("DIST2SRC_GIT_BACKEND")
+    monkeypatch.setattr(git_backend, "pygit2", None)
+    assert type(git_backend.get_backend(repo)) is SubprocessBackend
+    monkeypatch.setenv("DIST2SRC_GIT_BACKEND", "libgit2")
+    # falls back
+    assert type(git_backend.get_backend(repo)) is SubprocessBackend
+
+
+def test_backend_used(backend, tmp_path: Path):
+    repo = GitRepo(tmp_path, create=True)
+    assert repo.backend.name == backend
+    if backend == "libgit2":
+        # no git process for the in-process operations
+        flexmock(git.Git).should_receive("execute").never()
+        repo.commit("Initial commit")
+        repo.create_tag("acl-1.0", "HEAD")
+        assert repo.get_tags_for_head() == ["acl-1.0"]
+        assert not repo.has_ref("c8s")
+        assert not repo.is_file_tracked("acl.spec")
+
+
+def test_has_ref(backend, tmp_path: Path, create_repo):
+    upstream = create_repo(tmp_path / "upstream")
+    upstream.checkout("c8", create_branch=True)
+    clone = git.Repo.clone_from(str(tmp_path / "upstream"), tmp_path / "clone")
+    repo = GitRepo(Path(clone.working_dir))
+    repo.checkout("c8s", create_branch=True)
+
+    assert repo.has_ref("c8s")
+    assert repo.has_ref("c8")  # only origin/c8
+    assert repo.has_ref("master")
+    assert not repo.has_ref("c9s")
+    assert upstream.has_ref("c8")
+    assert not upstream.has_ref("c8s")
+
+
+def test_is_file_tracked(backend, tmp_path: Path, create_repo):
+    repo = create_repo(tmp_path)
+    (tmp_path / "SOURCES" / "acl-2.2.53.tar.gz").write_text("archive")
+
+    assert repo.is_file_tracked("acl.spec")
+    assert repo.is_file_tracked("SOURCES/acl.patch")
+    assert repo.is_file_tracked("SOURCES")
+    assert repo.is_file_tracked("SOURCES/*.patch")
+    assert not repo.is_file_tracked("SOURCES/acl-2.2.53.tar.gz")
+    assert not repo.is_file_tracked("SOURCES/acl")
+    assert not repo.is_file_tracked("*.tar.gz")
+    # staged, not committed yet
+    repo.stage(add="SOURCES/acl-2.2.53.tar.gz")
+    assert repo.is_file_tracked("SOURCES/acl-2.2.53.tar.gz")
+
+
+def test_tags(backend, tmp_path: Path, create_repo):
+    repo = create_repo(tmp_path)
+    repo.create_tag("old", "HEAD")
+    repo.commit("Second commit")
+    repo.create_tag("c8s-source-git", "master")
+    repo.create_tag("acl-2.2.53-1.el8", "master")
+    repo.repo.create_tag("annotated", message="annotated tag")
+
+    assert repo.get_tags_for_head() == [
+        "acl-2.2.53-1.el8",
+        "annotated",
+        "c8s-source-git",
+    ]
+    # moved to another commit
+    repo.create_tag("old", "master")
+    assert repo.repo.tags["old"].commit == repo.repo.head.commit
+    assert "old" in repo.get_tags_for_head()
+
+
+def test_commit(backend, tmp_path: Path, create_repo):
+    repo = create_repo(tmp_path)
+    (tmp_path / "acl.spec").write_text("Name: acl\nVersion: 2.2.53")
+    repo.stage(add="acl.spec")
+    repo.commit(
+        "Update the spec  ", body="\n\npatch_name: acl.patch\n\n\n\nignore: true\n"
+    )
+    assert describe_commit(repo) == {
+        "message": "Update the spec\n\npatch_name: acl.patch\n\nignore: true\n",
+        "tree": repo.repo.git.write_tree(),
+        "parents": 1,
+        "author": ("Packit", "packit@example.com"),
+        "committer": ("Packit", "packit@example.com"),
+    }
+    assert not repo.repo.is_dirty()
+
+    # empty commit
+    repo.commit("Nothing changed")
+    assert describe_commit(repo)["tree"] == describe_commit(repo, "HEAD~")["tree"]
+
+    # first commit of an orphan branch
+    repo.checkout("c8s", orphan=True)
+    (tmp_path / "README").write_text("source-git")
+    repo.stage(add="README")
+    repo.commit("Source-git repo for acl")
+    assert describe_commit(repo)["parents"] == 0
+    assert [item.path for item in repo.repo.head.commit.tree] == ["README"]
+
+
+@pytest.mark.skipif(git_backend.pygit2 is None, reason="pygit2 is not installed")
+def test_commit_parity(tmp_path: Path, monkeypatch, create_repo):
+    """both backends create the same commits"""
+    results = {}
+    for name in ("subprocess", "libgit2"):
+        monkeypatch.setenv("DIST2SRC_GIT_BACKEND", name)
+        repo = create_repo(tmp_path / name)
+        repo.set_environment({"GIT_AUTHOR_NAME": "Packit Author"})
+        for message, body in (
+            ("Add sources defined in the spec file", None),
+            ("Prepare for a new update", "Reverting patches\nso we can apply it."),
+            ("  Patch  ", "\n\npatch_name: a.patch\n  \n\npresent_in_specfile: true"),
+        ):
+            (repo.repo_path / "acl.spec").write_text(message)
+            repo.stage()
+            repo.commit(message, body=body)
+        results[name] = [describe_commit(repo, f"HEAD~{i}") for i in range(4)]
+    assert results["subprocess"] == results["libgit2"]
+    assert results["libgit2"][0]["author"] == ("Packit Author", "packit@example.com")
+
+
+def test_commit_during_cherry_pick(backend, tmp_path: Path, create_repo):
+    """git commits it, the author is taken from the cherry-picked commit"""
+    repo = create_repo(tmp_path)
+    repo.checkout("other", create_branch=True)
+    (tmp_path / "acl.spec").write_text("Name: acl\nRelease: 1")
+    repo.stage()
+    repo.repo.git.commit(
+        m="Release 1", author="Upstream <upstream@example.com>", allow_empty=True
+    )
+    repo.checkout("master")
+    (tmp_path / "acl.spec").write_text("Name: acl\nRelease: 1")
+    repo.stage()
+    repo.commit("Same change")
+    with pytest.raises(git.GitCommandError):
+        repo.repo.git.cherry_pick("other")
+    repo.commit("Base commit: empty - no source archive")
+
+    assert describe_commit(repo)["author"] == ("Upstream", "upstream@example.com")
+    assert not (Path(repo.repo.git_dir) / "CHERRY_PICK_HEAD").exists()
+
+
+@pytest.mark.skipif(git_backend.pygit2 is None, reason="pygit2 is not installed")
+def test_libgit2_falls_back(tmp_path: Path, monkeypatch, no_git_config):
+    monkeypatch.delenv("GIT_AUTHOR_NAME")
+    repo = git.Repo.init(tmp_path / "acl")
+    backend = LibGit2Backend(repo)
+    flexmock(SubprocessBackend).should_receive("commit").with_args(
+        "No identity", None
+    ).once()
+    backend.commit("No identity")
+
+
+@pytest.mark.skipif(git_backend.pygit2 is None, reason="pygit2 is not installed")
+@pytest.mark.parametrize("hooks_path", [None, "/absolute/hooks", ".githooks"])
+def test_libgit2_runs_hooks(tmp_path: Path, hooks_path, no_git_config):
+    """git commits when there are commit hooks"""
+    repo = git.Repo.init(tmp_path / "acl")
+    if hooks_path:
+        hooks_path = hooks_path.replace("/absolute", str(tmp_path))
+        repo.git.config("core.hooksPath", hooks_path)
+    hooks = Path(repo.working_dir) / (hooks_path or ".git/hooks")
+    hooks.mkdir(parents=True, exist_ok=True)
+    hook = hooks / "pre-commit"
+    hook.write_text("#!/bin/sh\n")
+    hook.chmod(0o755)
+
+    backend = LibGit2Backend(repo)
+    flexmock(SubprocessBackend).should_receive("commit").with_args(
+        "Hooked", None
+    ).once()
+    backend.commit("Hooked")
+
+
+@pytest.mark.parametrize(
+    "message, expected",
+    [
+        ("subject", "subject\n"),
+        ("\n\nsubject  \n\n\nbody\t\n\n", "subject\n\nbody\n"),
+        ("  \n", ""),
+    ],
+)
+def test_cleanup_message(message, expected):
+    assert cleanup_message(message) == expected
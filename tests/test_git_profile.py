@@ -0,0 +1,83 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+from pathlib import Path
+
+import git
+import pytest
+from flexmock import flexmock
+
+from dist2src.core import Dist2Src, GitRepo
+from dist2src.git_profile import BULK_CONVERSION, config_env, get_profile
+
+
+def test_config_env(monkeypatch):
+    monkeypatch.delenv("GIT_CONFIG_COUNT", raising=False)
+    assert config_env({"gc.auto": "0", "pack.compression": "1"}) == {
+        "GIT_CONFIG_KEY_0": "gc.auto",
+        "GIT_CONFIG_VALUE_0": "0",
+        "GIT_CONFIG_KEY_1": "pack.compression",
+        "GIT_CONFIG_VALUE_1": "1",
+        "GIT_CONFIG_COUNT": "2",
+    }
+    # the settings passed by the caller are kept
+    monkeypatch.setenv("GIT_CONFIG_COUNT", "1")
+    assert config_env({"gc.auto": "0"}) == {
+        "GIT_CONFIG_KEY_1": "gc.auto",
+        "GIT_CONFIG_VALUE_1": "0",
+        "GIT_CONFIG_COUNT": "2",
+    }
+
+
+def test_get_profile(monkeypatch):
+    assert get_profile() == BULK_CONVERSION
+    monkeypatch.setenv("DIST2SRC_GIT_PROFILE", "default")
+    assert get_profile() == {}
+
+
+def git_config(repo: GitRepo, key: str):
+    try:
+        return repo.repo.git.config("--get", key)
+    except git.GitCommandError:
+        return None
+
+
+def test_set_environment(tmp_path: Path):
+    repo = GitRepo(tmp_path, create=True)
+    previous = repo.set_environment(config_env({"gc.auto": "0"}))
+    assert git_config(repo, "gc.auto") == "0"
+
+    repo.set_environment(previous)
+    assert git_config(repo, "gc.auto") is None
+    # nothing is written to the repo config
+    assert "gc" not in (tmp_path / ".git" / "config").read_text()
+
+
+@pytest.mark.parametrize("git_profile", [None, {}])
+def test_convert_uses_the_profile(tmp_path: Path, git_profile):
+    dist_git = tmp_path / "rpms" / "acl"
+    dist_git_repo = git.Repo.init(dist_git)
+    dist_git_repo.git.checkout("-b", "c8s")
+    dist_git_repo.index.commit("empty")
+    d2s = Dist2Src(dist_git, tmp_path / "src" / "acl", git_profile=git_profile)
+
+    def convert(origin_branch, dest_branch):
+        for repo in (d2s.dist_git, d2s.source_git):
+            assert git_config(repo, "gc.auto") == ("0" if git_profile is None else None)
+
+    flexmock(d2s).should_receive("_convert").replace_with(convert).once()
+    d2s.convert("c8s", "c8s")
+
+    # restored, e.g. for the push
+    for repo in (d2s.dist_git, d2s.source_git):
+        assert git_config(repo, "gc.auto") is None
+
+
+def test_BUILD_repo_uses_the_profile(tmp_path: Path):
+    dist_git = tmp_path / "rpms" / "acl"
+    git.Repo.init(dist_git)
+    d2s = Dist2Src(dist_git, tmp_path / "src" / "acl")
+    flexmock(d2s).should_receive("BUILD_repo_path").and_return(tmp_path / "BUILD")
+    git.Repo.init(tmp_path / "BUILD")
+
+    assert git_config(d2s._open_BUILD_repo(), "gc.auto") == "0"
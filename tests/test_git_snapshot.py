@@ -0,0 +1,123 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+from pathlib import Path
+
+import git
+import pytest
+
+from dist2src.core import Dist2Src, GitRepo
+
+pytestmark = pytest.mark.usefixtures("git_identity")
+
+
+def count_git_commands(monkeypatch, *commands: str) -> dict:
+    """count the git commands run from now on"""
+    counts = dict.fromkeys(commands, 0)
+    execute = git.Git.execute
+
+    def count(self, command, *args, **kwargs):
+        if command[1] in counts:
+            counts[command[1]] += 1
+        return execute(self, command, *args, **kwargs)
+
+    monkeypatch.setattr(git.Git, "execute", count)
+    return counts
+
+
+def test_lookups_match_the_backend(tmp_path: Path, create_repo):
+    upstream = create_repo(tmp_path / "upstream")
+    upstream.checkout("c8", create_branch=True)
+    clone = git.Repo.clone_from(str(tmp_path / "upstream"), tmp_path / "clone")
+    repo = GitRepo(Path(clone.working_dir))
+    repo.checkout("c8s", create_branch=True)
+    repo.create_tag("acl-2.2.53-1.el8", "HEAD")
+    repo.repo.create_tag("annotated", message="annotated tag")
+    repo.repo.create_tag("tree", ref="HEAD^{tree}")
+    (repo.repo_path / "acl.spec").write_text("Name: acl\nVersion: 2.2.53")
+
+    refs = ["c8s", "c8", "master", "c9s"]
+    paths = ["acl.spec", "SOURCES", "SOURCES/acl.patch", "SOURCES/acl", "README"]
+    expected = (
+        [repo.backend.has_ref(ref) for ref in refs],
+        [repo.backend.is_file_tracked(path) for path in paths],
+        repo.repo.is_dirty(),
+    )
+    with repo.snapshot():
+        assert (
+            [repo.has_ref(ref) for ref in refs],
+            [repo.is_file_tracked(path) for path in paths],
+            repo.is_dirty(),
+        ) == expected
+        assert repo.get_tags_for_head() == ["acl-2.2.53-1.el8", "annotated"]
+        # pathspecs are left to git
+        assert repo.is_file_tracked("SOURCES/*.patch")
+
+
+def test_one_scan_per_snapshot(tmp_path: Path, monkeypatch, create_repo):
+    repo = create_repo(tmp_path)
+    repo.create_tag("acl-2.2.53-1.el8", "HEAD")
+    counts = count_git_commands(monkeypatch, "for-each-ref", "ls-files", "status")
+
+    with repo.snapshot() as snapshot:
+        with repo.snapshot() as nested:
+            assert nested is snapshot
+            for _ in range(3):
+                assert repo.has_ref("master")
+                assert repo.get_tags_for_head() == ["acl-2.2.53-1.el8"]
+                assert repo.is_file_tracked("acl.spec")
+                assert not repo.is_file_tracked("acl.tar.gz")
+                assert not repo.is_dirty()
+
+    assert counts == {"for-each-ref": 1, "ls-files": 1, "status": 1}
+    assert repo._snapshot is None
+
+
+def test_writes_invalidate(tmp_path: Path, create_repo):
+    repo = create_repo(tmp_path)
+    with repo.snapshot():
+        assert not repo.has_ref("c8s")
+        assert not repo.is_file_tracked("README")
+        assert repo.get_tags_for_head() == []
+
+        repo.checkout("c8s", create_branch=True)
+        assert repo.has_ref("c8s")
+        (tmp_path / "README").write_text("source-git")
+        repo.stage(add="README")
+        assert repo.is_file_tracked("README")
+        assert repo.is_dirty()
+        repo.commit("Add README")
+        assert not repo.is_dirty()
+        repo.create_tag("c8s-source-git", "HEAD")
+        assert repo.get_tags_for_head() == ["c8s-source-git"]
+
+        # changed without GitRepo
+        repo.repo.git.branch("c9s")
+        assert not repo.has_ref("c9s")
+        repo.invalidate()
+        assert repo.has_ref("c9s")
+
+
+def test_is_dirty(tmp_path: Path, monkeypatch, create_repo):
+    """a single `git status`, the same result as GitPython's two `git diff`s"""
+    repo = create_repo(tmp_path)
+    counts = count_git_commands(monkeypatch, "status")
+    (tmp_path / "untracked").write_text("untracked")
+    assert repo.is_dirty() is repo.repo.is_dirty() is False
+    (tmp_path / "acl.spec").write_text("Name: acl\nVersion: 2.2.53")
+    assert repo.is_dirty() is repo.repo.is_dirty() is True
+    repo.stage(add="acl.spec")
+    assert repo.is_dirty() is repo.repo.is_dirty() is True
+    assert counts == {"status": 3}
+
+
+def test_direct_writes_invalidate(tmp_path: Path, create_repo):
+    """Dist2Src invalidates the snapshot after running git itself"""
+    repo = create_repo(tmp_path / "src" / "acl")
+    first = repo.repo.head.commit.hexsha
+    repo.commit("Second commit")
+    d2s = Dist2Src(None, repo.repo_path)
+    with d2s.source_git.snapshot():
+        assert not d2s.source_git.has_ref("c8s")
+        d2s._reset_source_git("c8s", first)
+        assert d2s.source_git.has_ref("c8s")
@@ -0,0 +1,153 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+import os
+import signal
+from pathlib import Path
+
+import git
+import pytest
+from flexmock import flexmock
+
+from dist2src.core import Dist2Src, GitRepo
+from dist2src.journal import ConversionInterrupted, Journal, stop_on_signals
+
+CONVERSION = {"origin_branch": "c8s", "dest_branch": "c8s", "dist_git_commit": "abc"}
+
+
+@pytest.fixture()
+def repo(tmp_path: Path) -> Path:
+    git.Repo.init(tmp_path / "src")
+    return tmp_path / "src"
+
+
+def test_journal(repo: Path):
+    journal = Journal(repo, CONVERSION)
+    assert not journal.stages
+    journal.record("fetch_archive", sources={"SOURCES/acl.tar.gz": "123"})
+    journal.record("run_prep", commit="def")
+    journal.record("fetch_branch", commit="ghi")
+
+    journal = Journal(repo, CONVERSION)
+    assert list(journal.stages) == ["fetch_archive", "run_prep", "fetch_branch"]
+    assert journal.get("run_prep") == {"commit": "def"}
+    assert journal.get("rebase_patches") is None
+
+    # recording a stage again drops the ones after it
+    journal.record("run_prep", commit="jkl")
+    assert list(Journal(repo, CONVERSION).stages) == ["fetch_archive", "run_prep"]
+
+    journal.clear()
+    assert Journal.read(repo) is None
+
+
+def test_journal_of_different_conversion(repo: Path):
+    Journal(repo, CONVERSION).record("run_prep", commit="def")
+
+    journal = Journal(repo, dict(CONVERSION, dist_git_commit="xyz"))
+    assert not journal.stages
+    assert Journal.read(repo) is None
+
+
+def test_stop_on_signals(repo: Path):
+    journal = Journal(repo, CONVERSION)
+    original_handler = signal.getsignal(signal.SIGTERM)
+    with stop_on_signals():
+        os.kill(os.getpid(), signal.SIGTERM)
+        # stops at the next checkpoint, the stage is recorded
+        with pytest.raises(ConversionInterrupted):
+            journal.record("run_prep", commit="def")
+        journal.record("fetch_branch", commit="ghi")
+    assert signal.getsignal(signal.SIGTERM) is original_handler
+    assert list(Journal(repo, CONVERSION).stages) == ["run_prep", "fetch_branch"]
+
+
+def commit_file(repo: git.Repo, path: str, content: str, message: str):
+    file_path = Path(repo.working_dir) / path
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    file_path.write_text(content)
+    repo.index.add([path])
+    repo.index.commit(message)
+
+
+def test_perform_convert_resumes(tmp_path: Path, monkeypatch):
+    """an interrupted conversion continues after the last completed stage"""
+    for variable in ("GIT_AUTHOR", "GIT_COMMITTER"):
+        monkeypatch.setenv(f"{variable}_NAME", "Packit")
+        monkeypatch.setenv(f"{variable}_EMAIL", "packit@example.com")
+    monkeypatch.setenv("DIST2SRC_CACHE_DIR", str(tmp_path / "cache"))
+    dist_git = tmp_path / "rpms" / "acl"
+    dist_git_repo = git.Repo.init(dist_git)
+    dist_git_repo.git.checkout("-b", "c8s")
+    commit_file(
+        dist_git_repo, "SPECS/acl.spec", "Name: acl\n%prep\n%autosetup\n", "spec"
+    )
+    source_git = tmp_path / "src" / "acl"
+
+    def run_prep():
+        BUILD_repo = git.Repo.init(dist_git / "BUILD" / "acl-1.0")
+        commit_file(BUILD_repo, "README", "acl", "base")
+        commit_file(BUILD_repo, "acl.c", "fixed", "0001-fix.patch")
+
+    flexmock(Dist2Src).should_receive("fetch_archive").once()
+    flexmock(Dist2Src).should_receive("lookaside_sources").and_return({})
+    flexmock(Dist2Src).should_receive("run_prep").replace_with(run_prep).once()
+    flexmock(Dist2Src).should_receive("get_lookaside_sources").and_return([])
+    flexmock(Dist2Src).should_receive("copy_all_sources")
+    flexmock(Dist2Src).should_receive("copy_conditional_patches")
+    flexmock(GitRepo).should_call("cherry_pick_base").once()
+    rebase_patches = Dist2Src.rebase_patches
+    calls = []
+
+    def interrupted_rebase_patches(self, from_branch, to_branch):
+        calls.append(to_branch)
+        if len(calls) == 1:
+            # killed in the middle
+            self.source_git.checkout(to_branch)
+            raise ConversionInterrupted()
+        rebase_patches(self, from_branch, to_branch)
+
+    monkeypatch.setattr(Dist2Src, "rebase_patches", interrupted_rebase_patches)
+
+    with pytest.raises(ConversionInterrupted):
+        Dist2Src(dist_git, source_git).convert("c8s", "c8s")
+    assert list(Journal.read(source_git)["stages"]) == [
+        "start",
+        "fetch_archive",
+        "run_prep",
+        "fetch_branch",
+        "cherry_pick_base",
+        "add_sources",
+    ]
+
+    Dist2Src(dist_git, source_git).convert("c8s", "c8s")
+
+    assert Journal.read(source_git) is None
+    assert [c.summary for c in git.Repo(source_git).iter_commits("c8s")] == [
+        "0001-fix.patch",
+        "Add sources defined in the spec file",
+        "Add spec-file for the distribution",
+        ".packit.yaml",
+        "base",
+    ]
+
+
+def test_failed_conversion_clears_journal(tmp_path: Path, monkeypatch):
+    """only an interrupted conversion is resumed, a failed one starts over"""
+    dist_git = tmp_path / "rpms" / "acl"
+    dist_git_repo = git.Repo.init(dist_git)
+    dist_git_repo.git.checkout("-b", "c8s")
+    commit_file(
+        dist_git_repo, "SPECS/acl.spec", "Name: acl\n%prep\n%autosetup\n", "spec"
+    )
+    source_git = tmp_path / "src" / "acl"
+    git.Repo.init(source_git)
+
+    def failing_convert(self, origin_branch, dest_branch):
+        self.journal.record("start")
+        raise RuntimeError("%prep failed")
+
+    monkeypatch.setattr(Dist2Src, "_convert", failing_convert)
+    with pytest.raises(RuntimeError):
+        Dist2Src(dist_git, source_git).convert("c8s", "c8s")
+    assert Journal.read(source_git) is None
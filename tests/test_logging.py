@@ -1,11 +1,25 @@
+import gzip
+import logging
 import os
+import sys
+import time
 
 from pathlib import Path
-from dist2src.worker.logging import set_logging_to_file
+
+from flexmock import flexmock
+
+from dist2src.worker import logging as worker_logging
+from dist2src.worker.logging import (
+    CappedGzipHandler,
+    remove_old_logs,
+    set_logging_to_file,
+)
 
 
 def test_set_logging_to_file(tmpdir):
-    set_logging_to_file("acl", "00ab78", Path(tmpdir))
+    handler = set_logging_to_file("acl", "00ab78", Path(tmpdir))
+    logging.getLogger("dist2src").removeHandler(handler)
+    handler.close()
 
     expected_dir = Path(tmpdir / "acl")
     assert expected_dir.is_dir()
@@ -15,3 +29,97 @@ def test_set_logging_to_file(tmpdir):
 
     file = files[0]
     assert file.startswith("00ab78_")
+    assert file.endswith(".log.gz")
+    with gzip.open(expected_dir / file, "rt") as log:
+        assert "Processing repository acl, commit SHA 00ab78." in log.read()
+
+
+def test_log_head_and_tail(tmp_path: Path):
+    logger = logging.getLogger("dist2src.test")
+    handler = set_logging_to_file(
+        "acl", "00ab78", tmp_path, head_size=200, tail_size=200
+    )
+    try:
+        for i in range(1000):
+            logger.debug(f"line {i:04}")
+    finally:
+        logging.getLogger("dist2src").removeHandler(handler)
+        handler.close()
+
+    (path,) = (tmp_path / "acl").iterdir()
+    with gzip.open(path, "rt") as log:
+        lines = log.read().splitlines()
+    (skipped,) = [i for i, line in enumerate(lines) if "skipped" in line]
+    head, tail = lines[:skipped], lines[skipped:][1:]
+    assert "Processing repository acl" in head[0]
+    assert head[1].endswith("line 0000")
+    assert tail[-1].endswith("line 0999")
+    assert sum(len(line) + 1 for line in head) <= 200
+    assert sum(len(line) + 1 for line in tail) <= 200
+
+
+def test_log_tail_is_flushed(tmp_path: Path):
+    """the end of the log is on the disk before the handler is closed"""
+    path = tmp_path / "00ab78.log.gz"
+    handler = CappedGzipHandler(path, head_size=20, tail_size=40, flush_interval=0)
+    for i in range(10):
+        handler.emit(logging.makeLogRecord({"msg": f"line {i}"}))
+
+    tail = (tmp_path / "00ab78.log.tail").read_text().splitlines()
+    assert tail[0].startswith("[... ")
+    assert tail[-1] == "line 9"
+    # the head can be read from the unfinished gzip file
+    with gzip.open(path, "rt") as log:
+        assert log.read(7) == "line 0\n"
+
+    handler.close()
+    assert [p.name for p in tmp_path.iterdir()] == ["00ab78.log.gz"]
+    with gzip.open(path, "rt") as log:
+        assert log.read().splitlines()[-1] == "line 9"
+
+
+def test_log_size_is_in_bytes(tmp_path: Path):
+    path = tmp_path / "00ab78.log.gz"
+    handler = CappedGzipHandler(path, head_size=25, tail_size=25)
+    for i in range(10):
+        handler.emit(logging.makeLogRecord({"msg": f"čtení {i}"}))
+    handler.close()
+
+    with gzip.open(path, "rt") as log:
+        lines = log.read().splitlines()
+    # 'čtení N\n' is 8 characters, but 10 bytes
+    assert lines[:2] == ["čtení 0", "čtení 1"]
+    assert lines[-2:] == ["čtení 8", "čtení 9"]
+    assert lines[2] == "[... 6 records (60 B) skipped ...]"
+
+
+def test_remove_old_logs(tmp_path: Path):
+    now = time.time()
+    for name, age, size in [
+        ("acl/old.log.gz", 3 * 24 * 3600, 10),
+        ("acl/older.log", 2 * 3600, 100),
+        ("acl/new.log.gz", 3600, 100),
+        ("kernel/new.log.gz", 60, 100),
+    ]:
+        path = tmp_path / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(b"x" * size)
+        os.utime(path, (now - age, now - age))
+
+    remove_old_logs(tmp_path, max_age=24 * 3600, max_size=250)
+
+    assert sorted(str(p.relative_to(tmp_path)) for p in tmp_path.glob("*/*")) == [
+        "acl/new.log.gz",
+        "kernel/new.log.gz",
+    ]
+
+
+def test_old_logs_are_removed_once_per_interval(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(worker_logging, "_old_logs_removed", {})
+    flexmock(worker_logging).should_receive("remove_old_logs").with_args(
+        tmp_path, max_age=3600, max_size=sys.maxsize
+    ).once()
+    for _ in range(3):
+        handler = set_logging_to_file("acl", "00ab78", tmp_path, max_age=3600)
+        logging.getLogger("dist2src").removeHandler(handler)
+        handler.close()
@@ -0,0 +1,79 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+import hashlib
+from pathlib import Path
+
+import git
+import pytest
+import sh
+from flexmock import flexmock
+
+from dist2src.core import Dist2Src, checksum_matches
+
+ARCHIVE = b"acl-2.2.53"
+
+
+@pytest.fixture()
+def dist_git(tmp_path: Path) -> Path:
+    path = tmp_path / "rpms" / "acl"
+    (path / "SOURCES").mkdir(parents=True)
+    sha = hashlib.sha1(ARCHIVE).hexdigest()
+    (path / ".acl.metadata").write_text(f"{sha} SOURCES/acl-2.2.53.tar.gz\n")
+    git.Repo.init(path)
+    return path
+
+
+def get_sources(dist_git: Path, calls: list):
+    def command():
+        calls.append(1)
+        (dist_git / "SOURCES" / "acl-2.2.53.tar.gz").write_bytes(ARCHIVE)
+
+    return command
+
+
+@pytest.mark.parametrize(
+    "algorithm, content, expected",
+    [
+        ("md5", ARCHIVE, True),
+        ("sha1", ARCHIVE, True),
+        ("sha256", ARCHIVE, True),
+        ("sha512", ARCHIVE, True),
+        ("sha256", b"corrupted", False),
+    ],
+)
+def test_checksum_matches(tmp_path: Path, algorithm, content, expected):
+    path = tmp_path / "archive"
+    path.write_bytes(content)
+    checksum = hashlib.new(algorithm, ARCHIVE).hexdigest()
+    assert checksum_matches(path, checksum) is expected
+    assert not checksum_matches(tmp_path / "missing", checksum)
+
+
+def test_sources_are_downloaded_once(dist_git: Path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        sh, "Command", {"get_sources.sh": get_sources(dist_git, calls)}.get
+    )
+    d2s = Dist2Src(dist_git, None)
+    assert not d2s.sources_downloaded()
+    d2s.fetch_archive()
+    # e.g. converting the next branch, with the same sources
+    d2s.fetch_archive()
+    assert calls == [1]
+    assert d2s.downloaded_sources == ["SOURCES/acl-2.2.53.tar.gz"]
+
+    # a different archive is downloaded again
+    (dist_git / "SOURCES" / "acl-2.2.53.tar.gz").write_bytes(b"corrupted")
+    d2s.fetch_archive()
+    assert calls == [1, 1]
+
+
+def test_lookaside_sources_are_read_per_conversion(dist_git: Path):
+    d2s = Dist2Src(dist_git, None)
+    assert list(d2s.lookaside_sources()) == ["SOURCES/acl-2.2.53.tar.gz"]
+    (dist_git / ".acl.metadata").write_text("abc SOURCES/acl-2.3.1.tar.gz\n")
+    flexmock(d2s).should_receive("_open_journal").and_raise(RuntimeError)
+    with pytest.raises(RuntimeError):
+        d2s.convert("c8", "c8")
+    assert list(d2s.lookaside_sources()) == ["SOURCES/acl-2.3.1.tar.gz"]
@@ -0,0 +1,89 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+import time
+
+import pytest
+
+from dist2src.metrics import (
+    REGISTRY,
+    StageTimings,
+    observe_pending,
+    size_bucket,
+    timed_stage,
+)
+
+
+@pytest.mark.parametrize(
+    "size,bucket",
+    (
+        (None, "unknown"),
+        (0, "small"),
+        (50 * 1024**2, "medium"),
+        (500 * 1024**2, "large"),
+        (5 * 1024**3, "huge"),
+    ),
+)
+def test_size_bucket(size, bucket):
+    assert size_bucket(size) == bucket
+
+
+def get_count(stage: str, size: str) -> float:
+    return (
+        REGISTRY.get_sample_value(
+            "dist2src_stage_duration_seconds_count", {"stage": stage, "size": size}
+        )
+        or 0
+    )
+
+
+def test_stage_timings():
+    """Stages are observed once the size is known, repeated stages add up."""
+    before = get_count("clone", "medium")
+    timings = StageTimings()
+    with timings.stage("clone"):
+        pass
+    with timings.stage("clone"):
+        pass
+    assert list(timings.durations) == ["clone"]
+
+    timings.size = 50 * 1024**2
+    timings.observe()
+    assert get_count("clone", "medium") == before + 1
+    assert not timings.durations
+
+
+def test_nested_stage():
+    """A stage measured within another one is not counted in it."""
+    timings = StageTimings()
+    start = time.monotonic()
+    with timings.stage("run_prep"):
+        time.sleep(0.05)
+        timings.add_nested("decompress", 0.04, within="run_prep")
+    elapsed = time.monotonic() - start
+    assert timings.durations["decompress"] == 0.04
+    assert 0.01 <= timings.durations["run_prep"] <= elapsed - 0.04
+
+    # never negative
+    with timings.stage("clone"):
+        timings.add_nested("ls_remote", 10.0, within="clone")
+    assert timings.durations["clone"] == 0.0
+
+
+def test_timed_stage_failure():
+    """Failed stages are measured as well and can be observed later."""
+
+    class Converter:
+        def __init__(self):
+            self.timings = StageTimings()
+
+        @timed_stage("run_prep")
+        def run_prep(self):
+            raise RuntimeError("rpmbuild failed")
+
+    before = get_count("run_prep", "unknown")
+    converter = Converter()
+    with pytest.raises(RuntimeError):
+        converter.run_prep()
+    observe_pending()
+    assert get_count("run_prep", "unknown") == before + 1
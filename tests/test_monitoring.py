@@ -0,0 +1,69 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+import threading
+
+from flexmock import flexmock
+
+from dist2src.worker import monitoring
+from dist2src.worker.monitoring import REGISTRY, BackgroundPusher, Pushgateway
+
+
+def test_metrics_accumulate_in_process():
+    """Counters are shared by all Pushgateway instances in the process."""
+    flexmock(monitoring.pusher).should_receive("request_push").twice()
+    before = REGISTRY.get_sample_value("created_updates_total") or 0
+
+    Pushgateway().push_created_update()
+    Pushgateway().push_created_update()
+
+    assert REGISTRY.get_sample_value("created_updates_total") == before + 2
+
+
+def test_clones_avoided():
+    flexmock(monitoring.pusher).should_receive("request_push").twice()
+    abandoned = REGISTRY.get_sample_value("abandoned_updates_total") or 0
+    avoided = REGISTRY.get_sample_value("dist2src_clones_avoided_total") or 0
+
+    Pushgateway().push_abandoned_update()
+    Pushgateway().push_abandoned_update(clone_avoided=True)
+
+    assert REGISTRY.get_sample_value("abandoned_updates_total") == abandoned + 2
+    assert REGISTRY.get_sample_value("dist2src_clones_avoided_total") == avoided + 1
+
+
+def test_no_pushgateway_address(monkeypatch):
+    monkeypatch.delenv("PUSHGATEWAY_ADDRESS", raising=False)
+    flexmock(monitoring).should_receive("push_to_gateway").never()
+    pusher = BackgroundPusher(REGISTRY, interval=0)
+    pusher.request_push()
+    assert pusher._thread is None
+
+
+def test_push_requests_are_coalesced(monkeypatch):
+    """
+    Requests made while a push is in progress don't block the caller
+    and result in a single additional push.
+    """
+    monkeypatch.setenv("PUSHGATEWAY_ADDRESS", "http://pushgateway")
+    in_push = threading.Event()
+    release = threading.Event()
+    pushes = []
+
+    def slow_push(address, job, registry, grouping_key):
+        pushes.append(address)
+        in_push.set()
+        release.wait(5)
+
+    flexmock(monitoring).should_receive("push_to_gateway").replace_with(slow_push)
+    pusher = BackgroundPusher(REGISTRY, interval=0)
+
+    pusher.request_push()
+    assert in_push.wait(5)
+    # the Pushgateway is stuck, these return immediately
+    for _ in range(10):
+        pusher.request_push()
+    release.set()
+    pusher.flush()
+
+    assert pushes == ["http://pushgateway"] * 2
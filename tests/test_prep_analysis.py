@@ -0,0 +1,180 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+from pathlib import Path
+
+import git
+import pytest
+from flexmock import flexmock
+
+from dist2src import prep_analysis
+from dist2src.core import Dist2Src
+from dist2src.prep_analysis import PrepVerdict, analyze_prep, get_prep, get_prep_verdict
+from tests.synthetic import PREP_STYLES
+
+SPEC = """\
+Name: acl
+Version: 2.2.53
+{definitions}
+
+%description
+ACL
+
+%prep
+{prep}
+
+%build
+make
+"""
+
+
+def spec(prep: str, definitions: str = "") -> str:
+    return SPEC.format(prep=prep, definitions=definitions)
+
+
+def test_get_prep():
+    assert get_prep(spec("%setup -q\n%patch1 -p1")) == [
+        "%setup -q",
+        "%patch1 -p1",
+        "",
+    ]
+    assert get_prep("Name: appstream-data\n%build\nmake\n") is None
+
+
+@pytest.mark.parametrize(
+    "prep", [style.format(patches="%patch1 -p1") for style in PREP_STYLES.values()]
+)
+def test_convertible(prep):
+    assert analyze_prep(spec(prep)) == PrepVerdict(single_commit=False, reasons=[])
+
+
+@pytest.mark.parametrize(
+    "prep,definitions,reason",
+    [
+        ("%setup -q -a 1 -a 2\n%patch1 -p1", "", "multiple archives unpacked by"),
+        ("%setup -q -qa1 -a2", "", "multiple archives unpacked by"),
+        ("%setup -q\npushd src\n%patch1 -p1\npopd", "", "not applied in the top-level"),
+        ("%setup -q\ncd src\n%patch1 -p1", "", "not applied in the top-level"),
+        (
+            "%setup -q\n%{patch_in_src}",
+            "%global patch_in_src cd src; %patch1",
+            "not applied",
+        ),
+        ("%autosetup -S git", "%global __scm_apply_git(qp:m:) %{__git} am", "%__scm_*"),
+        ("%setup -q\ntar -xf %{SOURCE1}\n%patch1 -p1", "", "nested archive"),
+        (
+            "%setup -q\n%{uncompress:%{SOURCE2}} | tar -xf -\n%autopatch -p1",
+            "",
+            "nested archive",
+        ),
+    ],
+)
+def test_single_commit(prep, definitions, reason):
+    verdict = analyze_prep(spec(prep, definitions))
+    assert verdict.single_commit
+    assert reason in verdict.reasons[0]
+
+
+def test_no_prep():
+    assert analyze_prep("Name: appstream-data\n%build\n") == PrepVerdict(
+        single_commit=True, reasons=["no %prep section"]
+    )
+
+
+def test_back_in_top_level():
+    assert not analyze_prep(
+        spec("%setup -q\npushd src\nmake gen\npopd\ncd doc\ncd ..\n%patch1 -p1")
+    ).single_commit
+
+
+@pytest.mark.parametrize(
+    "prep",
+    [
+        # patches are applied by %autosetup, before the archive is unpacked
+        "%autosetup -Sgit\ntar fx %SOURCE1",
+        "%setup -q\n%patch1 -p1\ntar -xf %{SOURCE1}",
+    ],
+)
+def test_nested_archive_after_patches(prep):
+    assert not analyze_prep(spec(prep)).single_commit
+
+
+def test_get_prep_verdict_is_cached(tmp_path: Path):
+    content = spec("%setup -q\npushd src\n%patch1 -p1\npopd")
+    verdict = get_prep_verdict(content, cache_dir=tmp_path)
+    assert verdict.single_commit
+
+    flexmock(prep_analysis).should_receive("analyze_prep").never()
+    assert get_prep_verdict(content, cache_dir=tmp_path) == verdict
+
+
+@pytest.mark.parametrize(
+    "name,prep,single_commit",
+    [
+        ("acl", "%autosetup -p1", False),
+        ("acl", "%setup -q\npushd src\n%patch1 -p1\npopd", True),
+        # the override
+        ("kernel", "%autosetup -p1", True),
+    ],
+)
+def test_needs_single_commit(tmp_path: Path, monkeypatch, name, prep, single_commit):
+    monkeypatch.setenv("DIST2SRC_CACHE_DIR", str(tmp_path / "cache"))
+    dist_git = tmp_path / name
+    (dist_git / "SPECS").mkdir(parents=True)
+    (dist_git / "SPECS" / f"{name}.spec").write_text(spec(prep))
+    repo = git.Repo.init(dist_git)
+    repo.git.checkout("-b", "c8s")
+    repo.index.add([f"SPECS/{name}.spec"])
+    repo.index.commit("spec")
+
+    d2s = Dist2Src(dist_git_path=dist_git, source_git_path=None)
+    assert d2s.needs_single_commit("c8s") is single_commit
+    # unknown branch
+    assert d2s.needs_single_commit("c9s") is (name == "kernel")
+
+
+@pytest.mark.parametrize(
+    "name,prep,start_commit,single_commit,analyzed",
+    [
+        # the strategy of the existing branch wins over the analyzer
+        ("acl", "%autosetup -p1", "Source-git repo for acl", True, False),
+        (
+            "acl",
+            "%setup -q\npushd src\n%patch1 -p1\npopd",
+            "Add sources defined in the spec file",
+            False,
+            True,
+        ),
+        # the override
+        (
+            "kernel",
+            "%autosetup -p1",
+            "Add sources defined in the spec file",
+            True,
+            True,
+        ),
+    ],
+)
+def test_needs_single_commit_update(
+    tmp_path: Path, monkeypatch, name, prep, start_commit, single_commit, analyzed
+):
+    monkeypatch.setenv("DIST2SRC_CACHE_DIR", str(tmp_path / "cache"))
+    dist_git = tmp_path / "rpms" / name
+    (dist_git / "SPECS").mkdir(parents=True)
+    (dist_git / "SPECS" / f"{name}.spec").write_text(spec(prep))
+    repo = git.Repo.init(dist_git)
+    repo.git.checkout("-b", "c8s")
+    repo.index.add([f"SPECS/{name}.spec"])
+    repo.index.commit("spec")
+    source_git = tmp_path / "src" / name
+    source_git.mkdir(parents=True)
+    sg_repo = git.Repo.init(source_git)
+    sg_repo.git.checkout("-b", "c8s")
+    sg_repo.index.commit(start_commit)
+    sg_repo.create_tag("c8s-source-git")
+    sg_repo.index.commit("Apply patch acl.patch")
+
+    d2s = Dist2Src(dist_git_path=dist_git, source_git_path=source_git)
+    assert d2s.needs_single_commit("c8s", "c8s") is single_commit
+    # a new source-git branch is analyzed
+    assert d2s.needs_single_commit("c8s", "c9s") is analyzed
@@ -7,15 +7,22 @@ import shutil
 from pathlib import Path
 
 import git
+import pytest
 from flexmock import flexmock
 from ogr.services.gitlab.service import GitlabService
 
 from dist2src.constants import GITLAB_SRC_NAMESPACE
 from dist2src.core import Dist2Src
+from dist2src.metrics import StageTimings
 from dist2src.worker import logging as worker_logging
-from dist2src.worker import processor
+from dist2src.worker import processor, sentry
+from dist2src.worker.celerizer import celery_app
 from dist2src.worker.monitoring import Pushgateway
 from dist2src.worker.processor import Processor
+from dist2src.worker.tasks import process_message
+from dist2src.worker.updater import Updater
+from tests.fake_services import FakeServices
+from tests.test_worker_updater import create_bare_repo, tags_api
 
 
 def test_event_not_for_dist_git_namespace(caplog):
@@ -124,7 +131,7 @@ def test_already_up_to_date(caplog):
         .and_return(src_git_project)
     )
     src_git_project.should_receive("exists").and_return(True)
-    src_git_project.should_receive("get_tags").and_return(["convert/c8s/0a0c838"])
+    src_git_project.gitlab_repo = tags_api(["convert/c8s/0a0c838"])
     flexmock(Pushgateway).should_receive("push_received_message").with_args(
         ignored=True
     ).once()
@@ -157,10 +164,14 @@ def test_conversion():
         .and_return(src_git_project)
     )
     src_git_project.should_receive("exists").and_return(True)
-    src_git_project.should_receive("get_tags").and_return(["convert/c8s/hash4321"])
+    src_git_project.gitlab_repo = tags_api(["convert/c8s/hash4321"])
 
     # Previous working directories are cleaned up.
     flexmock(shutil).should_receive("rmtree")
+    # The branch in dist-git is still at the commit of the event.
+    flexmock(processor).should_receive("ls_remote").with_args(
+        "https://git.centos.org/rpms/acl.git", "refs/heads/c8s", heads=True
+    ).and_return({"refs/heads/c8s": "0a0c838"}).once()
     # Dist-git repo is cloned and the branch is checked out.
     dist_git_repo = flexmock(
         git=flexmock(), branches={"c8s": flexmock(commit=flexmock(hexsha="0a0c838"))}
@@ -180,10 +191,13 @@ def test_conversion():
         {"ssh": "ssh://git@gitlab.com/redhat/centos-stream/src/acl"}
     )
     src_git_repo = flexmock(
-        git=flexmock(),
-        references=[flexmock(remote_head="c8s")],
-        heads={"c8s": flexmock(commit="newcommithash")},
+        git=flexmock(), heads={"c8s": flexmock(commit="newcommithash")}
     )
+    # the refs are read at once
+    src_git_repo.git.should_receive("for_each_ref").and_return(
+        "refs/heads/main\0commit\0a1b2c3d\0\0\n"
+        "refs/remotes/origin/c8s\0commit\0e4f5a6b\0\0"
+    ).once()
     (
         flexmock(git.Repo)
         .should_receive("clone_from")
@@ -205,6 +219,7 @@ def test_conversion():
         .with_args(
             dist_git_path=Path("/workdir/rpms/acl"),
             source_git_path=Path("/workdir/redhat/centos-stream/src/acl"),
+            timings=StageTimings,
         )
         .and_return(d2s)
     )
@@ -219,7 +234,12 @@ def test_conversion():
     )
     # Result is pushed.
     src_git_repo.git.should_receive("push").with_args(
-        "origin", "c8s", tags=True, force=True
+        "origin",
+        "c8s",
+        "refs/tags/convert/c8s/0a0c838",
+        "refs/tags/c8s-source-git",
+        force=True,
+        atomic=True,
     ).once()
 
     flexmock(Pushgateway).should_receive("push_received_message").with_args(
@@ -227,7 +247,9 @@ def test_conversion():
     ).once()
     flexmock(Pushgateway).should_receive("push_created_update").once()
 
-    flexmock(worker_logging).should_receive("set_logging_to_file").once()
+    flexmock(worker_logging).should_receive("set_logging_to_file").and_return(
+        logging.NullHandler()
+    ).once()
 
     Processor().process_message(
         {
@@ -236,3 +258,211 @@ def test_conversion():
             "end_commit": "0a0c838",
         }
     )
+
+
+@pytest.mark.parametrize("converted_by_another_task", [None, "c8"])
+def test_conversion_of_several_branches(converted_by_another_task):
+    """
+    The branches of a task are converted in the same clones,
+    by the same Dist2Src, and pushed at once.
+
+    A branch another task converted in the meantime is not pushed.
+    """
+    src_git_project = flexmock(gitlab_repo=tags_api(["convert/c8/0a0c838"]))
+    src_git_project.should_receive("exists").and_return(True)
+    src_git_project.should_receive("get_git_urls").and_return({"ssh": "ssh://src/acl"})
+    flexmock(GitlabService).should_receive("get_project").and_return(src_git_project)
+    flexmock(shutil).should_receive("rmtree")
+    # the heads of all the branches are checked at once
+    flexmock(processor).should_receive("ls_remote").with_args(
+        "https://git.centos.org/rpms/acl.git",
+        "refs/heads/c8",
+        "refs/heads/c8s",
+        heads=True,
+    ).and_return({"refs/heads/c8": "1b1d949", "refs/heads/c8s": "1b1d949"}).once()
+    dist_git_repo = flexmock(
+        git=flexmock(),
+        branches={
+            branch: flexmock(commit=flexmock(hexsha="1b1d949"))
+            for branch in ("c8", "c8s")
+        },
+    )
+    src_git_repo = flexmock(
+        git=flexmock(),
+        heads={"c8": flexmock(commit="c8commit"), "c8s": flexmock(commit="c8scommit")},
+    )
+    src_git_repo.git.should_receive("for_each_ref").and_return("").once()
+    flexmock(git.Repo).should_receive("clone_from").and_return(
+        dist_git_repo
+    ).and_return(src_git_repo).twice()
+    dist_git_repo.git.should_receive("checkout").with_args("c8").once()
+    dist_git_repo.git.should_receive("checkout").with_args("c8s").once()
+
+    d2s = flexmock()
+    flexmock(processor).should_receive("Dist2Src").and_return(d2s).once()
+    d2s.should_receive("convert").with_args("c8", "c8").once().ordered()
+    d2s.should_receive("convert").with_args("c8s", "c8s").once().ordered()
+    for branch in ("c8", "c8s"):
+        tag = src_git_repo.git.should_receive("tag").with_args(
+            "--annotate",
+            "--message",
+            f"Converted from commit 1b1d949,\nfrom branch {branch}.",
+            f"convert/{branch}/1b1d949",
+            f"{branch}commit",
+        )
+        if branch == converted_by_another_task:
+            tag.and_raise(
+                git.GitCommandError(
+                    "git tag",
+                    128,
+                    stderr=f"fatal: tag 'convert/{branch}' already exists",
+                )
+            )
+        tag.once()
+    pushed = [b for b in ("c8", "c8s") if b != converted_by_another_task]
+    # not the tags of the dropped branch, its conversion moved c8-source-git
+    refspecs = []
+    for branch in pushed:
+        refspecs += [
+            branch,
+            f"refs/tags/convert/{branch}/1b1d949",
+            f"refs/tags/{branch}-source-git",
+        ]
+    src_git_repo.git.should_receive("push").with_args(
+        "origin", *refspecs, force=True, atomic=True
+    ).once()
+
+    flexmock(Pushgateway).should_receive("push_received_message").with_args(
+        ignored=False
+    ).once()
+    flexmock(Pushgateway).should_receive("push_created_update").times(len(pushed))
+    flexmock(worker_logging).should_receive("set_logging_to_file").and_return(
+        logging.NullHandler()
+    )
+
+    Processor().process_message(
+        {
+            "repo": {"fullname": "rpms/acl", "name": "acl"},
+            "branch": "c8",
+            "end_commit": "1b1d949",
+            "branches": {"c8": "1b1d949", "c8s": "1b1d949", "work": "1b1d949"},
+        }
+    )
+
+
+def test_converted_branches_are_dropped(caplog):
+    """
+    Branches already converted, or moved on since the event, are not converted.
+    """
+    src_git_project = flexmock(gitlab_repo=tags_api(["convert/c8/0a0c838"]))
+    src_git_project.should_receive("exists").and_return(True)
+    flexmock(GitlabService).should_receive("get_project").and_return(src_git_project)
+    flexmock(shutil).should_receive("rmtree")
+    flexmock(processor).should_receive("ls_remote").with_args(
+        "https://git.centos.org/rpms/acl.git", "refs/heads/c8s", heads=True
+    ).and_return({"refs/heads/c8s": "2c2e050"}).once()
+    flexmock(git.Repo).should_receive("clone_from").never()
+    flexmock(worker_logging).should_receive("set_logging_to_file").and_return(
+        logging.NullHandler()
+    )
+    flexmock(Pushgateway).should_receive("push_received_message").with_args(
+        ignored=False
+    ).once()
+    flexmock(Pushgateway).should_receive("push_abandoned_update").with_args(
+        clone_avoided=True
+    ).once()
+
+    with caplog.at_level(logging.INFO):
+        Processor().process_message(
+            {
+                "repo": {"fullname": "rpms/acl", "name": "acl"},
+                "branch": "c8",
+                "end_commit": "0a0c838",
+                "branches": {"c8": "0a0c838", "c8s": "1b1d949"},
+            }
+        )
+    assert "branch 'c8'. The source-git repo is already up to date" in caplog.text
+    assert "HEAD of 'c8s' (2c2e050) is not matching" in caplog.text
+
+
+def test_stale_event_is_abandoned_before_cloning(caplog):
+    """
+    When the branch in dist-git moved on since the event, nothing is cloned.
+    """
+    src_git_project = flexmock(gitlab_repo=tags_api([]))
+    src_git_project.should_receive("exists").and_return(True)
+    flexmock(GitlabService).should_receive("get_project").and_return(src_git_project)
+    flexmock(shutil).should_receive("rmtree")
+    flexmock(processor).should_receive("ls_remote").and_return(
+        {"refs/heads/c8s": "1b1d949"}
+    )
+    flexmock(git.Repo).should_receive("clone_from").never()
+    flexmock(Dist2Src).should_receive("convert").never()
+    flexmock(worker_logging).should_receive("set_logging_to_file").and_return(
+        logging.NullHandler()
+    )
+    flexmock(Pushgateway).should_receive("push_received_message")
+    flexmock(Pushgateway).should_receive("push_abandoned_update").with_args(
+        clone_avoided=True
+    ).once()
+
+    with caplog.at_level(logging.INFO):
+        Processor().process_message(
+            {
+                "repo": {"fullname": "rpms/acl", "name": "acl"},
+                "branch": "c8s",
+                "end_commit": "0a0c838",
+            }
+        )
+    assert "Abandon updating acl" in caplog.text
+
+
+def test_update_pipeline(tmp_path, monkeypatch):
+    """
+    The update tasks created by the updater are processed by the worker,
+    against the local stand-in services; the conversion itself is faked.
+    """
+    with FakeServices(tmp_path / "services") as services:
+        for key, value in services.environ.items():
+            monkeypatch.setenv(key, value)
+        monkeypatch.setenv("D2S_WORKDIR", str(tmp_path / "workdir"))
+        monkeypatch.setenv("D2S_LOGS_DIR", str(tmp_path / "logs"))
+        monkeypatch.setenv("D2S_BRANCHES_WATCHED", "c8s")
+        monkeypatch.setenv("CELERY_TASK_NAME", "task.run_dist2src")
+        for variable in ("NAME", "EMAIL"):
+            for role in ("AUTHOR", "COMMITTER"):
+                monkeypatch.setenv(f"GIT_{role}_{variable}", "packit@example.com")
+        (tmp_path / "workdir").mkdir()
+        flexmock(sentry).should_receive("configure_sentry")
+
+        heads = create_bare_repo(tmp_path / "acl", branches=["c8s"])
+        create_bare_repo(tmp_path / "acl-src", branches=["c8s"])
+        services.add_git_project(
+            "acl", dist_git=tmp_path / "acl", src_git=tmp_path / "acl-src"
+        )
+
+        def convert(origin_branch, dest_branch):
+            repo = git.Repo(tmp_path / "workdir" / GITLAB_SRC_NAMESPACE / "acl")
+            repo.git.commit("--allow-empty", "-m", f"Convert {origin_branch}")
+            # the upstream ref tag, as Dist2Src does
+            repo.create_tag(f"{dest_branch}-source-git", force=True)
+
+        flexmock(processor).should_receive("Dist2Src").replace_with(
+            lambda **kwargs: flexmock(convert=convert)
+        )
+        sent = []
+        flexmock(celery_app).should_receive("send_task").replace_with(
+            lambda name, expires, kwargs, **options: sent.append(kwargs)
+            or flexmock(id="uuid")
+        )
+
+        Updater().check_updates()
+        assert len(sent) == 1
+        process_message(**sent[0])
+
+        assert f"convert/c8s/{heads['c8s']}" in services.get_tags("acl")
+        assert "c8s-source-git" in services.get_tags("acl")
+        # the source-git repo is up to date now
+        sent.clear()
+        Updater().check_updates()
+        assert not sent
@@ -0,0 +1,58 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+import json
+import subprocess
+from pathlib import Path
+
+import git
+
+from dist2src.profiling import Profiler
+
+
+class Converter:
+    def __init__(self, path: Path):
+        self.repo = git.Repo.init(path)
+
+    def convert(self):
+        self.status()
+        subprocess.check_output(["git", "--version"])
+
+    def status(self):
+        return self.repo.git.status()
+
+
+def test_profiler(tmp_path: Path):
+    profiler = Profiler()
+    profiler.instrument(Converter)
+    converter = Converter(tmp_path / "repo")
+    profiler.start()
+    try:
+        converter.convert()
+    finally:
+        profiler.stop()
+
+    names = [(e["kind"], e["name"], e["stack"]) for e in profiler.events]
+    assert names == [
+        ("command", "git status", "Converter.convert;Converter.status;git status"),
+        ("method", "Converter.status", "Converter.convert;Converter.status"),
+        ("command", "git --version", "Converter.convert;git --version"),
+        ("method", "Converter.convert", "Converter.convert"),
+    ]
+    # everything is restored once stopped
+    assert Converter.convert.__name__ == "convert"
+    assert not hasattr(Converter.convert, "__wrapped__")
+    assert not hasattr(subprocess.check_output, "__wrapped__")
+
+    profile = tmp_path / "profile.json"
+    profiler.write(profile, dump="collapsed")
+    events = json.loads(profile.read_text())["events"]
+    assert {"wall", "cpu", "children_cpu", "max_rss"} <= set(events[0])
+    assert "Converter.convert" in (tmp_path / "profile.json.txt").read_text()
+    folded = (tmp_path / "profile.json.folded").read_text().splitlines()
+    assert {line.rsplit(" ", 1)[0] for line in folded} == {
+        "Converter.convert;Converter.status;git status",
+        "Converter.convert;Converter.status",
+        "Converter.convert;git --version",
+        "Converter.convert",
+    }
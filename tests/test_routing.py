@@ -0,0 +1,159 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+import subprocess
+import time
+from pathlib import Path
+
+import pytest
+from flexmock import flexmock
+
+from dist2src.worker import routing, tasks
+from dist2src.worker.celerizer import celery_app
+from dist2src.worker.config import Configuration, Queue
+from dist2src.worker.monitoring import Pushgateway
+from dist2src.worker.routing import (
+    REALTIME,
+    SCHEDULED,
+    Cost,
+    estimate_cost,
+    select_queue,
+    send_update_task,
+)
+from tests.fake_services import FakeServices
+from tests.synthetic import SyntheticDistGit
+
+EVENT = {
+    "repo": {"fullname": "rpms/acl", "name": "acl"},
+    "branch": "c8s",
+    "end_commit": "0a0c838",
+}
+
+
+@pytest.fixture()
+def cfg(monkeypatch):
+    monkeypatch.setenv("D2S_TASK_ROUTING", "true")
+    monkeypatch.setenv("D2S_LARGE_SIZE_THRESHOLD", "1000")
+    monkeypatch.setenv("D2S_LARGE_PATCHES_THRESHOLD", "10")
+    monkeypatch.setenv("D2S_SMALL_SOFT_TIME_LIMIT", "60")
+    return Configuration()
+
+
+def test_queues(cfg):
+    assert cfg.small_queue == Queue("dist2src-small", 60, 360)
+    assert cfg.large_queue == Queue("dist2src-large", 4 * 60 * 60, 4 * 60 * 60 + 300)
+
+
+@pytest.mark.parametrize(
+    "cost,queue",
+    [
+        (Cost(size=999, patches=9, hard=False), "dist2src-small"),
+        (Cost(size=1000, patches=9, hard=False), "dist2src-large"),
+        (Cost(size=999, patches=10, hard=False), "dist2src-large"),
+        (Cost(size=None, patches=None, hard=True), "dist2src-large"),
+        # unknown cost
+        (Cost(size=None, patches=9, hard=False), "dist2src-large"),
+    ],
+)
+def test_select_queue(cfg, cost, queue):
+    assert select_queue(cfg, cost).name == queue
+
+
+def test_estimate_cost(tmp_path: Path, monkeypatch):
+    with FakeServices(tmp_path / "services") as services:
+        for key, value in services.environ.items():
+            monkeypatch.setenv(key, value)
+        dist_git = SyntheticDistGit(tmp_path / "acl", patch_count=3).create()
+        archive = dist_git.path / "SOURCES" / "acl-1.0.tar.gz"
+        sha = services.add_lookaside_source("acl", "c8s", archive)
+        (dist_git.path / ".acl.metadata").write_text(f"{sha} SOURCES/acl-1.0.tar.gz\n")
+        subprocess.check_call(["git", "add", "."], cwd=dist_git.path)
+        subprocess.check_call(
+            ["git", "-c", "user.name=A", "-c", "user.email=a@b", "commit", "-qm", "x"],
+            cwd=dist_git.path,
+        )
+        services.add_git_project("acl", dist_git=dist_git.path)
+
+        assert estimate_cost(Configuration(), "acl", "c8s") == Cost(
+            size=archive.stat().st_size, patches=3, hard=False
+        )
+        # the files are not found
+        assert estimate_cost(Configuration(), "acl", "c9s") == Cost(
+            size=None, patches=None, hard=False
+        )
+        assert estimate_cost(Configuration(), "kernel", "c8s").hard
+
+
+@pytest.mark.parametrize(
+    "lane,queue",
+    [(REALTIME, "dist2src-small"), (SCHEDULED, "dist2src-small-scheduled")],
+)
+def test_send_update_task_routed(cfg, lane, queue):
+    flexmock(time).should_receive("time").and_return(1600000000.0)
+    flexmock(routing).should_receive("estimate_cost").with_args(
+        cfg, "acl", "c8s"
+    ).and_return(Cost(size=10, patches=1, hard=False))
+    flexmock(celery_app).should_receive("send_task").with_args(
+        name="task.dist2src.process_message",
+        expires=None,
+        kwargs={
+            "event": EVENT,
+            "routed": True,
+            "lane": lane,
+            "queued_at": 1600000000.0,
+        },
+        queue=queue,
+        soft_time_limit=60,
+        time_limit=360,
+    ).once()
+
+    send_update_task(cfg, "task.dist2src.process_message", EVENT, lane=lane)
+
+
+@pytest.mark.parametrize(
+    "lane,options",
+    [(REALTIME, {}), (SCHEDULED, {"queue": "dist2src-scheduled"})],
+)
+def test_send_update_task_not_routed(cfg, lane, options):
+    cfg.task_routing = False
+    flexmock(time).should_receive("time").and_return(1600000000.0)
+    flexmock(celery_app).should_receive("send_task").with_args(
+        name="task.dist2src.process_message",
+        expires=3600,
+        kwargs={
+            "event": EVENT,
+            "routed": True,
+            "lane": lane,
+            "queued_at": 1600000000.0,
+        },
+        **options,
+    ).once()
+
+    send_update_task(
+        cfg, "task.dist2src.process_message", EVENT, expires=3600, lane=lane
+    )
+
+
+def test_process_message_routes_events(cfg):
+    """events from the listener are passed on, routed tasks are processed"""
+    flexmock(tasks).should_receive("send_update_task").with_args(
+        Configuration, tasks.process_message.name, EVENT, lane=REALTIME
+    ).once()
+    flexmock(tasks.Processor).should_receive("process_message").with_args(
+        event=EVENT
+    ).once()
+
+    tasks.process_message(EVENT)
+    tasks.process_message(EVENT, routed=True)
+
+
+def test_process_message_measures_queue_wait(cfg):
+    flexmock(time).should_receive("time").and_return(1600000100.0)
+    flexmock(Pushgateway).should_receive("push_task_queue_wait").with_args(
+        SCHEDULED, 100.0
+    ).once()
+    flexmock(tasks.Processor).should_receive("process_message").with_args(
+        event=EVENT
+    ).once()
+
+    tasks.process_message(EVENT, routed=True, lane=SCHEDULED, queued_at=1600000000.0)
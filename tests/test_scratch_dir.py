@@ -0,0 +1,90 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+import shutil
+from collections import namedtuple
+from pathlib import Path
+
+import git
+import pytest
+import sh
+from flexmock import flexmock
+
+from dist2src.core import Dist2Src
+
+DiskUsage = namedtuple("DiskUsage", "total used free")
+
+
+@pytest.fixture()
+def dist_git(tmp_path: Path) -> Path:
+    path = tmp_path / "rpms" / "acl"
+    (path / "SPECS").mkdir(parents=True)
+    (path / "SPECS" / "acl.spec").write_text("Name: acl\n%prep\n%autosetup\n")
+    repo = git.Repo.init(path)
+    repo.index.add(["SPECS/acl.spec"])
+    repo.index.commit("spec")
+    return path
+
+
+@pytest.fixture()
+def scratch_dir(tmp_path: Path) -> Path:
+    path = tmp_path / "scratch"
+    path.mkdir()
+    return path
+
+
+def fake_rpmbuild(*args, _env):
+    """unpack the sources into _builddir, dist-git/BUILD by default"""
+    defines = dict(
+        args[i + 1].split(" ", 1) for i, a in enumerate(args) if a == "--define"
+    )
+    builddir = Path(defines.get("_builddir", f"{defines['_topdir']}/BUILD"))
+    (builddir / "acl-1.0").mkdir(parents=True)
+    (builddir / "acl-1.0" / "README").write_text("acl")
+    return flexmock(stderr=b"")
+
+
+@pytest.fixture()
+def rpmbuild(monkeypatch):
+    monkeypatch.setattr(sh, "Command", {"rpmbuild": fake_rpmbuild}.get)
+
+
+@pytest.mark.usefixtures("rpmbuild")
+def test_run_prep_in_scratch_dir(dist_git: Path, scratch_dir: Path):
+    d2s = Dist2Src(dist_git, None, scratch_dir=scratch_dir)
+    d2s.run_prep(ensure_autosetup=False)
+
+    (build_dir,) = scratch_dir.iterdir()
+    assert (dist_git / "BUILD").resolve() == build_dir
+    assert d2s.BUILD_repo_path.resolve() == build_dir / "acl-1.0"
+    assert (d2s.BUILD_repo_path / "README").read_text() == "acl"
+
+    # running %prep again starts from scratch
+    d2s.run_prep(ensure_autosetup=False)
+    assert list(scratch_dir.iterdir()) != [build_dir]
+    assert len(list(scratch_dir.iterdir())) == 1
+
+    d2s.remove_build_dir()
+    assert not (dist_git / "BUILD").exists()
+    assert not list(scratch_dir.iterdir())
+
+
+@pytest.mark.usefixtures("rpmbuild")
+def test_scratch_dir_too_small(dist_git: Path, scratch_dir: Path):
+    flexmock(Dist2Src).should_receive("sources_size").and_return(100 * 1024**2)
+    flexmock(shutil).should_receive("disk_usage").and_return(
+        DiskUsage(total=1024**3, used=1024**3 - 1024**2, free=1024**2)
+    )
+    d2s = Dist2Src(dist_git, None, scratch_dir=scratch_dir)
+    d2s.run_prep(ensure_autosetup=False)
+
+    # fell back to the dist-git
+    assert not (dist_git / "BUILD").is_symlink()
+    assert (dist_git / "BUILD" / "acl-1.0" / "README").is_file()
+    assert not list(scratch_dir.iterdir())
+
+
+def test_scratch_dir_from_environment(dist_git: Path, scratch_dir: Path, monkeypatch):
+    assert Dist2Src(dist_git, None).scratch_dir is None
+    monkeypatch.setenv("DIST2SRC_SCRATCH_DIR", str(scratch_dir))
+    assert Dist2Src(dist_git, None).scratch_dir == scratch_dir
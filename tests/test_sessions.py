@@ -0,0 +1,136 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import gitlab
+import pytest
+from flexmock import flexmock
+
+from dist2src import sessions
+from dist2src.metrics import REGISTRY
+from dist2src.sessions import SessionPool, get_client, get_session
+from dist2src.worker.config import Configuration
+from tests.fake_services import FakeServices
+
+
+@pytest.fixture(autouse=True)
+def pool(monkeypatch):
+    pool = SessionPool()
+    monkeypatch.setattr(sessions, "_pool", pool)
+    return pool
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_session(monkeypatch):
+    session = get_session("lookaside")
+    assert get_session("lookaside") is session
+    assert get_session("dist-git") is not session
+
+    # a forked process doesn't reuse the sessions
+    monkeypatch.setattr(os, "getpid", lambda: -1)
+    assert get_session("lookaside") is not session
+
+
+def test_get_client():
+    first = get_client("src-git", ("url", "token"), object)
+    assert get_client("src-git", ("url", "token"), object) is first
+    # refreshed token
+    assert get_client("src-git", ("url", "new-token"), object) is not first
+
+
+def test_get_client_creates_once():
+    created = []
+    started = threading.Barrier(4)
+
+    def create():
+        created.append(threading.current_thread())
+        # let the other threads ask for the client meanwhile
+        time.sleep(0.1)
+        return object()
+
+    clients = []
+
+    def get():
+        started.wait()
+        clients.append(get_client("src-git", ("url", "token"), create))
+
+    threads = [threading.Thread(target=get) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 1
+    assert len({id(client) for client in clients}) == 1
+
+
+def test_connection_reuse_metrics(server_url):
+    session = get_session("lookaside")
+    for _ in range(3):
+        assert session.head(f"{server_url}/acl/c8s/abc").ok
+
+    assert list(sessions.connection_stats()) == [("lookaside", 3, 1)]
+    labels = {"session": "lookaside"}
+    assert REGISTRY.get_sample_value("dist2src_http_requests_total", labels) == 3
+    assert REGISTRY.get_sample_value("dist2src_http_connections_total", labels) == 1
+
+
+def test_configuration_shares_clients(monkeypatch):
+    monkeypatch.setenv("D2S_SRC_GIT_TOKEN", "token")
+    # once per token
+    flexmock(gitlab.Gitlab).should_receive("auth").twice()
+    src_git_svc = Configuration().src_git_svc
+    assert Configuration().src_git_svc is src_git_svc
+    assert Configuration().dist_git_svc is Configuration().dist_git_svc
+    assert src_git_svc.gitlab_instance.session is get_session("src-git")
+    assert Configuration().dist_git_svc.session is get_session("dist-git")
+
+    monkeypatch.setenv("D2S_SRC_GIT_TOKEN", "refreshed")
+    assert Configuration().src_git_svc is not src_git_svc
+
+
+def test_src_git_svc(tmp_path, monkeypatch):
+    """the ogr calls the worker makes work with the shared session"""
+    with FakeServices(tmp_path) as services:
+        for name, value in services.environ.items():
+            monkeypatch.setenv(name, value)
+        monkeypatch.setenv("D2S_SRC_GIT_TOKEN", "token")
+        services.add_project("acl", branches={"c8s": "a1b2"})
+        cfg = Configuration()
+
+        assert cfg.src_git_svc.user.get_username() == "packit"
+        project = cfg.src_git_svc.get_project(
+            namespace=cfg.src_git_namespace, repo="acl"
+        )
+        assert project.gitlab_repo.path_with_namespace == f"{cfg.src_git_namespace}/acl"
+        group = cfg.src_git_svc.gitlab_instance.groups.get(cfg.src_git_namespace)
+        assert group.full_path == cfg.src_git_namespace
+        adapter = get_session("src-git").get_adapter(services.src_git_url)
+
+    assert cfg.src_git_svc.gitlab_instance.session is get_session("src-git")
+    assert adapter.max_retries.total == 5
+    assert sum(path.endswith("/user") for _, path in services.requests) == 1
@@ -0,0 +1,109 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+import os
+import time
+from pathlib import Path
+
+import git
+import pytest
+from flexmock import flexmock
+
+from dist2src import core, spec_cache
+from dist2src.core import Dist2Src
+from dist2src.spec_cache import Patch, SpecCache, SpecMetadata
+
+METADATA = SpecMetadata(
+    sources=["/rpms/acl/SOURCES/acl-2.2.53.tar.gz"],
+    patches=[
+        Patch(number=1, name="0001-fix.patch", path="/rpms/acl/SOURCES/0001-fix.patch")
+    ],
+    prep=["%setup -q", "%patch1 -p1"],
+)
+
+
+@pytest.fixture()
+def spec(tmp_path: Path) -> Path:
+    spec = tmp_path / "acl" / "SPECS" / "acl.spec"
+    spec.parent.mkdir(parents=True)
+    spec.write_text("Name: acl\n%prep\n%setup -q\n%patch1 -p1\n")
+    return spec
+
+
+def test_get(tmp_path: Path, spec: Path):
+    cache = SpecCache(tmp_path / "cache")
+    parsed = []
+
+    def parse():
+        parsed.append(spec.read_text())
+        return METADATA
+
+    sources_dir = spec.parent.parent / "SOURCES"
+    assert cache.get(spec, sources_dir, parse) == METADATA
+    assert cache.get(spec, sources_dir, parse) == METADATA
+    # persisted for the next run
+    assert SpecCache(tmp_path / "cache").get(spec, sources_dir, parse) == METADATA
+    assert len(parsed) == 1
+
+    # a changed spec file is parsed again
+    spec.write_text(spec.read_text().replace("%setup -q", "%autosetup -N"))
+    cache.get(spec, sources_dir, parse)
+    # so is the same one, with a different macro environment
+    cache.get(spec, tmp_path / "SOURCES", parse)
+    assert len(parsed) == 3
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_get_invalid_entry(tmp_path: Path, spec: Path):
+    cache = SpecCache(tmp_path)
+    sources_dir = spec.parent.parent / "SOURCES"
+    cache.cache_dir.mkdir()
+    (cache.cache_dir / f"{cache.key(spec, sources_dir)}.json").write_text("{")
+
+    assert cache.get(spec, sources_dir, lambda: METADATA) == METADATA
+    assert SpecCache(tmp_path).get(spec, sources_dir, lambda: None) == METADATA
+
+
+def test_enforce_autosetup_uses_cache(tmp_path: Path, spec: Path):
+    """the spec file is parsed once, not at all when the cached %prep uses %autosetup"""
+    dist_git = spec.parent.parent
+    git.Repo.init(dist_git)
+    metadata = METADATA._replace(prep=["%autosetup -p1"])
+    patch = flexmock(index=1, path=Path(metadata.patches[0].path))
+    patch.should_receive("get_patch_name").and_return("0001-fix.patch")
+    flexmock(core).should_receive("Specfile").and_return(
+        flexmock(
+            get_sources=lambda: metadata.sources,
+            get_patches=lambda: [patch],
+            spec_content=flexmock(section=lambda name: metadata.prep),
+        )
+    ).once()
+
+    d2s = Dist2Src(dist_git, None, spec_cache=SpecCache(tmp_path / "cache"))
+    d2s._enforce_autosetup()
+    assert d2s.spec_metadata == metadata
+    Dist2Src(
+        dist_git, None, spec_cache=SpecCache(tmp_path / "cache")
+    )._enforce_autosetup()
+
+
+def test_prune(tmp_path: Path, spec: Path, monkeypatch):
+    sources_dir = spec.parent.parent / "SOURCES"
+    SpecCache(tmp_path).get(spec, sources_dir, lambda: METADATA)
+    cache_dir = tmp_path / "specs"
+    used, unused = cache_dir / f"{SpecCache.key(spec, sources_dir)}.json", []
+    for name in ("old.json", "interrupted.tmp"):
+        (cache_dir / name).write_text("{}")
+        unused.append(cache_dir / name)
+    month_ago = time.time() - 31 * 24 * 3600
+    for path in [used] + unused:
+        os.utime(path, (month_ago, month_ago))
+    # used by this process, not pruned again
+    SpecCache(tmp_path).get(spec, sources_dir, lambda: None)
+    assert all(path.exists() for path in unused)
+
+    monkeypatch.setattr(spec_cache, "_pruned", set())
+    SpecCache(tmp_path)
+    assert not any(path.exists() for path in unused)
+    # it was used again
+    assert used.exists()
@@ -2,16 +2,33 @@
 # SPDX-License-Identifier: MIT
 
 import os
+import subprocess
+import time
+from pathlib import Path
 
 from flexmock import flexmock
+from gitlab import GitlabGetError
 
 from dist2src.constants import GITLAB_SRC_NAMESPACE
 from dist2src.worker import sentry
+from dist2src.worker import updater as updater_module
 from dist2src.worker.celerizer import celery_app
 from dist2src.worker.monitoring import Pushgateway
 from dist2src.worker.updater import Updater
 
 
+def tags_api(tags):
+    """a GitLab project with 'tags', only the watched ones can be looked up"""
+
+    def get(name):
+        assert name.startswith(("convert/c8/", "convert/c8s/"))
+        if name not in tags:
+            raise GitlabGetError("404 Tag Not Found", response_code=404)
+        return flexmock(name=name)
+
+    return flexmock(tags=flexmock(get=get, list=None))
+
+
 def test_get_out_of_date_branches():
     """
     Dist-git branches for which there is no git tag in their source-git
@@ -27,6 +44,7 @@ def test_get_out_of_date_branches():
         src_git_svc=src_git_svc,
         dist_git_namespace="rpms",
         src_git_namespace=GITLAB_SRC_NAMESPACE,
+        out_of_date_backend="api",
     )
     dist_git_branches = {
         "branches": {
@@ -37,11 +55,11 @@ def test_get_out_of_date_branches():
         "total_branches": 10,
     }
     src_git_tags = [
-        flexmock(name="c8-source-git"),
-        flexmock(name="c8s-source-git"),
-        flexmock(name="convert/c8/043c57dad5c7665b0cdb553e561dc55b3c676999"),
-        flexmock(name="convert/c8s/09f7b3ee8f059266b461159dd91056a573365bee"),
-        flexmock(name="sg-start"),
+        "c8-source-git",
+        "c8s-source-git",
+        "convert/c8/043c57dad5c7665b0cdb553e561dc55b3c676999",
+        "convert/c8s/09f7b3ee8f059266b461159dd91056a573365bee",
+        "sg-start",
     ]
     (
         dist_git_svc.should_receive("call_api")
@@ -52,11 +70,11 @@ def test_get_out_of_date_branches():
         .and_return(dist_git_branches)
         .once()
     )
-    src_git_project = flexmock(repo=project_name)
+    src_git_project = flexmock(repo=project_name, gitlab_repo=tags_api(src_git_tags))
     src_git_svc.should_receive("get_project").with_args(
         repo=project_name, namespace=GITLAB_SRC_NAMESPACE
     ).and_return(src_git_project)
-    src_git_project.should_receive("get_tags").and_return(src_git_tags).once()
+    src_git_project.should_receive("get_tags").never()
 
     out_of_date_branches = sorted(
         Updater(configuration=config)._get_out_of_date_branches(project_name)
@@ -64,6 +82,98 @@ def test_get_out_of_date_branches():
     assert out_of_date_branches == [("c8", "fa4074d481e8088a1b9167f1b3d2318dd29604a0")]
 
 
+def create_bare_repo(path: Path, branches=(), tags=()) -> dict:
+    """
+    create a bare repo at 'path' with the branches and lightweight tags
+    specified, return {branch: commit}
+    """
+    work = path.with_name(f"{path.name}-work")
+    subprocess.check_call(["git", "init", "-q", str(work)])
+    subprocess.check_call(
+        [
+            "git",
+            "-c",
+            "user.name=Test",
+            "-c",
+            "user.email=test@example.com",
+            "commit",
+            "-q",
+            "--allow-empty",
+            "-m",
+            "Initial commit",
+        ],
+        cwd=work,
+    )
+    heads = {}
+    for branch in branches:
+        subprocess.check_call(["git", "branch", "-f", branch], cwd=work)
+        heads[branch] = (
+            subprocess.check_output(["git", "rev-parse", branch], cwd=work)
+            .decode()
+            .strip()
+        )
+    for tag in tags:
+        subprocess.check_call(["git", "tag", tag], cwd=work)
+    subprocess.check_call(["git", "clone", "-q", "--bare", str(work), str(path)])
+    return heads
+
+
+def test_get_out_of_date_branches_from_git(tmp_path: Path):
+    """
+    With the 'git' backend, dist-git branches and source-git tags are
+    obtained using 'git ls-remote', without calling the forge APIs.
+    """
+    dist_git_heads = create_bare_repo(
+        tmp_path / "rpms" / "rsync.git", branches=["c4", "c8", "c8s"]
+    )
+    create_bare_repo(
+        tmp_path / "src" / "rsync.git",
+        tags=[
+            "c8-source-git",
+            "convert/c8/043c57dad5c7665b0cdb553e561dc55b3c676999",
+            f"convert/c8s/{dist_git_heads['c8s']}",
+        ],
+    )
+    config = flexmock(
+        branches_watched=["c8", "c8s"],
+        dist_git_svc=flexmock(),
+        src_git_svc=flexmock(),
+        out_of_date_backend="git",
+    )
+    config.dist_git_svc.should_receive("call_api").never()
+    config.src_git_svc.should_receive("get_project").never()
+    updater = Updater(configuration=config)
+    flexmock(updater).should_receive("_dist_git_url").with_args("rsync").and_return(
+        str(tmp_path / "rpms" / "rsync.git")
+    )
+    flexmock(updater).should_receive("_src_git_url").with_args("rsync").and_return(
+        str(tmp_path / "src" / "rsync.git")
+    )
+
+    assert updater._get_out_of_date_branches("rsync") == [("c8", dist_git_heads["c8"])]
+    assert updater._get_out_of_date_branches("rsync", "c8s") == []
+
+
+def test_get_out_of_date_branches_from_git_no_src_git(tmp_path: Path):
+    """
+    When the source-git repo does not exist, all the watched branches
+    are out of date.
+    """
+    dist_git_heads = create_bare_repo(tmp_path / "rpms" / "rsync.git", branches=["c8s"])
+    config = flexmock(branches_watched=["c8", "c8s"], out_of_date_backend="git")
+    updater = Updater(configuration=config)
+    flexmock(updater).should_receive("_dist_git_url").and_return(
+        str(tmp_path / "rpms" / "rsync.git")
+    )
+    flexmock(updater).should_receive("_src_git_url").and_return(
+        str(tmp_path / "src" / "rsync.git")
+    )
+
+    assert updater._get_out_of_date_branches("rsync") == [
+        ("c8s", dist_git_heads["c8s"])
+    ]
+
+
 def test_no_celery_task():
     """
     If the 'CELERY_TASK_NAME' env var is not set, not tasks are sent to the
@@ -103,19 +213,33 @@ def test_create_celery_task():
         "branch": "c8s",
         "end_commit": "end_commit",
     }
+    flexmock(time).should_receive("time").and_return(1600000000.0)
+    # scheduled tasks go to their own queue
     (
         flexmock(celery_app)
         .should_receive("send_task")
         .with_args(
             name="task.dist2src.process_message",
             expires=3600,
-            kwargs={"event": payload},
+            kwargs={
+                "event": payload,
+                "routed": True,
+                "lane": "scheduled",
+                "queued_at": 1600000000.0,
+            },
+            queue="dist2src-scheduled",
         )
         .and_return(flexmock(id="task_uuid"))
         .once()
     )
     flexmock(Pushgateway).should_receive("push_created_update_task").once()
-    updater = Updater(configuration=flexmock(update_task_expires=3600))
+    updater = Updater(
+        configuration=flexmock(
+            update_task_expires=3600,
+            task_routing=False,
+            scheduled_queue_prefix="dist2src",
+        )
+    )
     updater._create_task(
         flexmock(
             full_repo_name=payload["repo"]["fullname"], repo=payload["repo"]["name"]
@@ -125,10 +249,38 @@ def test_create_celery_task():
     )
 
 
+def test_create_celery_task_for_several_branches(monkeypatch):
+    """
+    The out-of-date branches of a project are updated by a single task.
+    """
+    monkeypatch.setenv("CELERY_TASK_NAME", "task.dist2src.process_message")
+    flexmock(Pushgateway).should_receive("push_created_update_task").once()
+    flexmock(updater_module).should_receive("send_update_task").with_args(
+        object,
+        "task.dist2src.process_message",
+        {
+            "repo": {"fullname": "rpms/rsync", "name": "rsync"},
+            "branch": "c8",
+            "end_commit": "abc",
+            "branches": {"c8": "abc", "c8s": "def"},
+        },
+        expires=3600,
+        lane="scheduled",
+    ).and_return(flexmock(id="task_uuid")).once()
+
+    updater = Updater(configuration=flexmock(update_task_expires=3600))
+    updater._create_task(
+        flexmock(full_repo_name="rpms/rsync", repo="rsync"),
+        "c8",
+        "abc",
+        branches={"c8": "abc", "c8s": "def"},
+    )
+
+
 def test_check_updates():
     """
     Each project in the source-git namespace is checked whether is up to date.
-    A Celery task is created for each out-of-date branch in these projects.
+    A Celery task is created for the out-of-date branches of these projects.
     """
     gitlab_groups = flexmock()
     gitlab_instance = flexmock(groups=gitlab_groups)
@@ -145,24 +297,40 @@ def test_check_updates():
         branches_watched=["c8", "c8s"],
         update_task_expires=3600,
     )
-    gitlab_projects = flexmock()
+    gitlab_instance = flexmock()
+    gitlab_projects = flexmock(gitlab=gitlab_instance, path="/groups/42/projects")
     src_gitlab_group = flexmock(projects=gitlab_projects)
     gitlab_groups.should_receive("get").and_return(src_gitlab_group)
-    gitlab_projects.should_receive("list").with_args(page=1, per_page=100).and_return(
-        [
-            flexmock(name="acl"),
-            flexmock(name="rsync"),
-        ]
+    # projects are retrieved using keyset pagination, until there is a 'next' page
+    (
+        gitlab_instance.should_receive("http_request")
+        .with_args(
+            "get",
+            "/groups/42/projects",
+            query_data={
+                "pagination": "keyset",
+                "order_by": "id",
+                "sort": "asc",
+                "per_page": 100,
+                "simple": True,
+            },
+        )
+        .and_return(
+            flexmock(
+                links={"next": {"url": "https://gitlab.com/page2"}},
+                json=lambda: [{"name": "acl"}, {"name": "rsync"}],
+            )
+        )
+        .once()
     )
     src_project_rsync = flexmock(repo="rsync")
-    gitlab_projects.should_receive("list").with_args(page=2, per_page=100).and_return(
-        [
-            flexmock(name="kernel"),
-            flexmock(name="systemd"),
-        ]
-    )
-    gitlab_projects.should_receive("list").with_args(page=3, per_page=100).and_return(
-        []
+    (
+        gitlab_instance.should_receive("http_request")
+        .with_args("get", "https://gitlab.com/page2")
+        .and_return(
+            flexmock(links={}, json=lambda: [{"name": "kernel"}, {"name": "systemd"}])
+        )
+        .once()
     )
     src_git_svc.should_receive("get_project").with_args(
         repo="acl", namespace=GITLAB_SRC_NAMESPACE
@@ -177,7 +345,6 @@ def test_check_updates():
         repo="systemd", namespace=GITLAB_SRC_NAMESPACE
     ).and_return(flexmock(repo="systemd"))
     flexmock(sentry).should_receive("configure_sentry").once()
-    # projects are retrieved until there is a 'next' page
     dist_project_rsync = flexmock()
     dist_git_projects = {
         "acl": flexmock(),
@@ -211,7 +378,7 @@ def test_check_updates():
     )
     # tasks are only created for out-of-date projects
     flexmock(Updater).should_receive("_create_task").with_args(
-        dist_project_rsync, "c8s", "commit_hash"
+        dist_project_rsync, "c8s", "commit_hash", branches={"c8s": "commit_hash"}
     ).once()
     # source-git repos without a dist-git counterpart are monitored
     flexmock(Pushgateway).should_receive("push_found_missing_dist_git_repo").once()
@@ -221,3 +388,43 @@ def test_check_updates():
     ).once()
 
     Updater(configuration=config).check_updates()
+
+
+def test_iter_project_names_in_group_from_cursor():
+    """
+    Checking the projects can be resumed from a saved cursor,
+    and the cursor of the page being checked is available.
+    """
+    gitlab_instance = flexmock()
+    gitlab_group = flexmock(
+        projects=flexmock(gitlab=gitlab_instance, path="/groups/42/projects")
+    )
+    (
+        gitlab_instance.should_receive("http_request")
+        .with_args("get", "https://gitlab.com/page2")
+        .and_return(
+            flexmock(
+                links={"next": {"url": "https://gitlab.com/page3"}},
+                json=lambda: [{"name": "kernel"}],
+            )
+        )
+        .once()
+    )
+    (
+        gitlab_instance.should_receive("http_request")
+        .with_args("get", "https://gitlab.com/page3")
+        .and_return(flexmock(links={}, json=lambda: [{"name": "systemd"}]))
+        .once()
+    )
+
+    updater = Updater(configuration=flexmock())
+    seen = []
+    for name in updater._iter_project_names_in_group(
+        gitlab_group, cursor="https://gitlab.com/page2"
+    ):
+        seen.append((name, updater.cursor))
+    assert seen == [
+        ("kernel", "https://gitlab.com/page2"),
+        ("systemd", "https://gitlab.com/page3"),
+    ]
+    assert updater.cursor is None